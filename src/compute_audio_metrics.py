@@ -0,0 +1,74 @@
+"""Compute per-recording audio quality metrics and dump them into a single CSV file.
+
+The metrics describe the recordings themselves: by default, the raw channel files read
+by `filter_audio.py`. `--input-dir filtered/` measures the filtered recordings instead
+(their 70-800 Hz band energy ratio is then close to 1 by construction).
+"""
+
+import argparse
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from tqdm import tqdm
+
+import filter_audio
+
+from utils import instrumentation
+from utils.audio import list_audio_files
+from utils.audio_metrics import METRICS_COLUMNS, compute_file_metrics
+from utils.general import dump_to_csv
+
+
+INPUT_DIR = filter_audio.SEPARATED_CHANNELS_DIR
+OUTPUT_PATH = "metrics/audio_metrics.csv"
+
+# Number of worker processes (None: one per CPU)
+N_WORKERS = None
+# Number of files sent to a worker at once
+CHUNK_SIZE = 16
+
+
+def process_metrics(input_dir=INPUT_DIR):
+    """Compute quality metrics of the recordings in `input_dir`."""
+    wav_paths = list_recordings(input_dir)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=N_WORKERS) as executor:
+        results = executor.map(compute_file_metrics, wav_paths, chunksize=CHUNK_SIZE)
+        rows = list(tqdm(results, total=len(wav_paths)))
+    elapsed = time.perf_counter() - start
+
+    dump_to_csv(OUTPUT_PATH, rows, METRICS_COLUMNS)
+
+    # Report the throughput
+    size_mb = sum(os.path.getsize(path) for path in wav_paths) / 1e6
+    print(f"Processed {len(wav_paths)} files ({size_mb:.1f} MB) in {elapsed:.2f} s")
+    if elapsed > 0:
+        print(f"Throughput: {len(wav_paths) / elapsed:.1f} files/s, {size_mb / elapsed:.1f} MB/s")
+
+
+def list_recordings(input_dir):
+    """List the recordings below `input_dir`, sorted by path.
+
+    Of the raw tree, these are the channel files read by `filter_audio` (of the `input`
+    directories, channel 1 only with `filter_audio.ONLY_CH1`); of any other directory,
+    all WAV and FLAC files.
+    """
+    if os.path.normpath(input_dir) != os.path.normpath(filter_audio.SEPARATED_CHANNELS_DIR):
+        return list_audio_files(input_dir)
+    return [
+        path for path in list_audio_files(input_dir)
+        if filter_audio.is_input_dir(os.path.dirname(path)) and filter_audio.is_wav(path) and filter_audio.is_ch1(path)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input-dir", default=INPUT_DIR, help=f"directory of the measured recordings (default: {INPUT_DIR})")
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    instrumentation.run(partial(process_metrics, args.input_dir), "compute_audio_metrics", args)
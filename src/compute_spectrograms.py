@@ -0,0 +1,76 @@
+"""Compute log-mel spectrograms of the filtered recordings and store them in a feature cache.
+
+The cache is an array store (see `utils.array_store`) with one entry per recording,
+indexed by encounter and auscultation location (from `locations.json`):
+
+    reader = ArrayStoreReader("features/log_mel/")
+    for position in reader.group_by("encounter", "location")[(encounter, location)]:
+        log_mel = reader[position]  # (n_windows, n_mels) view, no decoding
+"""
+
+import argparse
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+from utils import archive_fs, instrumentation
+from utils.array_store import ArrayStoreWriter
+from utils.audio import list_audio_files, read_audio, recording_filename
+from utils.features import HOP_LENGTH, N_FFT, N_MELS, log_mel_spectrogram
+from utils.general import read_encounter_locations
+
+
+SEPARATED_CHANNELS_DIR = "raw_data--anonymised/"
+INPUT_DIR = "filtered/"
+OUTPUT_DIR = "features/log_mel/"
+
+# Data type of the stored features
+FEATURE_DTYPE = "float16"
+
+# Number of worker processes (None: one per CPU)
+N_WORKERS = None
+CHUNK_SIZE = 8
+
+
+def process_spectrograms():
+    """Compute log-mel spectrograms of all WAV and FLAC files in `INPUT_DIR`."""
+    wav_paths = list_audio_files(INPUT_DIR)
+    metadata = {"n_fft": N_FFT, "hop_length": HOP_LENGTH, "n_mels": N_MELS}
+
+    with ArrayStoreWriter(OUTPUT_DIR, dtype=FEATURE_DTYPE, metadata=metadata) as store:
+        with ProcessPoolExecutor(max_workers=N_WORKERS) as executor:
+            results = executor.map(compute_file_spectrogram, wav_paths, chunksize=CHUNK_SIZE)
+
+            for wav_path, (log_mel, sample_rate) in tqdm(zip(wav_paths, results), total=len(wav_paths)):
+                encounter = os.path.dirname(os.path.relpath(wav_path, INPUT_DIR))
+                filename = recording_filename(wav_path)
+                store.append(
+                    log_mel,
+                    encounter=encounter,
+                    filename=filename,
+                    location=get_auscultation_location(encounter, filename),
+                    sample_rate=sample_rate,
+                )
+
+
+def compute_file_spectrogram(wav_path):
+    """Compute the log-mel spectrogram of a WAV or FLAC file."""
+    samples, sample_rate = read_audio(wav_path)
+    return log_mel_spectrogram(samples, sample_rate), sample_rate
+
+
+def get_auscultation_location(encounter, filename):
+    """Get the auscultation location code of a recording from the encounter `locations.json`."""
+    return read_encounter_locations(os.path.join(SEPARATED_CHANNELS_DIR, encounter)).get(filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+
+    instrumentation.run(process_spectrograms, "compute_spectrograms", args)
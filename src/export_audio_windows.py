@@ -0,0 +1,93 @@
+"""Export the filtered recordings as fixed-length, overlapping windows for model training.
+
+The windows are written as 16-bit PCM into an array store (see `utils.array_store`)
+with one entry of shape (n_windows, window_length, channels) per recording. Each
+entry is labelled with the auscultation location (from `locations.json`) and the
+disease flags of the encounter (from the patient XML file):
+
+    reader = ArrayStoreReader("windows/")
+    for position, entry in enumerate(reader.entries):
+        windows = reader[position]  # memory-mapped view, no decoding
+        labels = entry["location"], [entry[flag] for flag in DISEASE_FLAGS]
+"""
+
+import argparse
+import os
+
+from functools import lru_cache
+
+import numpy as np
+
+from tqdm import tqdm
+
+from utils import archive_fs, instrumentation
+from utils.archive_fs import get_filesystem
+from utils.array_store import ArrayStoreWriter
+from utils.audio import frame_signal, list_audio_files, open_audio, pcm_to_float, recording_filename
+from utils.general import read_encounter_locations
+from utils.xml_processing import DISEASE_FLAGS, obtain_row_dict
+
+
+SEPARATED_CHANNELS_DIR = "raw_data--anonymised/"
+INPUT_DIR = "filtered/"
+OUTPUT_DIR = "windows/"
+
+# Window length and hop (in seconds)
+WINDOW_S = 4.0
+HOP_S = 2.0
+
+# Size after which a new shard is started
+SHARD_SIZE_MB = 512
+
+
+def process_windows():
+    """Slice all WAV and FLAC files in `INPUT_DIR` into windows and write them into shards."""
+    wav_paths = list_audio_files(INPUT_DIR)
+    metadata = {"window_s": WINDOW_S, "hop_s": HOP_S, "disease_flags": DISEASE_FLAGS}
+
+    with ArrayStoreWriter(OUTPUT_DIR, dtype="int16", shard_size_mb=SHARD_SIZE_MB, metadata=metadata) as store:
+        for wav_path in tqdm(wav_paths):
+            samples, info = open_audio(wav_path)
+            if samples.dtype != np.int16:
+                samples = np.round(pcm_to_float(samples) * 32767).astype(np.int16)
+
+            # Views of the memory-mapped samples, copied only when written into the shard
+            windows = frame_signal(samples, round(WINDOW_S * info.sample_rate), round(HOP_S * info.sample_rate))
+            if len(windows) == 0:
+                continue
+
+            encounter = os.path.dirname(os.path.relpath(wav_path, INPUT_DIR))
+            filename = recording_filename(wav_path)
+            raw_encounter_dir = os.path.join(SEPARATED_CHANNELS_DIR, encounter)
+            store.append(
+                windows,
+                encounter=encounter,
+                filename=filename,
+                sample_rate=info.sample_rate,
+                location=read_encounter_locations(raw_encounter_dir).get(filename),
+                **get_disease_labels(os.path.dirname(raw_encounter_dir)),
+            )
+
+
+@lru_cache(maxsize=1024)
+def get_disease_labels(patient_dir):
+    """Get the disease flags (0/1) of a patient from the XML file in `patient_dir`.
+
+    Missing XML files give no labels (all flags are None).
+    """
+    xml_paths = sorted(get_filesystem().glob(os.path.join(patient_dir, "*.xml")))
+    if xml_paths == []:
+        return {flag: None for flag in DISEASE_FLAGS}
+
+    long_data_row = obtain_row_dict(xml_paths[0])
+    return {flag: int(bool(long_data_row.get(flag))) for flag in DISEASE_FLAGS}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+
+    instrumentation.run(process_windows, "export_audio_windows", args)
@@ -1,6 +1,23 @@
-import glob
-import os
+"""Export the XML files and audio recordings as FHIR bundles."""
 
+import argparse
+import os
+import sys
+
+from collections import namedtuple
+from contextlib import ExitStack, nullcontext
+
+from utils import archive_fs, instrumentation, sharding
+from utils.archive_fs import get_filesystem
+from utils.async_writer import BackgroundWriter
+from utils.compact import CompactTable
+from utils.fhir_delta import DELTA_DIR, FINGERPRINTS_PATH, FHIRDelta
+from utils.fhir_store import FHIRStore
+from utils.fhir_upload import BundleUploader, FHIRClient
+from utils.instrumentation import count, timer
+from utils.observations import build_observations
+from utils.query import Dataset
+from utils.questionnaires import build_questionnaire_responses
 from utils.general import dump_json_to_file, read_json_from_file
 from utils.fhir import get_patient, get_encounter, get_bundle
 from utils.fhir import age_group_observation
@@ -9,11 +26,8 @@ from utils.fhir import body_temperature_observation, weight_observation
 from utils.fhir import respiratory_rate_observation, respiratory_rate_30s_observation
 from utils.fhir import pulse_oximetry_observation, spirometry_fev1prcnt_observation
 from utils.fhir import auscultation_sound_media
-from utils.fhir import patient_history_questionnaire_response
-from utils.fhir import background_disease_questionnaire_response
-from utils.fhir import change_in_care_questionnaire_response
-from utils.fhir import current_condition_questionnaire_response
 from utils.xml_processing import obtain_row_dict
+from utils.xml_schema import check_xml_schema
 
 
 COUNTRY_CODES = {
@@ -32,87 +46,171 @@ GENDER_CORRECT = [
     None,
 ]
 
-BREATHLESSNESS_CODES = {
-    None: None,
-    0: ("ph-breathlessness-0", "I only get breathless when I do strenuous exercise"),
-    1: ("ph-breathlessness-1", "I get short of breath when hurrying on the level or walking up a slight hil"),
-    2: ("ph-breathlessness-2", "On level ground I walk slower than people of the same age because of breathlessness or have to stop for breath w),n walking at my own pace"),
-    3: ("ph-breathlessness-3", "I stop for breath after walking about 100 yards or after a few minutes on the level ground"),
-    4: ("ph-breathlessness-4", "I am too breathless to leave the house or get out of breath when dressing or undressing"),
-}
+XML_FAMILIES = [
+    "raw_data--anonymised/28-11-2022/*/Data/input/*/*.xml",  # Horizon
+    # "raw_data--anonymised/16-03-2022/*/Data/input/*/*.xml",  # Sanolla
+]
 
-SMOKING_HABIT_CODES = {
-    None: None,
-    0: ("ph-smoking-0", "Never"),
-    1: ("ph-smoking-1", "Ex-smoker"),
-    2: ("ph-smoking-2", "Current smoker"),
-}
+# Write the bundles in background threads (overlaps the writes with building the next bundles)
+BACKGROUND_WRITES = True
+# fsync policy of the background writes ("never", "file" or "flush")
+FSYNC = "never"
+
+# Base URL of a FHIR server to upload the resources to (None: no upload, see `utils.fhir_upload`)
+UPLOAD_URL = None
+# Number of resources per uploaded bundle
+UPLOAD_BUNDLE_SIZE = 100
+# Type of the uploaded bundles ("transaction" or "batch")
+UPLOAD_BUNDLE_TYPE = "transaction"
+# Number of concurrent uploads (and pooled keep-alive connections)
+UPLOAD_CONNECTIONS = 4
+# Write the bundles to files (can be disabled when uploading)
+WRITE_FILES = True
+# Export only the resources which changed since the last delta export (see `utils.fhir_delta`)
+DELTA_EXPORT = False
+# Create the observations of all XML files of a family in one columnar sweep (see `utils.observations`)
+BATCH_OBSERVATIONS = False
+# Keep the rows of a family in a `CompactTable` instead of a list of dicts (with `BATCH_OBSERVATIONS`)
+COMPACT_ROWS = False
+# Path to a SQLite store to add all resources to (None: no store, see `utils.fhir_store`)
+STORE_PATH = None
+
+# Optional destinations of the resources besides the bundle files (None if not used)
+Sinks = namedtuple("Sinks", ["uploader", "delta", "store"], defaults=[None, None, None])
+
+
+def process_to_fhir(upload_url=UPLOAD_URL, write_files=WRITE_FILES, delta_export=DELTA_EXPORT, store_path=STORE_PATH):
+    """Process all XML files and audio recordings to FHIR bundles.
 
-PARTICIPATION_CODES = {
-    None: None,
-    0: ("pp-0", "Continue participation"),
-    1: ("pp-1", "Intensive care with future return"),
-    2: ("pp-2", "Intensive care - discontinued"),
-    3: ("pp-3", "Personal request - discontinued"),
-    4: ("pp-4", "End of trial"),
-    5: ("pp-5", "Other"),
-}
+    Args:
+        upload_url (str): base URL of a FHIR server to upload the resources to (None: no upload)
+        write_files (bool): write the bundles to files
+        delta_export (bool): write (and upload) only the new, changed and deleted resources
+        store_path (str): path to a SQLite store to add all resources to (None: no store)
 
+    With `--shard`, only the patients of the shard are exported, and the delta and the
+    store are kept per shard (see `utils.sharding`).
+    """
+    with ExitStack() as stack:
+        # Entered first so that the fingerprints are only saved once all changes were uploaded
+        delta = None
+        if delta_export:
+            delta_dir = sharding.shard_path(DELTA_DIR)
+            delta = FHIRDelta(delta_dir, os.path.join(delta_dir, os.path.relpath(FINGERPRINTS_PATH, DELTA_DIR)))
+            stack.enter_context(delta)
+        uploader = None
+        if upload_url:
+            client = FHIRClient(upload_url, n_connections=UPLOAD_CONNECTIONS)
+            uploader = BundleUploader(client, UPLOAD_BUNDLE_SIZE, UPLOAD_BUNDLE_TYPE, n_threads=UPLOAD_CONNECTIONS)
+            stack.enter_context(uploader)
+        store = stack.enter_context(FHIRStore(sharding.shard_path(store_path))) if store_path else None
+        sinks = Sinks(uploader, delta, store)
+
+        writer = stack.enter_context(
+            BackgroundWriter(fsync=FSYNC) if BACKGROUND_WRITES and write_files else nullcontext()
+        )
+        for xml_path_format in XML_FAMILIES:
+            with timer("glob"):
+                all_xml_files = sharding.select(get_filesystem().glob(xml_path_format))
+
+            rows, observations = [None] * len(all_xml_files), [None] * len(all_xml_files)
+            if BATCH_OBSERVATIONS:
+                if COMPACT_ROWS:
+                    rows = CompactTable(obtain_row_dict(single_file) for single_file in all_xml_files)
+                    dataset = Dataset.from_table(rows)
+                else:
+                    rows = [obtain_row_dict(single_file) for single_file in all_xml_files]
+                    dataset = Dataset.from_rows(rows)
+                with timer("build_observations"):
+                    observations = build_observations(dataset)
+
+            for single_file, row, row_observations in zip(all_xml_files, rows, observations):
+                with timer("process_file", path=single_file):
+                    process_file(single_file, writer, sinks, write_files, row, row_observations)
+
+        if delta is not None and uploader is not None:
+            for key in delta.deleted():
+                uploader.delete(key)
+
+    if delta is not None:
+        delta.print_report()
+    if uploader is not None:
+        uploader.print_report()
+
+
+def check_schema():
+    """Scan all XML files before the export (see `utils.xml_schema`).
+
+    Besides the categorical and numeric fields, the countries and genders must be
+    known (`COUNTRY_CODES`, `GENDER_CORRECT`).
+    """
+    allowed_values = {
+        "Country": [country.lower() for country in COUNTRY_CODES if country],
+        "Gender": [gender for gender in GENDER_CORRECT if gender],
+    }
+    fs = get_filesystem()
+    xml_paths = sorted({path for xml_path_format in XML_FAMILIES for path in sharding.select(fs.glob(xml_path_format))})
+    return check_xml_schema(xml_paths, allowed_values)
 
-COUGHING_CODES = {
-    None: None,
-    0: ("cc-coughing-0", "Normal or better"),
-    1: ("cc-coughing-1", "Somewhat worse than normal"),
-    2: ("cc-coughing-2", "Much worse than normal"),
-}
 
-FATIGUE_CODES = {
-    None: None,
-    0: ("cc-fatigue-0", "Normal or better"),
-    1: ("cc-fatigue-1", "Somewhat worse than normal"),
-    2: ("cc-fatigue-2", "Much worse than normal"),
-}
+def process_file(single_file, writer=None, sinks=Sinks(), write_files=True, long_data_row=None, observations=None):
+    """Process a single XML file and the audio recordings of the patient to FHIR bundles.
 
-SOB_CODES= {
-    None: None,
-    0: ("cc-sob-0", "Normal or better"),
-    1: ("cc-sob-1", "Somewhat worse than normal"),
-    2: ("cc-sob-2", "Much worse than normal"),
-}
+    The bundles are written to files (by `writer` if given) and/or passed to the `sinks`
+    (see `export_bundle`). The row of the file and its observations are created unless given.
+    """
+    if long_data_row is None:
+        long_data_row = obtain_row_dict(single_file)
+
+    with timer("glob"):
+        recordings = os.path.join(os.path.dirname(single_file), "*/locations.json")
+        locations_paths = get_filesystem().glob(recordings)
+
+    # Generate FHIR bundles (construction of the `fhir.resources` models)
+    with timer("process_entry"):
+        tabular_bundle, patient_id, encounter_loc_id = process_entry(long_data_row, observations)
+    export_bundle(tabular_bundle, encounter_loc_id, sinks)
+    # Dump FHIR bundle to file
+    if write_files:
+        dump_path = os.path.dirname(single_file).replace("raw_data", "fhir")
+        dump_path = os.path.join(dump_path, "encounter_bundle.json")
+        os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+        with timer("Bundle.json"):
+            bundle_json = tabular_bundle.json(indent=4)
+        dump_json_to_file(dump_path, bundle_json, writer)
+    count("encounter_bundles")
 
+    # Generate FHIR bundles for audio recordings and dump to file
+    _ = process_locations(locations_paths, patient_id, encounter_loc_id, writer, sinks, write_files)
 
-XML_FAMILIES = [
-    "raw_data--anonymised/28-11-2022/*/Data/input/*/*.xml",  # Horizon
-    # "raw_data--anonymised/16-03-2022/*/Data/input/*/*.xml",  # Sanolla
-]
 
+def export_bundle(bundle, encounter_id, sinks):
+    """Pass the resources of a bundle to the sinks.
 
-def process_to_fhir():
-    """Process all XML files and audio recordings to FHIR bundles.
+    All resources are added to the store; with the delta export, only the new and
+    changed resources are uploaded.
     """
-    for xml_path_format in XML_FAMILIES:
-        all_xml_files = glob.glob(xml_path_format)
+    if sinks.store is not None:
+        with timer("store"):
+            sinks.store.add_bundle(bundle, encounter_id)
 
-        for single_file in all_xml_files:
-            long_data_row = obtain_row_dict(single_file)
+    if sinks.delta is not None:
+        with timer("delta"):
+            resources = sinks.delta.add_bundle(bundle, encounter_id)
+    else:
+        resources = [entry.resource for entry in bundle.entry or []]
 
-            recordings = os.path.join(os.path.dirname(single_file), "*/locations.json")
-            locations_paths = glob.glob(recordings)
+    if sinks.uploader is not None:
+        with timer("upload"):
+            for resource in resources:
+                sinks.uploader.add_resource(resource, encounter_id)
 
-            # Generate FHIR bundles
-            tabular_bundle, patient_id, encounter_loc_id = process_entry(long_data_row)
-            # Dump FHIR bundle to file
-            dump_path = os.path.dirname(single_file).replace("raw_data", "fhir")
-            dump_path = os.path.join(dump_path, "encounter_bundle.json")
-            os.makedirs(os.path.dirname(dump_path), exist_ok=True)
-            dump_json_to_file(dump_path, tabular_bundle.json(indent=4))
 
-            # Generate FHIR bundles for audio recordings and dump to file
-            _ = process_locations(locations_paths, patient_id, encounter_loc_id)
+def process_entry(row_dict, observations=None):
+    """Process a single row of data from the XML file.
 
-
-def process_entry(row_dict):
-    """Process a single row of data from the XML file."""
+    The observations are created from the row unless given (see `utils.observations`).
+    """
 
     # Get patient ID
     patient_id = row_dict.get("PatientIdentifier")
@@ -151,6 +249,26 @@ def process_entry(row_dict):
     )
 
     # Collect all observations
+    if observations is None:
+        observations = get_observations(row_dict, patient_id, encounter_id)
+
+    # Collect all questionnaires (see `utils.questionnaires`)
+    questionnaires = build_questionnaire_responses(row_dict, patient_id, encounter_id, practitioner_id)
+
+    # Create tabular bundle
+    tabular_bundle = get_bundle(
+        patient,
+        encounter,
+        questionnaires,
+        observations,
+        None,
+    )
+
+    return tabular_bundle, patient_id, encounter_id
+
+
+def get_observations(row_dict, patient_id, encounter_id):
+    """Create the observations of a single row of data (see `utils.observations` for all rows at once)."""
     observations = []
 
     age_group = row_dict.get("Age")
@@ -201,108 +319,63 @@ def process_entry(row_dict):
         spirometry_fev1prcnt_obs = spirometry_fev1prcnt_observation(float(spirometry_fev1prcnt), encounter_id, patient_id)
         observations.append(spirometry_fev1prcnt_obs)
 
+    return observations
 
-    # Collect all questionnaires
-    questionnaires = []
-
-    patient_history = patient_history_questionnaire_response(
-        patient_id,
-        encounter_id,
-        practitioner_id,
-        daily_medication=row_dict.get("DailyMedication"),
-        daily_cough=row_dict.get("DailyCough"),
-        breathlessness_code_and_statement=BREATHLESSNESS_CODES[row_dict.get("Statement")],
-        smoking_habit_code_and_statement=SMOKING_HABIT_CODES[row_dict.get("SmokingHabit")],
-        average_cigarettes_per_day=row_dict.get("CigarettesPerDay"),
-        years_smoking=row_dict.get("YearsOfSmoking"),
-        disqualify_patient=row_dict.get("DisqualifyPatient"),
-    )
-    questionnaires.append(patient_history)
-
-
-    background_disease = background_disease_questionnaire_response(
-        patient_id,
-        encounter_id,
-        practitioner_id,
-        asthma=row_dict.get("Asthma"),
-        copd=row_dict.get("COPD"),
-        emphysema=row_dict.get("Emphysema"),
-        chronic_bronchitis=row_dict.get("ChronicBronchitis"),
-        lung_cancer=row_dict.get("LungCancer"),
-        hypertension=row_dict.get("Hypertension"),
-        angina_pectoris=row_dict.get("AnginaPectoris"),
-        myocardial_infarction=row_dict.get("MyocardialInfarction"),
-        heart_failure=row_dict.get("HeartFailure"),
-        diabetes=row_dict.get("Diabetes"),
-        current_respiratory_disease=row_dict.get("RespiratoryInfection"),
-        other_lung_disease=row_dict.get("LungDisease"),
-        other_cardiovascular_disease=row_dict.get("HeartDisease"),
-    )
-    questionnaires.append(background_disease)
-
-
-    change_in_care = change_in_care_questionnaire_response(
-        patient_id,
-        encounter_id,
-        practitioner_id,
-        new_increased_medication=row_dict.get("NewIncreasedMedication"),
-        patient_participation_code_and_statement=PARTICIPATION_CODES[row_dict.get("PatientParticipation")],
-    )
-    questionnaires.append(change_in_care)
-
-
-    current_condition = current_condition_questionnaire_response(
-        patient_id,
-        encounter_id,
-        practitioner_id,
-        coughing_code_and_statement=COUGHING_CODES[row_dict.get("Coughing")],
-        fatigue_code_and_statement=FATIGUE_CODES[row_dict.get("Fatigue")],
-        sob_code_and_statement=SOB_CODES[row_dict.get("ShortnessOfBreath")],
-    )
-    questionnaires.append(current_condition)
 
-    # Create tabular bundle
-    tabular_bundle = get_bundle(
-        patient,
-        encounter,
-        questionnaires,
-        observations,
-        None,
-    )
-
-    return tabular_bundle, patient_id, encounter_id
-
-
-def process_locations(locations, patient_id, encounter_id):
+def process_locations(locations, patient_id, encounter_id, writer=None, sinks=Sinks(), write_files=True):
     """Process locations.json files and create media bundles"""
     for single_file in locations:
         medias = []
 
         # Read locations.json
-        locations = read_json_from_file(single_file)
+        with timer("read_locations"):
+            locations = read_json_from_file(single_file)
         # Get directory (date) of locations.json
         directory = os.path.dirname(single_file)
 
         # Generate media resources
-        for filename, code in locations.items():
-            file_path = os.path.join(directory, filename)
-            media = auscultation_sound_media(file_path, code, encounter_id, patient_id)
-            medias.append(media)
-
-        # Create media bundle
-        media_bundle = get_bundle(
-            None,
-            None,
-            [],
-            [],
-            medias,
-        )
+        with timer("process_locations"):
+            for filename, code in locations.items():
+                file_path = os.path.join(directory, filename)
+                media = auscultation_sound_media(file_path, code, encounter_id, patient_id)
+                medias.append(media)
+
+            # Create media bundle
+            media_bundle = get_bundle(
+                None,
+                None,
+                [],
+                [],
+                medias,
+            )
+        count("media_resources", len(medias))
+        export_bundle(media_bundle, encounter_id, sinks)
 
         # Dump media bundle to file
-        dump_path = single_file.replace("raw_data", "fhir").replace("locations.json", "media_bundle.json")
-        os.makedirs(os.path.dirname(dump_path), exist_ok=True)
-        dump_json_to_file(dump_path, media_bundle.json(indent=4))
+        if write_files:
+            dump_path = single_file.replace("raw_data", "fhir").replace("locations.json", "media_bundle.json")
+            os.makedirs(os.path.dirname(dump_path), exist_ok=True)
+            with timer("Bundle.json"):
+                bundle_json = media_bundle.json(indent=4)
+            dump_json_to_file(dump_path, bundle_json, writer)
+        count("media_bundles")
 
 
 if __name__ == "__main__":
-    process_to_fhir()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--check-schema", action="store_true", help="scan all XML files first and stop if the extraction would fail")
+    parser.add_argument("--upload", metavar="URL", default=UPLOAD_URL, help="upload the resources to the FHIR server at this base URL")
+    parser.add_argument("--no-files", action="store_true", help="do not write the bundles to files (with --upload)")
+    parser.add_argument("--delta", action="store_true", default=DELTA_EXPORT, help="write (and upload) only the resources which changed since the last delta export, instead of the bundle files")
+    parser.add_argument("--store", metavar="PATH", default=STORE_PATH, help="also add all resources to a SQLite store (see utils.fhir_store)")
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    sharding.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+    sharding.configure(args)
+
+    if args.check_schema and not check_schema():
+        sys.exit(1)
+    write_files = WRITE_FILES and not args.no_files and not args.delta
+    instrumentation.run(lambda: process_to_fhir(args.upload, write_files, args.delta, args.store), sharding.shard_path("export_to_fhir"), args)
@@ -1,9 +1,15 @@
 """Extract content from XML files and dump it into a single CSV file."""
 
-import glob
+import argparse
+import sys
 
+from utils import archive_fs, instrumentation, sharding
+from utils.instrumentation import timer
+from utils.archive_fs import get_filesystem
+from utils.compact import CompactTable
 from utils.general import dump_to_csv
 from utils.xml_processing import obtain_row_dict
+from utils.xml_schema import check_xml_schema
 
 
 XML_FAMILIES = [
@@ -11,27 +17,51 @@ XML_FAMILIES = [
     ("raw_data--anonymised/16-03-2022/*/Data/input/*/*.xml", "extracted/sanolla.csv"),  # Sanolla
 ]
 
+# Keep the rows in a `CompactTable` instead of a list of dicts (less memory on large archives)
+COMPACT_ROWS = False
+
 
 def process_xml_to_csv():
     """This function takes in a set of XML files and converts them to a single CSV file.
 
     The paths to XML files are expected to be in the format of `xml_path_format`.
     The function iterates through each file and extracts the data contained in each XML tag.
-    It then writes this data to a single CSV file stored under `new_csv_dump`.
+    It then writes this data to a single CSV file stored under `new_csv_dump`
+    (one per shard with `--shard`, see `utils.sharding`).
     """
     for xml_path_format, new_csv_dump in XML_FAMILIES:
-        long_df = []
+        long_df = CompactTable() if COMPACT_ROWS else []
         csv_columns = set()
 
-        all_xml_files = glob.glob(xml_path_format)
+        with timer("glob"):
+            all_xml_files = sharding.select(get_filesystem().glob(xml_path_format))
 
         for single_file in all_xml_files:
-            long_data_row = obtain_row_dict(single_file)
+            with timer("process_file", path=single_file):
+                long_data_row = obtain_row_dict(single_file)
             long_df.append(long_data_row)
             csv_columns.update(long_data_row.keys())
 
-        dump_to_csv(new_csv_dump, long_df, sorted(csv_columns))
+        dump_to_csv(sharding.shard_path(new_csv_dump), long_df, sorted(csv_columns))
+
+
+def check_schema():
+    """Scan all XML files before the extraction (see `utils.xml_schema`)."""
+    fs = get_filesystem()
+    xml_paths = sorted({path for xml_path_format, _ in XML_FAMILIES for path in sharding.select(fs.glob(xml_path_format))})
+    return check_xml_schema(xml_paths)
 
 
 if __name__ == "__main__":
-    process_xml_to_csv()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--check-schema", action="store_true", help="scan all XML files first and stop if the extraction would fail")
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    sharding.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+    sharding.configure(args)
+
+    if args.check_schema and not check_schema():
+        sys.exit(1)
+    instrumentation.run(process_xml_to_csv, sharding.shard_path("extract_xml_to_csv"), args)
@@ -0,0 +1,109 @@
+"""Minimal FHIR server accepting transaction/batch bundles, to test the upload of `export_to_fhir`.
+
+The resources of the bundles are kept in memory (by type and id) and every bundle
+is answered with a `transaction-response`/`batch-response` bundle. Failures and
+latency can be simulated to exercise the retries of `utils.fhir_upload`:
+
+    python src/fhir_stub_server.py --port 8080 --fail-rate 0.1 --latency 0.05
+    python src/export_to_fhir.py --upload http://localhost:8080/fhir
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PORT = 8080
+
+
+class FHIRStubHandler(BaseHTTPRequestHandler):
+    """Handle POSTs of bundles to the base URL (any path)."""
+
+    # Keep-alive connections
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if server.latency:
+            time.sleep(server.latency)
+        if random.random() < server.fail_rate:
+            self._reply(503, {"resourceType": "OperationOutcome"}, {"Retry-After": "0"})
+            return
+
+        try:
+            bundle = json.loads(body)
+            bundle_type = bundle["type"]
+            if bundle.get("resourceType") != "Bundle" or bundle_type not in ("transaction", "batch"):
+                raise ValueError("Not a transaction or batch bundle")
+            entries = []
+            for entry in bundle.get("entry", []):
+                url = entry["request"]["url"]
+                if entry["request"]["method"] == "DELETE":
+                    with server.lock:
+                        server.resources.pop(tuple(url.split("/", 1)), None)
+                    entries.append({"response": {"status": "204 No Content"}})
+                    continue
+                resource = entry["resource"]
+                key = (resource["resourceType"], resource["id"])
+                if url != "/".join(key):
+                    raise ValueError(f"Request URL {url} does not match the resource")
+                with server.lock:
+                    status = "200 OK" if key in server.resources else "201 Created"
+                    server.resources[key] = resource
+                entries.append({"response": {"status": status, "location": url}})
+        except (KeyError, TypeError, ValueError) as error:
+            self._reply(400, {"resourceType": "OperationOutcome", "issue": [{"diagnostics": str(error)}]})
+            return
+
+        with server.lock:
+            server.n_bundles += 1
+        self._reply(200, {"resourceType": "Bundle", "type": bundle_type + "-response", "entry": entries})
+
+    def _reply(self, status, document, headers=None):
+        data = json.dumps(document).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/fhir+json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=PORT, fail_rate=0.0, latency=0.0):
+    """Create the stub server (call `serve_forever()` to run it)."""
+    server = ThreadingHTTPServer(("localhost", port), FHIRStubHandler)
+    server.fail_rate = fail_rate
+    server.latency = latency
+    server.resources = {}
+    server.n_bundles = 0
+    server.lock = threading.Lock()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of the requests answered with 503")
+    parser.add_argument("--latency", type=float, default=0.0, help="delay of every response in seconds")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.fail_rate, args.latency)
+    print(f"Serving on http://localhost:{args.port}/fhir")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        counts = {}
+        for resource_type, _ in server.resources:
+            counts[resource_type] = counts.get(resource_type, 0) + 1
+        print(f"Received {server.n_bundles} bundles, stored resources: {counts}")
@@ -1,12 +1,23 @@
 """Apply filtering to audio files."""
 
+import argparse
 import os
+import re
 import shutil
 
-import sox
+from contextlib import ExitStack
+
+import numpy as np
 
 from tqdm import tqdm
 
+from utils import archive_fs, instrumentation, sharding
+from utils.instrumentation import count, timer
+from utils.archive_fs import get_filesystem
+from utils.array_store import ArrayStoreWriter
+from utils.audio import AudioFileWriter, ParallelAudioWriter, float_to_pcm, open_wav, output_sample_width, pcm_to_float, read_wav_info, write_audio
+from utils.filters import FILTER_PROFILES, Resampler, SosFilter, apply_sos, profile_sos, resample
+
 
 SEPARATED_CHANNELS_DIR = "raw_data--anonymised/"
 OUTPUT_DIR = "filtered/"
@@ -14,21 +25,117 @@ OUTPUT_DIR = "filtered/"
 # Set to True to only process channel 1
 ONLY_CH1 = True
 
+# Set to True to filter all channel files of a recording together, in one NumPy batch
+# (only used when ONLY_CH1 is False)
+BATCH_CHANNELS = False
+# Set to True to write the channels filtered in a batch into one interleaved multichannel file
+# named after the recording (e.g. `10_31_07.wav`) instead of one file per channel
+INTERLEAVE_CHANNELS = False
+
+# Filter profiles (see `utils.filters.FILTER_PROFILES`) to apply; several profiles
+# are produced from a single read of each source file. The "default" profile
+# (70-800 Hz) is written to OUTPUT_DIR, any other profile to `filtered-<profile>/`.
+PROFILES = ["default"]
+
+# Sample rate (Hz) to decimate the filtered recordings to (None: keep the sample rate of the
+# source). After the lowpass of the profiles, the content above ~1 kHz is only noise, so e.g.
+# 4000 makes the files and the feature extraction several times smaller/faster for sources
+# recorded at higher rates. The lowpass cutoffs must be below the new Nyquist frequency;
+# sources at or below this rate are left as they are.
+DECIMATE_TO = None
+
+# Output mode: "files" mirrors the input tree with one WAV file per recording, "packed"
+# appends the 16-bit PCM of all recordings into large shard files of an array store
+# (see `utils.array_store`) in the output directory, indexed by encounter, filename
+# and sample rate. Packed output is always filtered in-process (NumPy/SciPy).
+OUTPUT_MODE = "files"
+# Size after which a new shard is started (packed mode)
+PACKED_SHARD_SIZE_MB = 1024
+
+# Format of the output files ("files" mode): "wav" (PCM) or "flac" (lossless, about half the size,
+# read back with `utils.audio.open_audio`). The files keep the name of the recording with the
+# extension of the format (e.g. `10_31_07_ch1.flac`).
+OUTPUT_FORMAT = "wav"
+OUTPUT_EXTENSIONS = {"wav": ".wav", "flac": ".flac"}
+# Number of threads encoding and writing the output files in parallel with the filtering
+N_WRITER_THREADS = 4
+
+# Set to a number of frames (e.g. 65536) to filter the recordings block by block in-process
+# ("files" mode): the source is memory-mapped and the output written block by block, so the
+# memory used per recording is constant whatever its length (e.g. long monitoring recordings).
+# The output is the same as that of the in-process whole-file filtering.
+STREAM_BLOCK_FRAMES = None
+
+CHANNEL_FILE_PATTERN = re.compile(r"^(?P<recording>.+)_ch(?P<channel>\d+)\.wav$")
+
 
 def process_files():
-    """Apply filtering to audio files."""
-    # Set up the output directory
-    setup_folder()
+    """Apply filtering to audio files.
+
+    With `--shard`, only the recordings of the patients of the shard are filtered: the
+    output directories are shared by the shards and not cleared, packed stores are
+    written per shard (see `utils.sharding`).
+    """
+    if OUTPUT_MODE not in ("files", "packed"):
+        raise ValueError(f"Unknown output mode: {OUTPUT_MODE}")
+    if OUTPUT_FORMAT not in OUTPUT_EXTENSIONS:
+        raise ValueError(f"Unknown output format: {OUTPUT_FORMAT}")
+    if DECIMATE_TO is not None:
+        for profile in PROFILES:
+            if FILTER_PROFILES[profile][1] >= DECIMATE_TO / 2:
+                raise ValueError(f"Lowpass cutoff of profile {profile} is not below the Nyquist frequency of DECIMATE_TO ({DECIMATE_TO} Hz)")
+
+    with ExitStack() as stack:
+        # Set up the output directories (or the packed stores, which replace them)
+        stores = None
+        writer = None
+        if OUTPUT_MODE == "packed":
+            stores = {profile: stack.enter_context(open_packed_store(profile)) for profile in PROFILES}
+        else:
+            for profile in PROFILES:
+                if sharding.get_shard() is None:
+                    setup_folder(get_output_dir(profile))
+                else:
+                    os.makedirs(get_output_dir(profile), exist_ok=True)
+            writer = stack.enter_context(ParallelAudioWriter(N_WRITER_THREADS))
+
+        filter_files(stores, writer)
+
+
+def filter_files(stores=None, writer=None):
+    """Filter all raw audio files, into `stores` (profile -> ArrayStoreWriter) if given.
 
+    The output files are written by `writer` (a `ParallelAudioWriter`) if given.
+    """
     # Count the number of files to process
-    file_count = sum(len(files) for root, _, files in os.walk(SEPARATED_CHANNELS_DIR) if "input" in root)
+    fs = get_filesystem()
+    file_count = sum(len(files) for root, _, files in fs.walk(SEPARATED_CHANNELS_DIR) if is_input_dir(root))
     # Set the progress bar
     with tqdm(total=file_count) as pbar:
 
         # Recursively walk through the raw data directory
-        for root, _, files in os.walk(SEPARATED_CHANNELS_DIR):
-            # Process only `input` directories
-            if "input" not in root:
+        for root, _, files in fs.walk(SEPARATED_CHANNELS_DIR):
+            # Process only `input` directories (of the shard)
+            if not is_input_dir(root):
+                continue
+
+            # Filter the channel files of each recording together
+            if is_batch_mode():
+                for recording, channel_files in group_channel_files(files).items():
+                    src_paths = [os.path.join(root, file) for file in channel_files]
+                    if INTERLEAVE_CHANNELS:
+                        dst_files = [recording + ".wav"]
+                    else:
+                        dst_files = channel_files
+                    dst_paths = {profile: get_dst_paths(root, dst_files, profile) for profile in PROFILES}
+                    timed = ("apply_filter_batch", os.path.join(root, recording))
+                    if STREAM_BLOCK_FRAMES is not None and stores is None:
+                        writer.submit(run_timed, timed, apply_filter_stream, src_paths, dst_paths)
+                    else:
+                        run_timed(timed, apply_filter_batch, src_paths, dst_paths, stores, writer)
+                    count("audio_files", len(src_paths))
+
+                pbar.update(len(files))
                 continue
 
             for file in files:
@@ -45,31 +152,80 @@ def process_files():
 
                 # Create the source and destination paths
                 src_path = os.path.join(root, file)
-                dst_path = src_path.replace(
-                    SEPARATED_CHANNELS_DIR,
-                    OUTPUT_DIR,
-                )
+                dst_paths = {profile: get_dst_paths(root, [file], profile) for profile in PROFILES}
+
+                # Apply filtering (in-process when several profiles share one read of the file),
+                # timed in the writer thread when submitted to `writer`
+                timed = ("apply_filter", src_path)
+                if STREAM_BLOCK_FRAMES is not None and stores is None:
+                    writer.submit(run_timed, timed, apply_filter_stream, [src_path], dst_paths)
+                elif len(PROFILES) == 1 and stores is None:
+                    if writer is None:
+                        run_timed(timed, apply_filter, src_path, dst_paths[PROFILES[0]][0], PROFILES[0])
+                    else:
+                        writer.submit(run_timed, timed, apply_filter, src_path, dst_paths[PROFILES[0]][0], PROFILES[0])
+                else:
+                    run_timed(timed, apply_filter_batch, [src_path], dst_paths, stores, writer)
+                count("audio_files")
+
+
+def run_timed(timed, function, *args):
+    """Call `function(*args)` timed as `timed` (stage, path), also from a writer thread."""
+    stage, path = timed
+    with timer(stage, path=path):
+        return function(*args)
+
 
-                # Create the destination directory if it does not exist
-                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+def get_output_dir(profile):
+    """Get the output directory of a filter profile."""
+    if profile not in FILTER_PROFILES:
+        raise ValueError(f"Unknown filter profile: {profile}")
+    if profile == "default":
+        return OUTPUT_DIR
+    return OUTPUT_DIR.rstrip("/") + f"-{profile}/"
 
-                # Apply filtering
-                apply_filter(src_path, dst_path)
 
+def get_dst_paths(root, files, profile):
+    """Create the destination directory of `root` for a filter profile and return the destination paths.
 
-def setup_folder():
+    In packed mode, the paths are relative to the output directory and name the store entries.
+    Otherwise the files get the extension of `OUTPUT_FORMAT`.
+    """
+    if OUTPUT_MODE == "packed":
+        encounter = os.path.relpath(root, SEPARATED_CHANNELS_DIR)
+        return [os.path.join(encounter, file) for file in files]
+    dst_dir = root.replace(SEPARATED_CHANNELS_DIR, get_output_dir(profile))
+    # Create the destination directory if it does not exist
+    os.makedirs(dst_dir, exist_ok=True)
+    extension = OUTPUT_EXTENSIONS[OUTPUT_FORMAT]
+    return [os.path.join(dst_dir, os.path.splitext(file)[0] + extension) for file in files]
+
+
+def open_packed_store(profile):
+    """Create the packed store of a filter profile (replacing its output directory)."""
+    highpass, lowpass = FILTER_PROFILES[profile]
+    metadata = {"profile": profile, "highpass": highpass, "lowpass": lowpass}
+    return ArrayStoreWriter(sharding.shard_path(get_output_dir(profile)), dtype="<i2", shard_size_mb=PACKED_SHARD_SIZE_MB, metadata=metadata)
+
+
+def setup_folder(output_dir=OUTPUT_DIR):
     """Set up the output directory."""
     # Remove the output directory if it exists
-    if os.path.isdir(OUTPUT_DIR):
-        shutil.rmtree(OUTPUT_DIR)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
     # Create the output directory
-    os.mkdir(OUTPUT_DIR)
+    os.mkdir(output_dir)
 
     # Verify that the output directory was created
-    if not os.path.isdir(OUTPUT_DIR):
+    if not os.path.isdir(output_dir):
         raise RuntimeError("Could not create output directory")
 
 
+def is_input_dir(root):
+    """Check if a directory is (below) an `input` directory of the processed shard."""
+    return "input" in root and sharding.in_shard(root)
+
+
 def is_wav(filespath):
     """Check if the file is a WAV file."""
     return filespath.endswith(".wav")
@@ -82,15 +238,201 @@ def is_ch1(filespath):
     return filespath.endswith("_ch1.wav")
 
 
-def apply_filter(src_path, dst_path):
-    """Apply filtering to an audio file."""
+def is_batch_mode():
+    """Check if the channel files of a recording are filtered together."""
+    return BATCH_CHANNELS and not ONLY_CH1
+
+
+def group_channel_files(files):
+    """Group the channel files (`<recording>_chN.wav`) of each recording.
+
+    Args:
+        files (list): filenames in a single directory
+
+    Returns:
+        dict: recording name -> channel filenames sorted by channel number
+    """
+    groups = {}
+    for file in files:
+        match = CHANNEL_FILE_PATTERN.match(file)
+        if match is None:
+            continue
+        groups.setdefault(match["recording"], []).append((int(match["channel"]), file))
+    return {recording: [file for _, file in sorted(channels)] for recording, channels in sorted(groups.items())}
+
+
+def apply_filter(src_path, dst_path, profile="default"):
+    """Apply filtering to an audio file (written in the format of the extension of `dst_path`)."""
+    # Imported on first use, `sox` probes for the SoX binary on import
+    import sox
+
+    highpass, lowpass = FILTER_PROFILES[profile]
     # Create the transformer
     tfm = sox.Transformer()
     # Apply the filter
-    tfm.highpass(70)
-    tfm.lowpass(800)
-    # Apply the transformer
-    tfm.build(src_path, dst_path)
+    tfm.highpass(highpass)
+    tfm.lowpass(lowpass)
+    # Decimate in the same chain (the `rate` effect is a polyphase resampler with anti-aliasing)
+    if DECIMATE_TO is not None and read_wav_info(src_path).sample_rate > DECIMATE_TO:
+        tfm.rate(DECIMATE_TO)
+    # Apply the transformer (archive members are decoded and passed to SoX as an array)
+    if os.path.isfile(src_path):
+        tfm.build(src_path, dst_path)
+    else:
+        samples, info = open_wav(src_path)
+        tfm.set_output_format(bits=8 * info.sample_width)
+        tfm.build(input_array=np.asarray(samples), sample_rate_in=info.sample_rate, output_filepath=dst_path)
+    if instrumentation.is_enabled():
+        instrumentation.add_bytes_written(os.path.getsize(dst_path))
+
+
+def apply_filter_batch(src_paths, dst_paths, stores=None, writer=None):
+    """Apply filtering to the channel files of one recording in a single NumPy batch.
+
+    The channels are read once each and stacked into a (n_frames, channels) array,
+    which is filtered with every requested profile (the same highpass and lowpass
+    filters as `apply_filter`, with coefficients designed once per sample rate),
+    and decimated to `DECIMATE_TO` if set. Channels shorter than the longest one
+    are zero-padded for filtering.
+
+    Args:
+        src_paths (list): paths to the channel files, in channel order
+        dst_paths (dict): profile -> list with one path per channel,
+            or a single path for an interleaved file
+        stores (dict): profile -> ArrayStoreWriter to append the recordings to
+            (as 16-bit PCM, `dst_paths` then name the entries) instead of writing WAV files
+        writer (ParallelAudioWriter): writer of the files (written before returning if None)
+    """
+    channels = []
+    sample_rate = None
+    sample_width = 2
+    for src_path in src_paths:
+        samples, info = open_wav(src_path)
+        if sample_rate is not None and info.sample_rate != sample_rate:
+            raise ValueError(f"Sample rate mismatch between channel files: {src_paths}")
+        sample_rate = info.sample_rate
+        sample_width = max(sample_width, output_sample_width(info.sample_width))
+        channels.append(pcm_to_float(samples[:, 0]))
+
+    lengths = [len(channel) for channel in channels]
+    batch = np.zeros((max(lengths), len(channels)), dtype=np.float32)
+    for i, channel in enumerate(channels):
+        batch[:lengths[i], i] = channel
+
+    output_rate = sample_rate
+    output_lengths = lengths
+    if DECIMATE_TO is not None and sample_rate > DECIMATE_TO:
+        output_rate = DECIMATE_TO
+        output_lengths = [-(-length * output_rate // sample_rate) for length in lengths]
+
+    for profile, profile_dst_paths in dst_paths.items():
+        filtered = apply_sos(profile_sos(profile, sample_rate), batch)
+        if output_rate != sample_rate:
+            # The decimation filter looks ahead: the end of a shorter channel is followed by zeros
+            # (as when decimated alone), not by the ringing of the filters in its padding
+            for i, length in enumerate(lengths):
+                filtered[length:, i] = 0.0
+            filtered = resample(filtered, sample_rate, output_rate)
+
+        if len(profile_dst_paths) == 1:
+            outputs = [(profile_dst_paths[0], filtered)]
+        else:
+            outputs = [(dst_path, filtered[:output_lengths[i], i:i + 1]) for i, dst_path in enumerate(profile_dst_paths)]
+
+        for dst_path, samples in outputs:
+            if stores is None:
+                if writer is None:
+                    write_audio(dst_path, samples, output_rate, sample_width)
+                else:
+                    writer.write(dst_path, samples, output_rate, sample_width)
+                continue
+            encounter, filename = os.path.split(dst_path)
+            stores[profile].append(float_to_pcm(samples), encounter=encounter, filename=filename, sample_rate=output_rate)
+
+
+def apply_filter_stream(src_paths, dst_paths, block_frames=None):
+    """Apply filtering to the channel files of one recording block by block, in constant memory.
+
+    The channel files are memory-mapped (see `utils.audio.open_wav`) and read in
+    blocks of `block_frames` frames, which are filtered (and decimated) with the state
+    of the filters carried from one block to the next, and appended to the output
+    files. The output files are the same as those of `apply_filter_batch`.
+
+    Args:
+        src_paths (list): paths to the channel files, in channel order
+        dst_paths (dict): profile -> list with one path per channel,
+            or a single path for an interleaved file
+        block_frames (int): number of frames per block (`STREAM_BLOCK_FRAMES` if None)
+    """
+    block_frames = block_frames or STREAM_BLOCK_FRAMES
+    sources = []
+    sample_rate = None
+    sample_width = 2
+    for src_path in src_paths:
+        samples, info = open_wav(src_path)
+        if sample_rate is not None and info.sample_rate != sample_rate:
+            raise ValueError(f"Sample rate mismatch between channel files: {src_paths}")
+        sample_rate = info.sample_rate
+        sample_width = max(sample_width, output_sample_width(info.sample_width))
+        sources.append(samples[:, 0])
+
+    lengths = [len(samples) for samples in sources]
+    output_rate = sample_rate
+    output_lengths = lengths
+    if DECIMATE_TO is not None and sample_rate > DECIMATE_TO:
+        output_rate = DECIMATE_TO
+        output_lengths = [-(-length * output_rate // sample_rate) for length in lengths]
+
+    with ExitStack() as stack:
+        chains = {}
+        for profile, profile_dst_paths in dst_paths.items():
+            sos_filter = SosFilter(profile_sos(profile, sample_rate), len(sources))
+            resampler = Resampler(sample_rate, output_rate, len(sources)) if output_rate != sample_rate else None
+            channels = len(sources) if len(profile_dst_paths) == 1 else 1
+            writers = [
+                stack.enter_context(AudioFileWriter(dst_path, output_rate, channels, sample_width))
+                for dst_path in profile_dst_paths
+            ]
+            chains[profile] = (sos_filter, resampler, writers)
+        # Number of output frames written per profile
+        written = dict.fromkeys(dst_paths, 0)
+
+        def write(profile, samples):
+            writers = chains[profile][2]
+            if len(writers) == 1:
+                writers[0].write(samples)
+            else:
+                for i, audio_f in enumerate(writers):
+                    audio_f.write(samples[:max(0, output_lengths[i] - written[profile]), i:i + 1])
+            written[profile] += len(samples)
+
+        for start in range(0, max(lengths), block_frames):
+            # Channels shorter than the longest one are zero-padded (as in `apply_filter_batch`)
+            block = np.zeros((min(block_frames, max(lengths) - start), len(sources)), dtype=np.float32)
+            for i, samples in enumerate(sources):
+                channel = samples[start:start + len(block)]
+                block[:len(channel), i] = pcm_to_float(channel)
+
+            for profile, (sos_filter, resampler, _) in chains.items():
+                filtered = sos_filter.process(block)
+                if resampler is not None:
+                    for i, length in enumerate(lengths):
+                        filtered[max(0, length - start):, i] = 0.0
+                    filtered = resampler.process(filtered)
+                write(profile, filtered)
+
+        for profile, (_, resampler, _) in chains.items():
+            if resampler is not None:
+                write(profile, resampler.flush())
+
 
 if __name__ == "__main__":
-    process_files()
+    parser = argparse.ArgumentParser(description=__doc__)
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    sharding.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+    sharding.configure(args)
+
+    instrumentation.run(process_files, sharding.shard_path("filter_audio"), args)
@@ -1,7 +1,15 @@
+"""Generate the auscultation locations (`locations.json`) of the encounters."""
+
+import argparse
 import datetime
-import glob
 import os
 
+from contextlib import nullcontext
+
+from utils import archive_fs, instrumentation, sharding
+from utils.archive_fs import get_filesystem
+from utils.async_writer import BackgroundWriter
+from utils.instrumentation import count, timer
 from utils.general import write_dict_to_json_file
 
 
@@ -28,45 +36,63 @@ RECORDINGS_ORDER = {
 
 UNKNOWN_LOCATION = "51185008"
 
+# Write the `locations.json` files in background threads
+BACKGROUND_WRITES = True
+# fsync policy of the background writes ("never", "file" or "flush")
+FSYNC = "never"
+
 
 def main():
     """Generate the auscultation locations."""
     # Get encounters directories
-    for dataset in PATH_FORMAT:
-        directories = glob.glob(dataset)
-
-        for encounter in directories:
-            # Generate the list of channel 1 audio recordings
-            audio_files = glob.glob(encounter + "*_ch1.wav")
-            if audio_files == []:
-                continue
-
-            # Get filenames
-            audio_files = [os.path.basename(file) for file in audio_files]
-
-            # Generate auscultation locations only if there are exactly 10 recordings
-            if len(audio_files) == 10 and "Covid-19" not in encounter:
-                file_location = {}
-                times = []
-                # Extract the time of recording from the filename
-                for file in audio_files:
-                    hour, minute, second = file.split("_")[0:3]
-                    times.append(datetime.time(int(hour), int(minute), int(second)))
-
-                # Sort the recordings by time
-                ordered = sorted(enumerate(times), key=lambda x: x[1])
-                # Prepare the dictionary: filename -> auscultation location
-                for i, (index, _) in enumerate(ordered):
-                    file_location[audio_files[index]] = RECORDINGS_ORDER[i]
-
-            # The unknown location points to the "Chest" body structure
-            else:
-                file_location = {file: UNKNOWN_LOCATION for file in audio_files}
-
-            # Write the dictionary to a JSON file
-            locations_path = os.path.join(encounter, "locations.json")
-            write_dict_to_json_file(file_location, locations_path)
+    with BackgroundWriter(fsync=FSYNC) if BACKGROUND_WRITES else nullcontext() as writer:
+        for dataset in PATH_FORMAT:
+            with timer("glob"):
+                directories = sharding.select(get_filesystem().glob(dataset))
+
+            for encounter in directories:
+                # Generate the list of channel 1 audio recordings
+                with timer("glob"):
+                    audio_files = get_filesystem().glob(encounter + "*_ch1.wav")
+                if audio_files == []:
+                    continue
+
+                # Get filenames
+                audio_files = [os.path.basename(file) for file in audio_files]
+
+                # Generate auscultation locations only if there are exactly 10 recordings
+                if len(audio_files) == 10 and "Covid-19" not in encounter:
+                    file_location = {}
+                    times = []
+                    # Extract the time of recording from the filename
+                    for file in audio_files:
+                        hour, minute, second = file.split("_")[0:3]
+                        times.append(datetime.time(int(hour), int(minute), int(second)))
+
+                    # Sort the recordings by time
+                    ordered = sorted(enumerate(times), key=lambda x: x[1])
+                    # Prepare the dictionary: filename -> auscultation location
+                    for i, (index, _) in enumerate(ordered):
+                        file_location[audio_files[index]] = RECORDINGS_ORDER[i]
+
+                # The unknown location points to the "Chest" body structure
+                else:
+                    file_location = {file: UNKNOWN_LOCATION for file in audio_files}
+
+                # Write the dictionary to a JSON file (in the local tree when reading from an archive)
+                os.makedirs(encounter, exist_ok=True)
+                locations_path = os.path.join(encounter, "locations.json")
+                write_dict_to_json_file(file_location, locations_path, writer)
+                count("encounters")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    sharding.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+    sharding.configure(args)
+
+    instrumentation.run(main, sharding.shard_path("generate_auscultation_locations"), args)
@@ -1,13 +1,18 @@
+"""Generate markdown reports summarising the XML files and audio recordings."""
+
+import argparse
 import datetime
-import glob
 import os
 
-from collections import Counter
-
 import xmltodict
 
+from utils import archive_fs, instrumentation
+from utils.instrumentation import count, timer
+from utils.archive_fs import get_filesystem
+from utils.compact import CompactTable
 from utils.general import dump_to_markdown
-from utils.xml_processing import get_long_df, get_location, get_date
+from utils.query import Dataset
+from utils.xml_processing import DISEASE_FLAGS, get_long_df, get_location, get_date
 
 
 DATE = '16_03_2022_cov'
@@ -19,6 +24,22 @@ XML_FAMILIES = [
     ("raw_data/16-03-2022/*/Data/input/*/*.xml", "reports/sanolla_report.md"),  # Sanolla
 ]
 
+# Keep the rows in a `CompactTable` instead of a list of dicts (less memory on large archives)
+COMPACT_ROWS = False
+
+# Disease flags of the long format (see `get_long_df`) by the name used in the reports
+DISEASES = {
+    "copd": "COPD",
+    "asthma": "Asthma",
+    "emphysema": "Emphysema",
+    "chronic_bronchitis": "ChronicBronchitis",
+    "lung_cancer": "LungCancer",
+    "hypertension": "Hypertension",
+    "angina_pectoris": "AnginaPectoris",
+    "myocardial_infarction": "MyocardialInfarction",
+    "heart_failure": "HeartFailure",
+}
+
 
 HEADING = (
     '# Report\n\n'
@@ -47,92 +68,51 @@ def main():
     for xml_path_format, report_path in XML_FAMILIES:
 
         encounters_path_format = xml_path_format.replace(".xml", "/")
-        encounters = glob.glob(encounters_path_format)
-        n_encounter_audio = [len(glob.glob(dir+"/*ch1.wav")) for dir in encounters]
+        fs = get_filesystem()
+        with timer("glob"):
+            encounters = fs.glob(encounters_path_format)
+            n_encounter_audio = [len(fs.glob(dir+"/*ch1.wav")) for dir in encounters]
         n_encounters = len([1 for n_audio in n_encounter_audio if n_audio != 0])  # TODO: upgrade
-        serial_numbers = set()
-
-        xml_paths = glob.glob(xml_path_format)
-
-        diseased_numbers = {
-            "copd": [],
-            "asthma": [],
-            "emphysema": [],
-            "chronic_bronchitis": [],
-            "lung_cancer": [],
-            "hypertension": [],
-            "angina_pectoris": [],
-            "myocardial_infarction": [],
-            "heart_failure": [],
-        }
 
+        with timer("glob"):
+            xml_paths = fs.glob(xml_path_format)
 
+        rows = CompactTable() if COMPACT_ROWS else []
         for xml_path in xml_paths:
             # Read the xml file
-            with open(xml_path, "r", encoding="utf-8") as xml_f:
-                xml_content = xmltodict.parse(xml_f.read())
-                xml_content = xml_content["Bat-Call_PatientData"]
+            with timer("process_file", path=xml_path), fs.open(xml_path, "r", encoding="utf-8") as xml_f:
+                with timer("xmltodict.parse"):
+                    xml_content = xmltodict.parse(xml_f.read())
+                    xml_content = xml_content["Bat-Call_PatientData"]
+                count("xml_files")
 
                 # Get the long format of the data
-                long_data_row = get_long_df(xml_content)
+                with timer("get_long_df"):
+                    long_data_row = get_long_df(xml_content)
                 # Add the location (care facility) and the date to the dictionary
                 long_data_row['Location'] = get_location(xml_path)
-                long_data_row['RecordDate'] = get_date(xml_path)
+                with timer("get_date"):
+                    long_data_row['RecordDate'] = get_date(xml_path)
                 # Add a unique identifier for each patient
                 try:
-                    patient_id = long_data_row["PatientIdentifier"] + '_' + long_data_row['Location']
+                    long_data_row['PatientId'] = long_data_row["PatientIdentifier"] + '_' + long_data_row['Location']
                 except KeyError:
-                    patient_id = long_data_row["SerialNumber"] + '_' + long_data_row['Location']
-
-                serial_numbers.add(patient_id)
-
-                # Get diseases that were recorded in the standardised way
-                asthma_entry = long_data_row.get("Asthma")
-                if asthma_entry is not None:
-                    assert asthma_entry
-                    diseased_numbers["asthma"].append(patient_id)
-
-                copd_entry = long_data_row.get("COPD")
-                if copd_entry is not None:
-                    assert copd_entry
-                    diseased_numbers["copd"].append(patient_id)
-
-                emphysema_entry = long_data_row.get("Emphysema")
-                if emphysema_entry is not None:
-                    assert emphysema_entry
-                    diseased_numbers["emphysema"].append(patient_id)
-
-                chronic_bronchitis_entry = long_data_row.get("ChronicBronchitis")
-                if chronic_bronchitis_entry is not None:
-                    assert chronic_bronchitis_entry
-                    diseased_numbers["chronic_bronchitis"].append(patient_id)
-
-                lung_cancer_entry = long_data_row.get("LungCancer")
-                if lung_cancer_entry is not None:
-                    assert lung_cancer_entry
-                    diseased_numbers["lung_cancer"].append(patient_id)
-
-                hypertension_entry = long_data_row.get("Hypertension")
-                if hypertension_entry is not None:
-                    assert hypertension_entry
-                    diseased_numbers["hypertension"].append(patient_id)
-
-                angina_pectoris_entry = long_data_row.get("AnginaPectoris")
-                if angina_pectoris_entry is not None:
-                    assert angina_pectoris_entry
-                    diseased_numbers["angina_pectoris"].append(patient_id)
-
-                myocardial_infarction_entry = long_data_row.get("MyocardialInfarction")
-                if myocardial_infarction_entry is not None:
-                    assert myocardial_infarction_entry
-                    diseased_numbers["myocardial_infarction"].append(patient_id)
-
-                heart_failure_entry = long_data_row.get("HeartFailure")
-                if heart_failure_entry is not None:
-                    assert heart_failure_entry
-                    diseased_numbers["heart_failure"].append(patient_id)
-
-
+                    long_data_row['PatientId'] = long_data_row["SerialNumber"] + '_' + long_data_row['Location']
+                rows.append(long_data_row)
+
+        with timer("query"):
+            if COMPACT_ROWS:
+                dataset = Dataset.from_table(rows, index_columns=["PatientId"] + DISEASE_FLAGS)
+            else:
+                dataset = Dataset.from_rows(rows, index_columns=["PatientId"] + DISEASE_FLAGS)
+            serial_numbers = dataset.index("PatientId")
+
+            # Get diseases that were recorded in the standardised way
+            diseased_numbers = {}
+            for name, flag in DISEASES.items():
+                flag_values = set(dataset.index(flag)) - {None}
+                assert flag_values <= {True}, f"Unexpected {flag} values: {flag_values}"
+                diseased_numbers[name] = dataset.filter(**{flag: True}).column("PatientId")
 
         heading = "| # audio recordings | # encounters | # XML files | # unique patients |\n"
         heading += "|:---:|:---:|:---:|:---:|\n"
@@ -145,8 +125,7 @@ def main():
         row = ""
 
         for k, v in diseased_numbers.items():
-            cnt = Counter(v)
-            row += f"| {k} | {cnt.total()} | {len(cnt)} |\n"
+            row += f"| {k} | {len(v)} | {len(set(v))} |\n"
         disease_table = heading + row
 
 
@@ -163,4 +142,10 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args, mount='raw_data/')
+
+    instrumentation.run(main, "generate_reports", args)
@@ -0,0 +1,201 @@
+"""Generate a synthetic archive with the layout and content of the raw dataset.
+
+The archive mirrors `raw_data--anonymised/<date>/<site>/Data/input/<patient>/`:
+every patient directory holds a `Bat-Call_PatientData` XML file and an encounter
+("date") directory `YYYY_MM_DD/` with `HH_MM_SS_chN.wav` recordings. Some patients
+also get an extra, empty date directory, as found in the real archive.
+The content is random but drawn from the values accepted by `utils.xml_processing`.
+"""
+
+import argparse
+import datetime
+import os
+import random
+
+import numpy as np
+import xmltodict
+
+from utils.audio import write_wav
+
+
+RAW_DIR = "raw_data--anonymised"
+DATASETS = ["28-11-2022", "16-03-2022"]
+
+COUNTRIES = ["Germany", "Spain", "Norway", "Israel"]
+GENDERS = ["Male", "Female", "Other", "Unknown"]
+AGE_GROUPS = ["18-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80+"]
+LUNG_DISEASES = ["None", "COPD", "Asthma", "COPD, Emphysema", "Chronic bronchitis", "Lung cancer - stage II", "Sarcoidosis"]
+HEART_DISEASES = ["None", "Hypertension", "Angina pectoris, Hypertension", "Myocardial infraction", "Heart failure", "Arrhythmia"]
+STATEMENTS = [
+    "I only get breathless with strenuous exercise.",
+    "I get short of breath when hurrying on level ground or walking up a slight hill.",
+    "On level ground I walk slower than people of the same age because of breathlessness "
+    "or have to stop for breath when waking at my own pace.",
+    "I stop for breath after walking about 100 yards or after a few minutes on level ground.",
+    "I am too breathless to leave the house or I am breathless when dressing.",
+]
+SMOKING_HABITS = ["Never smoked", "Ex-smoker", "Active smoker"]
+CFS_ANSWERS = ["Normal or better", "Somewhat worse than normal", "Much worse than normal"]
+PARTICIPATION = [
+    "Continue participation",
+    "Intensive care with future return",
+    "Intensive care – discontinued",
+    "Personal request - discontinued",
+    "End of trial",
+    "Other...",
+]
+HEALTH = ["Very bad", "Bad", "Neither good or bad", "Good", "Very good"]
+MEDICATIONS = ["Salbutamol 100 ug 2x/day", "Tiotropium 18 ug 1x/day", "Metoprolol 50 mg 1x/day", ""]
+
+
+def generate_archive(
+        root,
+        n_sites=2,
+        n_patients=20,
+        n_recordings=10,
+        n_channels=4,
+        duration_s=10.0,
+        sample_rate=4000,
+        seed=0,
+):
+    """Generate a synthetic archive under `root`.
+
+    Args:
+        root (str): directory in which `raw_data--anonymised/` is created
+        n_sites (int): number of sites (care facilities) per dataset
+        n_patients (int): number of patients per site
+        n_recordings (int): number of auscultation recordings per encounter
+        n_channels (int): number of channel files per recording
+        duration_s (float): duration of each recording in seconds
+        sample_rate (int): sample rate of the recordings in Hz
+        seed (int): seed of the random generators
+
+    Returns:
+        dict: number of XML and WAV files generated and their total size in bytes
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    stats = {"xml_files": 0, "wav_files": 0, "bytes": 0}
+
+    for dataset in DATASETS:
+        for site_idx in range(n_sites):
+            site = f"Site{site_idx:02d}"
+            for patient_idx in range(n_patients):
+                patient = f"{site}-P{patient_idx:05d}"
+                patient_dir = os.path.join(root, RAW_DIR, dataset, site, "Data", "input", patient)
+                date = datetime.date(2022, 1, 1) + datetime.timedelta(days=rng.randrange(300))
+                encounter_dir = os.path.join(patient_dir, date.strftime("%Y_%m_%d"))
+                os.makedirs(encounter_dir, exist_ok=True)
+
+                # Some patients have an additional date directory without recordings
+                if rng.random() < 0.1:
+                    os.makedirs(os.path.join(patient_dir, (date - datetime.timedelta(days=1)).strftime("%Y_%m_%d")), exist_ok=True)
+
+                xml_path = os.path.join(patient_dir, f"{patient}.xml")
+                with open(xml_path, "w", encoding="utf-8") as xml_f:
+                    xml_f.write(xmltodict.unparse({"Bat-Call_PatientData": random_patient_data(rng, patient)}, pretty=True))
+                stats["xml_files"] += 1
+                stats["bytes"] += os.path.getsize(xml_path)
+
+                start = datetime.datetime.combine(date, datetime.time(rng.randrange(8, 16), rng.randrange(60)))
+                for recording_idx in range(n_recordings):
+                    time = (start + datetime.timedelta(seconds=45 * recording_idx)).strftime("%H_%M_%S")
+                    recording = random_recording(np_rng, n_channels, duration_s, sample_rate)
+                    for channel in range(n_channels):
+                        wav_path = os.path.join(encounter_dir, f"{time}_ch{channel + 1}.wav")
+                        write_wav(wav_path, recording[:, channel], sample_rate)
+                        stats["wav_files"] += 1
+                        stats["bytes"] += os.path.getsize(wav_path)
+
+    return stats
+
+
+def random_patient_data(rng, patient):
+    """Random content of a `Bat-Call_PatientData` XML document."""
+    smoking_habit = rng.choice(SMOKING_HABITS)
+    data = {
+        "PatientIdentifier": patient,
+        "SerialNumber": f"SN{rng.randrange(10 ** 8):08d}",
+        "CollectorNameID": f"C{rng.randrange(100):03d}",
+        "Country": rng.choice(COUNTRIES),
+        "Gender": rng.choice(GENDERS),
+        "Age": rng.choice(AGE_GROUPS),
+        "Systolic": str(rng.randrange(95, 180)),
+        "Diastolic": str(rng.randrange(55, 110)),
+        "HeartRate": rng.choice(["No measurement", str(rng.randrange(50, 120))]),
+        "SpO2": rng.choice(["No measurement", str(rng.randrange(85, 100))]),
+        "PulseOximetry": str(rng.randrange(85, 100)),
+        "BodyTemperature": f"{rng.uniform(35.8, 39.5):.1f}",
+        "RespiratoryRate30Sec": str(rng.randrange(6, 15)),
+        "RespiratoryRateInOneMinute": str(rng.randrange(12, 30)),
+        # Weight is occasionally entered as free text in the real data
+        "Weight": rng.choice([f"{rng.uniform(45, 130):.1f}"] * 9 + ["approx. 80 kg"]),
+        "Spirometry": str(rng.randrange(30, 110)),
+        "Health": rng.choice(HEALTH),
+        "DailyMedication": rng.choice(MEDICATIONS) or None,
+        "DailyCough": rng.choice(["Yes", "No"]),
+        "Statement": rng.choice(STATEMENTS),
+        "SmokingHabit": smoking_habit,
+        "LungDisease": rng.choice(LUNG_DISEASES),
+        "HeartDisease": rng.choice(HEART_DISEASES),
+        "Diabetes": rng.choice(["Yes", "No", "Diabetes"]),
+        "RespiratoryInfection": rng.choice(["Yes", "No"]),
+        "NewIncreasedMedication": rng.choice(MEDICATIONS) or None,
+        "PatientParticipation": rng.choice(PARTICIPATION),
+        "Coughing": rng.choice(CFS_ANSWERS),
+        "Fatigue": rng.choice(CFS_ANSWERS),
+        "ShortnessOfBreath": rng.choice(CFS_ANSWERS),
+        "Device": {
+            "Model": "Stethoscope-4CH",
+            "FirmwareVersion": f"2.{rng.randrange(10)}.{rng.randrange(10)}",
+        },
+    }
+    if smoking_habit != "Never smoked":
+        data["CigarettesPerDay"] = str(rng.randrange(1, 40))
+        data["YearsOfSmoking"] = str(rng.randrange(1, 50))
+    if rng.random() < 0.02:
+        data["DisqualifyPatient"] = "Disqualify patient"
+    return data
+
+
+def random_recording(np_rng, n_channels, duration_s, sample_rate):
+    """Random multichannel recording: periodic low-frequency "heart" bursts in broadband noise."""
+    n_samples = int(duration_s * sample_rate)
+    t = np.arange(n_samples) / sample_rate
+    heart_rate = np_rng.uniform(0.8, 1.8)
+    envelope = np.exp(-30.0 * np.mod(t, 1.0 / heart_rate))
+    beats = envelope * np.sin(2 * np.pi * np_rng.uniform(40, 120) * t)
+    recording = np.empty((n_samples, n_channels), dtype=np.float32)
+    for channel in range(n_channels):
+        noise = np_rng.normal(0.0, 0.02, n_samples)
+        recording[:, channel] = 0.3 * np_rng.uniform(0.5, 1.0) * beats + noise
+    return np.clip(recording, -1.0, 1.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw data archive.")
+    parser.add_argument("root", help="directory in which `raw_data--anonymised/` is created")
+    parser.add_argument("--sites", type=int, default=2, help="sites per dataset")
+    parser.add_argument("--patients", type=int, default=20, help="patients per site")
+    parser.add_argument("--recordings", type=int, default=10, help="recordings per encounter")
+    parser.add_argument("--channels", type=int, default=4, help="channel files per recording")
+    parser.add_argument("--duration", type=float, default=10.0, help="recording duration in seconds")
+    parser.add_argument("--sample-rate", type=int, default=4000, help="recording sample rate in Hz")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stats = generate_archive(
+        args.root,
+        n_sites=args.sites,
+        n_patients=args.patients,
+        n_recordings=args.recordings,
+        n_channels=args.channels,
+        duration_s=args.duration,
+        sample_rate=args.sample_rate,
+        seed=args.seed,
+    )
+    print(f"Generated {stats['xml_files']} XML files and {stats['wav_files']} WAV files ({stats['bytes'] / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
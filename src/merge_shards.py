@@ -0,0 +1,136 @@
+"""Merge the per-shard outputs of the scripts run with `--shard i/N` (see `utils.sharding`).
+
+Without arguments, merges the CSV files of `extract_xml_to_csv.py` and `process_audio.py`
+(union of the columns) and the run reports in `profile/` (stages, counters and bytes summed, the
+wall time of the slowest shard). NDJSON directories (e.g. the runs of the delta
+export of each shard) are concatenated file by file with `--ndjson`:
+
+    python src/merge_shards.py
+    python src/merge_shards.py --ndjson fhir_delta/merged "fhir_delta.shard-*/20261019T*"
+"""
+
+import argparse
+import csv
+import glob
+import heapq
+import json
+import os
+import shutil
+
+from collections import Counter
+
+from extract_xml_to_csv import XML_FAMILIES
+from process_audio import DURATIONS_PATH, METRICS_PATH
+from utils.instrumentation import N_SLOWEST, REPORT_DIR
+from utils.sharding import SHARD_GLOB, shard_pattern
+
+
+def merge_csv(input_paths, output_path):
+    """Concatenate CSV files into `output_path`, with the (sorted) union of their columns."""
+    columns = set()
+    for path in input_paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            columns.update(next(csv.reader(f), []))
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    n_rows = 0
+    with open(output_path, "w", newline="", encoding="utf-8") as output:
+        writer = csv.DictWriter(output, fieldnames=sorted(columns))
+        writer.writeheader()
+        for path in input_paths:
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    writer.writerow(row)
+                    n_rows += 1
+    print(f"Merged {len(input_paths)} shards into {output_path} ({n_rows} rows, {len(columns)} columns)")
+
+
+def merge_reports(input_paths, output_path):
+    """Aggregate the run reports of the shards of a script into `output_path`.
+
+    The shards run in parallel: the wall time is that of the slowest shard, everything
+    else (CPU time, stages, counters, bytes written) is summed.
+    """
+    reports = []
+    for path in input_paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+
+    stages = {}
+    counters = Counter()
+    slowest = []
+    for report in reports:
+        for stage, stats in report["stages"].items():
+            merged = stages.setdefault(stage, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+            for key in merged:
+                merged[key] += stats[key]
+        counters.update(report["counters"])
+        slowest += report["slowest_files"]
+
+    merged_report = {
+        "script": os.path.splitext(os.path.basename(output_path))[0],
+        "shards": len(reports),
+        "wall": max(report["wall"] for report in reports),
+        "cpu": round(sum(report["cpu"] for report in reports), 4),
+        "stages": {
+            stage: {"calls": stats["calls"], "wall": round(stats["wall"], 4), "cpu": round(stats["cpu"], 4)}
+            for stage, stats in sorted(stages.items(), key=lambda item: -item[1]["wall"])
+        },
+        "counters": dict(counters),
+        "bytes_written": sum(report["bytes_written"] for report in reports),
+        "slowest_files": heapq.nlargest(N_SLOWEST, slowest, key=lambda entry: entry["seconds"]),
+    }
+    with open(output_path, "w") as f:
+        json.dump(merged_report, f, indent=4)
+    print(f"Merged {len(reports)} run reports into {output_path}")
+
+
+def merge_ndjson(input_dirs, output_dir):
+    """Concatenate the NDJSON files with the same name of the input directories into `output_dir`."""
+    os.makedirs(output_dir, exist_ok=True)
+    names = sorted({name for input_dir in input_dirs for name in os.listdir(input_dir) if name.endswith(".ndjson")})
+    for name in names:
+        with open(os.path.join(output_dir, name), "wb") as output:
+            for input_dir in input_dirs:
+                path = os.path.join(input_dir, name)
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        shutil.copyfileobj(f, output)
+    print(f"Merged {len(input_dirs)} directories into {output_dir} ({', '.join(names) or 'no files'})")
+
+
+def merge_all():
+    """Merge the CSV files of `extract_xml_to_csv`/`process_audio` and the run reports of all sharded runs."""
+    for csv_path in [csv_path for _, csv_path in XML_FAMILIES] + [METRICS_PATH, DURATIONS_PATH]:
+        input_paths = sorted(glob.glob(shard_pattern(csv_path)))
+        if input_paths:
+            merge_csv(input_paths, csv_path)
+
+    reports = {}
+    for path in sorted(glob.glob(os.path.join(REPORT_DIR, "*" + SHARD_GLOB + ".json"))):
+        name = os.path.basename(path).split(".shard-")[0]
+        reports.setdefault(name, []).append(path)
+    for name, input_paths in reports.items():
+        merge_reports(input_paths, os.path.join(REPORT_DIR, name + ".json"))
+
+
+def expand(patterns):
+    """Expand glob patterns (kept in order, duplicates removed)."""
+    return list(dict.fromkeys(path for pattern in patterns for path in sorted(glob.glob(pattern)) or [pattern]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv", nargs="+", metavar=("OUTPUT", "INPUT"), help="merge CSV files (glob patterns) into OUTPUT")
+    parser.add_argument("--reports", nargs="+", metavar=("OUTPUT", "INPUT"), help="merge run reports (glob patterns) into OUTPUT")
+    parser.add_argument("--ndjson", nargs="+", metavar=("OUTPUT", "INPUT"), help="merge NDJSON directories (glob patterns) into OUTPUT")
+    args = parser.parse_args()
+
+    if args.csv:
+        merge_csv(expand(args.csv[1:]), args.csv[0])
+    if args.reports:
+        merge_reports(expand(args.reports[1:]), args.reports[0])
+    if args.ndjson:
+        merge_ndjson(expand(args.ndjson[1:]), args.ndjson[0])
+    if not (args.csv or args.reports or args.ndjson):
+        merge_all()
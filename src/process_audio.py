@@ -0,0 +1,252 @@
+"""Filter the raw recordings and compute their metrics and features in a single pass.
+
+`filter_audio.py`, `compute_audio_metrics.py` and `compute_spectrograms.py` each read
+and decode every recording. This script decodes each raw recording once into a NumPy
+buffer and runs a chain of in-memory stages on it, each stage passing the buffer to
+the next one without intermediate files:
+
+    filter      filters the buffer with `FILTER_PROFILE` (in-process, as `filter_audio.apply_filter_batch`)
+    decimate    decimates the buffer to `filter_audio.DECIMATE_TO` (if set)
+    write       rounds the buffer to the PCM samples of the filtered file (in the
+                `OUTPUT_FORMAT` of `filter_audio`), which is written at the end
+    metrics     quality metrics of the decoded raw recording (as `compute_audio_metrics.py`)
+    log_mel     log-mel spectrogram of the buffer (as `compute_spectrograms.py`)
+    duration    sample rate, number of frames and duration of the buffer
+
+The outputs of a recording are written once all its stages ran, and the metrics,
+features and durations of all recordings at the end of the run, to the same files
+as the separate scripts:
+
+    python src/process_audio.py
+    python src/process_audio.py --stages duration  # only probe the durations of the raw recordings
+"""
+
+import argparse
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+
+from tqdm import tqdm
+
+import filter_audio
+
+from utils import archive_fs, instrumentation, sharding
+from utils.archive_fs import get_filesystem
+from utils.array_store import ArrayStoreWriter
+from utils.audio import float_to_pcm, open_wav, output_sample_width, pcm_to_float, write_audio
+from utils.audio_metrics import METRICS_COLUMNS, compute_metrics
+from utils.features import HOP_LENGTH, N_FFT, N_MELS, log_mel_spectrogram
+from utils.filters import apply_sos, profile_sos, resample
+from utils.general import dump_to_csv, read_encounter_locations
+
+
+SEPARATED_CHANNELS_DIR = filter_audio.SEPARATED_CHANNELS_DIR
+
+# Stages run on each recording, in order (see the module docstring)
+STAGES = ["filter", "decimate", "write", "metrics", "log_mel", "duration"]
+# Filter profile of the `filter` stage (see `utils.filters.FILTER_PROFILES`)
+FILTER_PROFILE = "default"
+
+METRICS_PATH = "metrics/audio_metrics.csv"
+FEATURES_DIR = "features/log_mel/"
+# Data type of the stored features
+FEATURE_DTYPE = "float16"
+DURATIONS_PATH = "metrics/audio_durations.csv"
+DURATION_COLUMNS = ["path", "sample_rate", "n_frames", "duration_s"]
+
+# Number of worker processes (None: one per CPU)
+N_WORKERS = None
+# Number of recordings sent to a worker at once
+CHUNK_SIZE = 8
+
+
+class Recording:
+    """A decoded recording passed through the stages, with the outputs of the stages."""
+
+    def __init__(self, src_path, samples, sample_rate, sample_width):
+        """
+        Args:
+            src_path (str): path to the raw recording
+            samples (np.ndarray): float32 samples of shape (n_frames, channels)
+            sample_rate (int): sample rate in Hz
+            sample_width (int): bytes per sample of the written PCM samples
+        """
+        self.src_path = src_path
+        self.samples = samples
+        self.sample_rate = sample_rate
+        # Decoded raw recording, before the stages
+        self.raw_samples = samples
+        self.raw_sample_rate = sample_rate
+        self.sample_width = sample_width
+        # Path of the filtered file (set by the `write` stage)
+        self.dst_path = None
+        # Stage name -> output to be written at the end
+        self.outputs = {}
+
+    @property
+    def path(self):
+        """Path of the recording in the outputs (the filtered file if written)."""
+        return self.dst_path or self.src_path
+
+
+def filter_stage(recording):
+    """Filter the buffer with `FILTER_PROFILE`."""
+    recording.samples = apply_sos(profile_sos(FILTER_PROFILE, recording.sample_rate), recording.samples)
+
+
+def decimate_stage(recording):
+    """Decimate the buffer to `filter_audio.DECIMATE_TO` (if set and below the sample rate)."""
+    target_rate = filter_audio.DECIMATE_TO
+    if target_rate is not None and recording.sample_rate > target_rate:
+        recording.samples = resample(recording.samples, recording.sample_rate, target_rate)
+        recording.sample_rate = target_rate
+
+
+def write_stage(recording):
+    """Round the buffer to the PCM samples of the filtered file, which is written at the end.
+
+    The next stages then see the samples of the file, as the scripts reading it.
+    """
+    root, file = os.path.split(recording.src_path)
+    recording.dst_path = filter_audio.get_dst_paths(root, [file], FILTER_PROFILE)[0]
+    recording.samples = pcm_to_float(float_to_pcm(recording.samples, recording.sample_width))
+    recording.outputs["write"] = (recording.dst_path, recording.samples, recording.sample_rate, recording.sample_width)
+
+
+def metrics_stage(recording):
+    """Compute the quality metrics of the raw recording (not of the filtered buffer)."""
+    metrics = compute_metrics(recording.raw_samples, recording.raw_sample_rate)
+    metrics["path"] = recording.src_path
+    recording.outputs["metrics"] = metrics
+
+
+def log_mel_stage(recording):
+    """Compute the log-mel spectrogram of the buffer."""
+    recording.outputs["log_mel"] = log_mel_spectrogram(recording.samples, recording.sample_rate)
+
+
+def duration_stage(recording):
+    """Record the sample rate, number of frames and duration of the buffer."""
+    n_frames = len(recording.samples)
+    recording.outputs["duration"] = {
+        "path": recording.path,
+        "sample_rate": recording.sample_rate,
+        "n_frames": n_frames,
+        "duration_s": round(n_frames / recording.sample_rate, 3),
+    }
+
+
+STAGE_FUNCTIONS = {
+    "filter": filter_stage,
+    "decimate": decimate_stage,
+    "write": write_stage,
+    "metrics": metrics_stage,
+    "log_mel": log_mel_stage,
+    "duration": duration_stage,
+}
+
+
+def process_audio(stages=None):
+    """Run the stages on all raw recordings and write the metrics, features and durations.
+
+    With `--shard`, only the recordings of the patients of the shard are processed and
+    the metrics, features and durations are written per shard (see `utils.sharding`).
+    """
+    stages = list(stages or STAGES)
+    for stage in stages:
+        if stage not in STAGE_FUNCTIONS:
+            raise ValueError(f"Unknown stage: {stage}")
+
+    src_paths = list_recordings()
+    if "write" in stages:
+        output_dir = filter_audio.get_output_dir(FILTER_PROFILE)
+        if sharding.get_shard() is None:
+            filter_audio.setup_folder(output_dir)
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+
+    metrics_rows = []
+    duration_rows = []
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        store = None
+        if "log_mel" in stages:
+            metadata = {"n_fft": N_FFT, "hop_length": HOP_LENGTH, "n_mels": N_MELS}
+            store = stack.enter_context(ArrayStoreWriter(sharding.shard_path(FEATURES_DIR), dtype=FEATURE_DTYPE, metadata=metadata))
+        executor = stack.enter_context(ProcessPoolExecutor(max_workers=N_WORKERS))
+
+        results = executor.map(partial(process_recording, stages=stages), src_paths, chunksize=CHUNK_SIZE)
+        for src_path, outputs in tqdm(zip(src_paths, results), total=len(src_paths)):
+            if "metrics" in outputs:
+                metrics_rows.append(outputs["metrics"])
+            if "duration" in outputs:
+                duration_rows.append(outputs["duration"])
+            if store is not None:
+                encounter, filename = os.path.split(os.path.relpath(src_path, SEPARATED_CHANNELS_DIR))
+                store.append(
+                    outputs["log_mel"],
+                    encounter=encounter,
+                    filename=filename,
+                    location=read_encounter_locations(os.path.dirname(src_path)).get(filename),
+                    sample_rate=outputs["sample_rate"],
+                )
+    elapsed = time.perf_counter() - start
+
+    if "metrics" in stages:
+        dump_to_csv(sharding.shard_path(METRICS_PATH), metrics_rows, METRICS_COLUMNS)
+    if "duration" in stages:
+        dump_to_csv(sharding.shard_path(DURATIONS_PATH), duration_rows, DURATION_COLUMNS)
+
+    # Report the throughput
+    instrumentation.count("audio_files", len(src_paths))
+    size_mb = sum(get_filesystem().getsize(path) for path in src_paths) / 1e6
+    print(f"Processed {len(src_paths)} files ({size_mb:.1f} MB) with {', '.join(stages)} in {elapsed:.2f} s")
+    if elapsed > 0:
+        print(f"Throughput: {len(src_paths) / elapsed:.1f} files/s, {size_mb / elapsed:.1f} MB/s")
+
+
+def list_recordings():
+    """List the raw recordings processed by `filter_audio` (of the shard), sorted by path."""
+    src_paths = []
+    for root, _, files in get_filesystem().walk(SEPARATED_CHANNELS_DIR):
+        if not filter_audio.is_input_dir(root):
+            continue
+        for file in files:
+            if filter_audio.is_wav(file) and filter_audio.is_ch1(file):
+                src_paths.append(os.path.join(root, file))
+    return sorted(src_paths)
+
+
+def process_recording(src_path, stages=STAGES):
+    """Decode a raw recording once, run the stages on it and write its filtered file.
+
+    Returns:
+        dict: stage name -> output of the metrics, log_mel and duration stages,
+            and the sample rate of the buffer after the last stage
+    """
+    samples, info = open_wav(src_path)
+    recording = Recording(src_path, pcm_to_float(samples[:, :1]), info.sample_rate, output_sample_width(info.sample_width))
+    for stage in stages:
+        STAGE_FUNCTIONS[stage](recording)
+
+    outputs = dict(recording.outputs)
+    if "write" in outputs:
+        write_audio(*outputs.pop("write"))
+    outputs["sample_rate"] = recording.sample_rate
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", type=lambda value: value.split(","), default=STAGES, help=f"comma-separated stages to run (default: {','.join(STAGES)})")
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    sharding.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+    sharding.configure(args)
+
+    instrumentation.run(partial(process_audio, args.stages), sharding.shard_path("process_audio"), args)
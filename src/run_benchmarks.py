@@ -0,0 +1,191 @@
+"""Benchmark the processing stages on a synthetic archive.
+
+Reports the throughput and the peak (traced) memory of XML flattening, FHIR bundle
+building, JSON serialization and audio filtering, and the start-up time of the
+scripts (`--help`). Results can be saved as JSON and compared with a previous run
+to make regressions visible:
+
+    python src/run_benchmarks.py --save baseline.json
+    python src/run_benchmarks.py --compare baseline.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from generate_synthetic_archive import RAW_DIR, generate_archive
+
+
+# Relative change in throughput reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+# Scripts whose start-up time (`<script> --help`) is measured
+STARTUP_SCRIPTS = [
+    "export_to_fhir",
+    "extract_xml_to_csv",
+    "filter_audio",
+    "generate_auscultation_locations",
+    "generate_reports",
+    "compute_audio_metrics",
+    "run_pipeline",
+]
+# Number of runs of each script (the median is reported)
+STARTUP_RUNS = 5
+
+
+def benchmark(name, function, items, size_bytes=None):
+    """Run `function` over all `items` and measure throughput and peak memory.
+
+    The function is called once on the first item before measuring, so that
+    dependencies imported on first use do not count towards the benchmark.
+
+    Returns:
+        dict: benchmark name, item count, seconds, items/s, MB/s (if `size_bytes` is given)
+            and peak traced memory in MB
+    """
+    if items:
+        function(items[0])
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "items": len(items),
+        "seconds": round(elapsed, 4),
+        "items_per_s": round(len(items) / elapsed, 2) if elapsed > 0 else None,
+        "mb_per_s": None,
+        "peak_mb": round(peak / 1e6, 2),
+    }
+    if size_bytes is not None and elapsed > 0:
+        result["mb_per_s"] = round(size_bytes / 1e6 / elapsed, 2)
+    return result, results
+
+
+def run_benchmarks(root):
+    """Run all benchmarks on the archive in `root` (the working directory is changed to it)."""
+    os.chdir(root)
+
+    # Imported here so that module-level paths of the scripts resolve inside the archive
+    import filter_audio
+    from export_to_fhir import process_entry
+    from utils.xml_processing import obtain_row_dict
+
+    xml_paths = sorted(glob.glob(os.path.join(RAW_DIR, "*", "*", "Data", "input", "*", "*.xml")))
+    wav_paths = sorted(glob.glob(os.path.join(RAW_DIR, "**", "*_ch1.wav"), recursive=True))
+    results = []
+
+    # XML flattening
+    result, rows = benchmark("xml_flattening", obtain_row_dict, xml_paths, sum(map(os.path.getsize, xml_paths)))
+    results.append(result)
+
+    # FHIR bundle building
+    result, bundles = benchmark("fhir_bundles", lambda row: process_entry(row)[0], rows)
+    results.append(result)
+
+    # JSON serialization (the size is that of the produced JSON)
+    result, documents = benchmark("json_serialization", lambda bundle: bundle.json(indent=4), bundles)
+    size = sum(len(document.encode("utf-8")) for document in documents)
+    result["mb_per_s"] = round(size / 1e6 / result["seconds"], 2) if result["seconds"] > 0 else None
+    results.append(result)
+
+    # Audio filtering, in-process (NumPy/SciPy) and with SoX if available
+    output_dir = tempfile.mkdtemp(dir=root)
+    wav_size = sum(map(os.path.getsize, wav_paths))
+    dst = lambda path: {"default": [os.path.join(output_dir, os.path.basename(path))]}
+    result, _ = benchmark("audio_filtering_numpy", lambda path: filter_audio.apply_filter_batch([path], dst(path)), wav_paths, wav_size)
+    results.append(result)
+    if shutil.which("sox") is not None:
+        result, _ = benchmark("audio_filtering_sox", lambda path: filter_audio.apply_filter(path, dst(path)["default"][0]), wav_paths, wav_size)
+        results.append(result)
+    shutil.rmtree(output_dir)
+
+    return results
+
+
+def benchmark_startup(scripts=STARTUP_SCRIPTS, runs=STARTUP_RUNS):
+    """Measure the start-up time of the scripts as the median wall time of `<script> --help`."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for script in scripts:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, os.path.join(src_dir, script + ".py"), "--help"], check=True, capture_output=True)
+            times.append(time.perf_counter() - start)
+        median = statistics.median(times)
+        results.append({
+            "name": f"startup_{script}",
+            "items": 1,
+            "seconds": round(median, 4),
+            "items_per_s": round(1.0 / median, 2),
+            "mb_per_s": None,
+            "peak_mb": 0.0,
+        })
+    return results
+
+
+def print_results(results, baseline=None):
+    """Print the benchmark results, with the change against `baseline` if given."""
+    baseline = {result["name"]: result for result in baseline or []}
+    print(f"{'Benchmark':<40} {'Items':>7} {'Time [s]':>9} {'Items/s':>10} {'MB/s':>8} {'Peak MB':>8} {'Change':>8}")
+    for result in results:
+        change = ""
+        reference = baseline.get(result["name"])
+        if reference and reference["items_per_s"] and result["items_per_s"]:
+            ratio = result["items_per_s"] / reference["items_per_s"] - 1.0
+            change = f"{ratio:+.0%}" + (" !" if ratio < -REGRESSION_THRESHOLD else "")
+        mb_per_s = "-" if result["mb_per_s"] is None else f"{result['mb_per_s']:.2f}"
+        print(
+            f"{result['name']:<40} {result['items']:>7} {result['seconds']:>9.3f} "
+            f"{result['items_per_s'] or 0:>10.1f} {mb_per_s:>8} {result['peak_mb']:>8.2f} {change:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on a synthetic archive.")
+    parser.add_argument("--root", help="existing archive to benchmark (default: generate a temporary one)")
+    parser.add_argument("--patients", type=int, default=20, help="patients per site of the generated archive")
+    parser.add_argument("--duration", type=float, default=10.0, help="recording duration (s) of the generated archive")
+    parser.add_argument("--save", help="save the results to a JSON file")
+    parser.add_argument("--compare", help="compare with results saved in a JSON file")
+    parser.add_argument("--startup-only", action="store_true", help="only measure the start-up time of the scripts")
+    args = parser.parse_args()
+
+    save_path = os.path.abspath(args.save) if args.save else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = benchmark_startup()
+    if not args.startup_only:
+        root = os.path.abspath(args.root) if args.root else tempfile.mkdtemp(prefix="mscad-benchmark-")
+        try:
+            if args.root is None:
+                generate_archive(root, n_patients=args.patients, duration_s=args.duration)
+            results += run_benchmarks(root)
+        finally:
+            if args.root is None:
+                shutil.rmtree(root, ignore_errors=True)
+
+    print_results(results, baseline)
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
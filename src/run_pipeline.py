@@ -0,0 +1,271 @@
+"""Run the dataset processing scripts as a pipeline of dependent stages.
+
+Each stage declares the files it reads (`inputs`) and writes (`outputs`) as glob
+patterns, and the stages it depends on. A stage is run only if the fingerprint of
+its inputs (paths, sizes and modification times, plus the stage script and the
+`utils` modules) changed since its last successful run, or if some of its outputs
+are missing. Stages whose dependencies are satisfied run concurrently, each as its
+script in a separate process (`python src/<script>.py <args>`), to which the
+`--archive`, `--shard`, `--instrument` and `--profile` options of the pipeline are
+passed on (`--shard` to the scripts which support it).
+
+Usage (from the directory containing the data):
+
+    python src/run_pipeline.py                  # run stale stages
+    python src/run_pipeline.py --force          # run all stages
+    python src/run_pipeline.py filter_audio     # run selected stages (and their stale dependencies)
+    python src/run_pipeline.py --shard 0/4      # run the stages on shard 0 of 4 (state kept per shard)
+"""
+
+import argparse
+import glob
+import hashlib
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from utils import archive_fs, instrumentation, sharding
+from utils.general import read_json_from_file, write_dict_to_json_file
+
+
+STATE_PATH = ".pipeline_state.json"
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Number of stages run at the same time (None: one per CPU)
+N_WORKERS = None
+
+RAW_XML = [
+    "raw_data--anonymised/28-11-2022/*/Data/input/*/*.xml",
+    "raw_data--anonymised/16-03-2022/*/Data/input/*/*.xml",
+]
+RAW_AUDIO = ["raw_data--anonymised/*/*/Data/input/*/*/*.wav"]
+RAW_CH1_AUDIO = ["raw_data--anonymised/*/*/Data/input/*/*/*_ch1.wav"]
+LOCATIONS = ["raw_data--anonymised/*/*/Data/input/*/*/locations.json"]
+
+
+# `script` is run with `args`, and with `--shard` if `sharded`
+Stage = namedtuple("Stage", ["name", "script", "args", "sharded", "inputs", "outputs", "depends"])
+
+STAGES = [
+    Stage(
+        name="generate_auscultation_locations",
+        script="generate_auscultation_locations",
+        args=[],
+        sharded=True,
+        inputs=RAW_CH1_AUDIO,
+        outputs=LOCATIONS,
+        depends=[],
+    ),
+    Stage(
+        name="filter_audio",
+        script="filter_audio",
+        args=[],
+        sharded=True,
+        inputs=RAW_AUDIO,
+        outputs=["filtered/"],
+        depends=[],
+    ),
+    Stage(
+        name="extract_xml_to_csv",
+        script="extract_xml_to_csv",
+        args=[],
+        sharded=True,
+        inputs=RAW_XML,
+        outputs=["extracted/*.csv"],
+        depends=[],
+    ),
+    Stage(
+        name="export_to_fhir",
+        script="export_to_fhir",
+        args=[],
+        sharded=True,
+        inputs=RAW_XML + LOCATIONS,
+        outputs=["fhir--anonymised/"],
+        depends=["generate_auscultation_locations"],
+    ),
+    Stage(
+        name="generate_reports",
+        script="generate_reports",
+        args=[],
+        sharded=False,
+        inputs=RAW_XML + RAW_CH1_AUDIO,
+        outputs=["reports/*.md"],
+        depends=[],
+    ),
+]
+
+
+def run_pipeline(selected=None, force=False, archives=(), instrument=False, profile=False):
+    """Run the stale stages of the pipeline (of the shard set with `utils.sharding`, if any).
+
+    Args:
+        selected (list): names of the stages to run together with their dependencies (default: all)
+        force (bool): run the stages even if their inputs did not change
+        archives (list): archives of the raw data passed to the scripts with `--archive`
+        instrument (bool): run the scripts with `--instrument`
+        profile (bool): run the scripts with `--profile`
+
+    Returns:
+        bool: True if no stage failed
+    """
+    stages = {stage.name: stage for stage in STAGES}
+    to_run = resolve_stages(stages, selected or list(stages))
+    state_path = sharding.shard_path(STATE_PATH)
+    state = read_json_from_file(state_path) if os.path.isfile(state_path) else {}
+    options = get_options(archives, instrument, profile)
+
+    pending = {name: stages[name] for name in to_run}
+    summary = {}
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=N_WORKERS) as executor:
+        while pending or running:
+            # Start every stage whose dependencies completed
+            for name, stage in list(pending.items()):
+                running_names = {running_name for running_name, _ in running.values()}
+                if any(dep in pending or dep in running_names for dep in stage.depends):
+                    continue
+                del pending[name]
+
+                if any(summary.get(dep, {}).get("status") in ("failed", "blocked") for dep in stage.depends):
+                    summary[name] = {"status": "blocked"}
+                    continue
+
+                fingerprint = get_fingerprint(stage, archives)
+                if not force and state.get(name) == fingerprint and outputs_exist(stage):
+                    summary[name] = {"status": "up to date"}
+                    continue
+
+                print(f"Running {name}")
+                running[executor.submit(run_stage, get_command(stage, options))] = (name, fingerprint)
+
+            if not running:
+                continue
+
+            # Wait for any running stage to finish
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, fingerprint = running.pop(future)
+                try:
+                    wall_time, cpu_time = future.result()
+                except Exception as exc:
+                    print(f"Stage {name} failed: {exc!r}", file=sys.stderr)
+                    summary[name] = {"status": "failed"}
+                    continue
+
+                summary[name] = {"status": "ran", "wall": wall_time, "cpu": cpu_time}
+                state[name] = fingerprint
+                write_dict_to_json_file(state, state_path)
+
+    print_summary(to_run, summary)
+    return all(summary[name]["status"] in ("ran", "up to date") for name in to_run)
+
+
+def resolve_stages(stages, selected):
+    """Return the selected stages and their dependencies, in declaration order."""
+    required = set()
+    queue = list(selected)
+    while queue:
+        name = queue.pop()
+        if name not in stages:
+            raise ValueError(f"Unknown stage: {name}")
+        if name not in required:
+            required.add(name)
+            queue.extend(stages[name].depends)
+    return [name for name in stages if name in required]
+
+
+def get_options(archives=(), instrument=False, profile=False):
+    """Options of the pipeline passed on to the scripts (`--shard` is added per stage)."""
+    options = []
+    for archive in archives:
+        options += ["--archive", archive]
+    if profile:
+        options.append("--profile")
+    elif instrument:
+        options.append("--instrument")
+    return options
+
+
+def get_command(stage, options):
+    """Command line running the script of a stage with its arguments and the pipeline options."""
+    command = [sys.executable, os.path.join(SRC_DIR, stage.script + ".py")] + stage.args + options
+    shard = sharding.get_shard()
+    if stage.sharded and shard is not None:
+        command += ["--shard", f"{shard.index}/{shard.count}"]
+    return command
+
+
+def get_fingerprint(stage, archives=()):
+    """Fingerprint the inputs of a stage (paths, sizes, modification times), its code and its arguments.
+
+    The code is the stage script and all modules of `utils`, which the scripts share;
+    the raw data read from archives is fingerprinted by the archives. The arguments are
+    those changing the outputs (not `--instrument` or `--profile`).
+    """
+    paths = set(archives)
+    for pattern in stage.inputs:
+        paths.update(glob.glob(pattern))
+
+    code_paths = [os.path.join(SRC_DIR, stage.script + ".py")] + sorted(glob.glob(os.path.join(SRC_DIR, "utils", "*.py")))
+    digest = hashlib.sha1()
+    digest.update("\0".join(get_command(stage, get_options(archives))[1:]).encode("utf-8") + b"\n")
+    for path in code_paths + sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def outputs_exist(stage):
+    """Check that every output pattern of a stage matches something."""
+    return all(glob.glob(pattern, recursive=True) != [] for pattern in stage.outputs)
+
+
+def run_stage(command):
+    """Run the script of a stage (from a worker process, one stage at a time).
+
+    Returns:
+        tuple: (wall time, CPU time of the script process and its children) in seconds
+    """
+    start_wall = time.perf_counter()
+    start_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = subprocess.run(command)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if result.returncode != 0:
+        raise RuntimeError(f"{os.path.basename(command[1])} exited with status {result.returncode}")
+    cpu = (usage.ru_utime - start_usage.ru_utime) + (usage.ru_stime - start_usage.ru_stime)
+    return time.perf_counter() - start_wall, cpu
+
+
+def print_summary(names, summary):
+    """Print the per-stage timing summary."""
+    print()
+    print(f"{'Stage':<34} {'Status':<11} {'Wall [s]':>9} {'CPU [s]':>9}")
+    for name in names:
+        entry = summary[name]
+        wall = f"{entry['wall']:.2f}" if "wall" in entry else "-"
+        cpu = f"{entry['cpu']:.2f}" if "cpu" in entry else "-"
+        print(f"{name:<34} {entry['status']:<11} {wall:>9} {cpu:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("stages", nargs="*", help="stages to run (default: all)")
+    parser.add_argument("--force", action="store_true", help="run stages even if their inputs did not change")
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    sharding.add_arguments(parser)
+    args = parser.parse_args()
+    sharding.configure(args)
+
+    if not run_pipeline(args.stages, args.force, args.archive, args.instrument, args.profile):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
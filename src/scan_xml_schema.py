@@ -0,0 +1,55 @@
+"""Scan all XML files once and report their schema and the values the extraction would fail on.
+
+Collects the output columns, the fields with their number of files and distinct
+values, and any unknown categorical values or unparseable numbers, prints the
+report and saves it as JSON. Exits with status 1 if the extraction would fail:
+
+    python src/scan_xml_schema.py
+    python src/scan_xml_schema.py "raw_data--anonymised/28-11-2022/*/Data/input/*/*.xml"
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from utils import archive_fs, instrumentation
+from utils.archive_fs import get_filesystem
+from utils.xml_schema import is_fatal, print_schema_report, scan_files
+
+
+XML_PATTERNS = [
+    "raw_data--anonymised/28-11-2022/*/Data/input/*/*.xml",  # Horizon
+    "raw_data--anonymised/16-03-2022/*/Data/input/*/*.xml",  # Sanolla
+]
+OUTPUT_PATH = "schema/xml_schema.json"
+
+
+def scan_xml_schema(patterns=XML_PATTERNS, output_path=OUTPUT_PATH):
+    """Scan the XML files matching `patterns`, print the report and save it to `output_path`.
+
+    Returns:
+        bool: True if the extraction would succeed on all files
+    """
+    fs = get_filesystem()
+    xml_paths = sorted({path for pattern in patterns for path in fs.glob(pattern)})
+    schema = scan_files(xml_paths)
+    print_schema_report(schema)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(schema, f, indent=4)
+    return not is_fatal(schema)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("patterns", nargs="*", default=XML_PATTERNS, help="glob patterns of the XML files")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="path of the JSON report")
+    instrumentation.add_arguments(parser)
+    archive_fs.add_arguments(parser)
+    args = parser.parse_args()
+    archive_fs.configure(args)
+
+    ok = instrumentation.run(lambda: scan_xml_schema(args.patterns, args.output), "scan_xml_schema", args)
+    sys.exit(0 if ok else 1)
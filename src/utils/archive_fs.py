@@ -0,0 +1,360 @@
+"""Read the raw data directly from ZIP/TAR archives, without extracting them.
+
+The scripts address the raw data by its path in the extracted tree
+(`raw_data--anonymised/<dataset>/<site>/Data/input/...`) and go through the
+filesystem returned by `get_filesystem()` for reading. By default this is the
+local filesystem; with `--archive` (see `add_arguments`/`configure`) it is an
+`ArchiveFS`, which overlays the local files on the members of the archives:
+
+    python src/export_to_fhir.py --archive horizon.zip --archive sanolla.tar
+
+The index of the members is built once per archive (the ZIP central directory; the
+TAR headers, cached in `INDEX_CACHE_DIR`). Members stored without compression (ZIP
+"stored" members, uncompressed TAR) are read in place, so WAV files can still be
+memory-mapped (see `locate`); compressed members are streamed. Compressed TAR
+files (`.tar.gz`, ...) can only be read sequentially, and every member opened
+decompresses the archive up to it: use ZIP or uncompressed TAR archives.
+
+Files written by the scripts (e.g. `locations.json`) go to the local tree and take
+precedence over the archive members with the same path.
+"""
+
+import fnmatch
+import glob
+import hashlib
+import io
+import json
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+
+from collections import namedtuple
+
+
+RAW_DIR = "raw_data--anonymised/"
+INDEX_CACHE_DIR = ".archive_index/"
+# Version of the cached TAR indexes (older caches are ignored)
+INDEX_VERSION = 2
+
+# Size of the fixed part of a ZIP local file header
+_ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+
+# Member of an archive: archive number, name in the archive (as stored, e.g. with
+# a leading `./`), size and offset of the data in the archive file (None if the
+# member is compressed)
+Member = namedtuple("Member", ["archive", "name", "size", "offset"])
+
+
+class LocalFS:
+    """The local filesystem, with the interface of `ArchiveFS`."""
+
+    def glob(self, pattern):
+        return glob.glob(pattern)
+
+    def walk(self, top):
+        return os.walk(top)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def getsize(self, path):
+        return os.path.getsize(path)
+
+    def open(self, path, mode="r", encoding=None):
+        return open(path, mode, encoding=encoding)
+
+    def locate(self, path):
+        """Get the file and offset at which the content of `path` is stored (None if compressed)."""
+        return path, 0
+
+
+class ArchiveFS(LocalFS):
+    """Members of ZIP/TAR archives mounted at `mount`, overlaid by the local filesystem."""
+
+    def __init__(self, archive_paths, mount=RAW_DIR):
+        """
+        Args:
+            archive_paths (list): paths to the ZIP/TAR archives
+            mount (str): directory at which the archives are mounted; archives which
+                contain this directory at their top level are mounted at its parent
+        """
+        self.archive_paths = [os.path.abspath(path) for path in archive_paths]
+        self.mount = _normalize(mount)
+        self._files = {}
+        self._dirs = {"": {}}
+        self._compressed_tar = set()
+        self._local = threading.local()
+
+        for archive, archive_path in enumerate(self.archive_paths):
+            if zipfile.is_zipfile(archive_path):
+                members = _zip_members(archive_path)
+            else:
+                members, compressed = _tar_members(archive_path)
+                if compressed:
+                    self._compressed_tar.add(archive)
+            top_level = {name.split("/", 1)[0] for name, _, _, _, _ in members}
+            strip = os.path.basename(self.mount) in top_level and len(top_level) == 1
+            for name, is_dir, size, offset, archive_name in members:
+                relative_name = name.partition("/")[2] if strip else name
+                path = _normalize(os.path.join(self.mount, relative_name))
+                if is_dir:
+                    self._add_dir(path)
+                else:
+                    self._add_dir(os.path.dirname(path))
+                    self._dirs[os.path.dirname(path)][os.path.basename(path)] = False
+                    self._files[path] = Member(archive, archive_name, size, offset)
+
+    def glob(self, pattern):
+        matches = dict.fromkeys(glob.glob(pattern))
+        only_dirs = pattern.endswith("/")
+        parts = _normalize(pattern).split("/")
+
+        candidates = [""]
+        for part in parts:
+            next_candidates = []
+            for candidate in candidates:
+                children = self._dirs.get(candidate)
+                if children is None:
+                    continue
+                if glob.has_magic(part):
+                    names = fnmatch.filter(children, part)
+                    if not part.startswith("."):
+                        names = [name for name in names if not name.startswith(".")]
+                else:
+                    names = [part] if part in children else []
+                next_candidates += [os.path.join(candidate, name) if candidate else name for name in names]
+            candidates = next_candidates
+
+        for path in candidates:
+            if only_dirs:
+                if path in self._dirs:
+                    matches.setdefault(path + "/")
+            else:
+                matches.setdefault(path)
+        return list(matches)
+
+    def walk(self, top):
+        dirs, files = [], []
+        for name in self.listdir(top):
+            (dirs if self.isdir(os.path.join(top, name)) else files).append(name)
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(os.path.join(top, name))
+
+    def listdir(self, path):
+        children = self._dirs.get(_normalize(path))
+        if os.path.isdir(path):
+            names = os.listdir(path)
+            seen = set(names)
+            return names + [name for name in children or {} if name not in seen]
+        if children is None:
+            raise FileNotFoundError(f"No such directory: {path}")
+        return list(children)
+
+    def isdir(self, path):
+        return os.path.isdir(path) or _normalize(path) in self._dirs
+
+    def isfile(self, path):
+        return os.path.isfile(path) or _normalize(path) in self._files
+
+    def getsize(self, path):
+        if os.path.exists(path):
+            return os.path.getsize(path)
+        return self._member(path).size
+
+    def open(self, path, mode="r", encoding=None):
+        if os.path.exists(path) or "r" not in mode:
+            return open(path, mode, encoding=encoding)
+        member = self._member(path)
+
+        if member.offset is not None:
+            f = _MemberReader(self.archive_paths[member.archive], member.offset, member.size)
+            f = io.BufferedReader(f)
+        elif member.archive in self._compressed_tar:
+            f = self._handle(member.archive).extractfile(member.name)
+        else:
+            f = self._handle(member.archive).open(member.name)
+
+        if "b" in mode:
+            return f
+        return io.TextIOWrapper(f, encoding=encoding)
+
+    def locate(self, path):
+        if os.path.exists(path):
+            return path, 0
+        member = self._member(path)
+        if member.offset is None:
+            return None
+        return self.archive_paths[member.archive], member.offset
+
+    def _member(self, path):
+        member = self._files.get(_normalize(path))
+        if member is None:
+            raise FileNotFoundError(f"No such file: {path}")
+        return member
+
+    def _add_dir(self, path):
+        """Add a directory and its missing parents to the index."""
+        child = None
+        while True:
+            is_new = path not in self._dirs
+            children = self._dirs.setdefault(path, {})
+            if child is not None:
+                children[child] = True
+            if not is_new:
+                return
+            path, child = os.path.dirname(path), os.path.basename(path)
+
+    def _handle(self, archive):
+        # Archive handles are shared neither with forked worker processes nor between
+        # threads (the members of a compressed TAR are read from the stream of its handle)
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.handles = {}
+            self._local.pid = os.getpid()
+        handles = self._local.handles
+        if archive not in handles:
+            archive_path = self.archive_paths[archive]
+            if archive in self._compressed_tar:
+                handles[archive] = tarfile.open(archive_path)
+            else:
+                handles[archive] = zipfile.ZipFile(archive_path)
+        return handles[archive]
+
+
+class _MemberReader(io.RawIOBase):
+    """Read-only file for a range of bytes of an archive file."""
+
+    def __init__(self, path, offset, size):
+        self._f = open(path, "rb")
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._size - self._position)
+        if n <= 0:
+            return 0
+        self._f.seek(self._offset + self._position)
+        n = self._f.readinto(memoryview(buffer)[:n])
+        self._position += n
+        return n
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self._position
+        elif whence == io.SEEK_END:
+            position += self._size
+        self._position = max(position, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def _normalize(path):
+    """Normalize a path to the form used in the index (relative, no trailing slash)."""
+    if os.path.isabs(path):
+        path = os.path.relpath(path)
+    path = os.path.normpath(path)
+    return "" if path == "." else path
+
+
+def _zip_members(archive_path):
+    """List the members of a ZIP archive as (name, is_dir, size, data offset, name in the archive)."""
+    members = []
+    with zipfile.ZipFile(archive_path) as zip_f, open(archive_path, "rb") as f:
+        for info in zip_f.infolist():
+            offset = None
+            if info.compress_type == zipfile.ZIP_STORED and not info.is_dir():
+                # The data follows the local header, whose variable fields may differ from the central directory
+                f.seek(info.header_offset)
+                header = _ZIP_LOCAL_HEADER.unpack(f.read(_ZIP_LOCAL_HEADER.size))
+                offset = info.header_offset + _ZIP_LOCAL_HEADER.size + header[9] + header[10]
+            members.append((_normalize(info.filename), info.is_dir(), info.file_size, offset, info.filename))
+    return members
+
+
+def _tar_members(archive_path):
+    """List the members of a TAR archive as (name, is_dir, size, data offset, name in the archive).
+
+    The list is cached in `INDEX_CACHE_DIR` (reading all headers of a large archive
+    takes a while); members of compressed archives have no offset.
+
+    Returns:
+        tuple: (members, whether the archive is compressed)
+    """
+    stat = os.stat(archive_path)
+    key = hashlib.sha1(f"{INDEX_VERSION}:{archive_path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    cache_path = os.path.join(INDEX_CACHE_DIR, key + ".json")
+    if os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+        return [tuple(member) for member in cache["members"]], cache["compressed"]
+
+    with tarfile.open(archive_path) as tar_f:
+        compressed = not isinstance(tar_f.fileobj, io.BufferedReader)
+        members = [
+            (
+                _normalize(info.name),
+                info.isdir(),
+                info.size,
+                None if compressed or not info.isfile() else info.offset_data,
+                info.name,
+            )
+            for info in tar_f.getmembers()
+            if info.isdir() or info.isfile()
+        ]
+
+    os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump({"archive": archive_path, "compressed": compressed, "members": members}, f)
+    return members, compressed
+
+
+_filesystem = LocalFS()
+
+
+def get_filesystem():
+    """Get the filesystem the raw data is read from."""
+    return _filesystem
+
+
+def set_filesystem(filesystem):
+    """Set the filesystem the raw data is read from."""
+    global _filesystem
+    _filesystem = filesystem
+
+
+def add_arguments(parser):
+    """Add the `--archive` option to an argument parser."""
+    parser.add_argument(
+        "--archive",
+        action="append",
+        default=[],
+        metavar="PATH",
+        help="read the raw data from a ZIP/TAR archive instead of the extracted tree (repeatable)",
+    )
+
+
+def configure(args, mount=RAW_DIR):
+    """Mount the archives given with `--archive` (if any) at `mount`."""
+    if args.archive:
+        set_filesystem(ArchiveFS(args.archive, mount))
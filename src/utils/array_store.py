@@ -0,0 +1,153 @@
+"""Chunked, memory-mappable store of many arrays of a single dtype.
+
+Arrays are appended one after another into large raw shard files
+(`shard-00000.bin`, `shard-00001.bin`, ...). The `index.json` file lists, for every
+array, its metadata together with the shard, byte offset and shape, so readers can
+memory-map a shard and get any array as a zero-copy view.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+from utils.instrumentation import add_bytes_written
+
+
+INDEX_FILENAME = "index.json"
+SHARD_FORMAT = "shard-{:05d}.bin"
+# Shards are closed once they grow beyond this size
+SHARD_SIZE_MB = 256
+
+
+class ArrayStoreWriter:
+    """Write arrays into a new store (the directory is replaced)."""
+
+    def __init__(self, root, dtype="float32", shard_size_mb=SHARD_SIZE_MB, metadata=None):
+        """
+        Args:
+            root (str): directory of the store
+            dtype (str): dtype of all stored arrays
+            shard_size_mb (float): size after which a new shard is started
+            metadata (dict): store-level metadata saved in the index
+        """
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        self.shard_size = int(shard_size_mb * 1e6)
+        self.metadata = metadata or {}
+        self.entries = []
+
+        self._shard_id = -1
+        self._shard_file = None
+        self._offset = 0
+
+        if os.path.isdir(root):
+            shutil.rmtree(root)
+        os.makedirs(root)
+
+    def append(self, array, **metadata):
+        """Append an array and record it in the index with the given metadata.
+
+        Returns:
+            int: position of the array in the index
+        """
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if self._shard_file is None or self._offset >= self.shard_size:
+            self._next_shard()
+
+        self._shard_file.write(array.tobytes())
+        self.entries.append({
+            **metadata,
+            "shard": SHARD_FORMAT.format(self._shard_id),
+            "offset": self._offset,
+            "shape": list(array.shape),
+        })
+        self._offset += array.nbytes
+        add_bytes_written(array.nbytes)
+        return len(self.entries) - 1
+
+    def close(self):
+        """Close the current shard and write the index, which makes the store readable."""
+        self._close_shard()
+        index = {"dtype": self.dtype.str, "metadata": self.metadata, "entries": self.entries}
+        index_path = os.path.join(self.root, INDEX_FILENAME)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def _close_shard(self):
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._shard_file = None
+
+    def _next_shard(self):
+        self._close_shard()
+        self._shard_id += 1
+        self._offset = 0
+        self._shard_file = open(os.path.join(self.root, SHARD_FORMAT.format(self._shard_id)), "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A store left incomplete by an error has no index, so that it cannot be read
+        if exc_type is None:
+            self.close()
+        else:
+            self._close_shard()
+
+
+class ArrayStoreReader:
+    """Read arrays of a store as zero-copy views of memory-mapped shards."""
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): directory of the store
+        """
+        self.root = root
+        with open(os.path.join(root, INDEX_FILENAME)) as f:
+            index = json.load(f)
+        self.dtype = np.dtype(index["dtype"])
+        self.metadata = index["metadata"]
+        self.entries = index["entries"]
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, position):
+        """Return the array at `position` in the index (read-only view)."""
+        entry = self.entries[position]
+        shard = self._shard(entry["shard"])
+        start = entry["offset"] // self.dtype.itemsize
+        size = int(np.prod(entry["shape"]))
+        return shard[start:start + size].reshape(entry["shape"])
+
+    def find(self, **metadata):
+        """Return the positions of the entries matching all the given metadata values."""
+        return [
+            position for position, entry in enumerate(self.entries)
+            if all(entry.get(key) == value for key, value in metadata.items())
+        ]
+
+    def group_by(self, *keys):
+        """Index the entries by the values of the given metadata keys.
+
+        Returns:
+            dict: tuple of metadata values -> list of positions
+        """
+        groups = {}
+        for position, entry in enumerate(self.entries):
+            groups.setdefault(tuple(entry.get(key) for key in keys), []).append(position)
+        return groups
+
+    def _shard(self, name):
+        if name not in self._shards:
+            path = os.path.join(self.root, name)
+            if os.path.getsize(path) == 0:
+                self._shards[name] = np.zeros(0, dtype=self.dtype)
+            else:
+                self._shards[name] = np.memmap(path, dtype=self.dtype, mode="r")
+        return self._shards[name]
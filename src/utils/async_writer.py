@@ -0,0 +1,137 @@
+"""Background file writer overlapping small-file writes with CPU work.
+
+On a network filesystem each open/write/close of a small file (a bundle, a
+`locations.json`) has a high latency. `BackgroundWriter` hands the writes to a few
+threads through a bounded queue, so that the caller keeps building the next bundle
+while earlier ones are written:
+
+    with BackgroundWriter() as writer:
+        for ...:
+            dump_json_to_file(path, bundle_json, writer=writer)
+
+`submit` blocks once `queue_size` writes are pending. A failed write is raised
+again (the original exception) by the next `submit`, `flush` or `close`, and the
+remaining writes are dropped. With `fsync="file"` every file is fsynced after it
+is written, with `fsync="flush"` all written files are fsynced on `flush`/`close`
+and with `fsync="never"` it is left to the operating system.
+"""
+
+import os
+import queue
+import threading
+
+from utils.instrumentation import add_bytes_written
+
+
+N_THREADS = 4
+QUEUE_SIZE = 64
+FSYNC_POLICIES = ("never", "file", "flush")
+
+# Sent to the threads to stop them
+_STOP = None
+
+
+class BackgroundWriter:
+    """Write files from a bounded queue in background threads."""
+
+    def __init__(self, n_threads=N_THREADS, queue_size=QUEUE_SIZE, fsync="never"):
+        """
+        Args:
+            n_threads (int): number of writing threads (concurrent writes)
+            queue_size (int): number of pending writes after which `submit` blocks
+            fsync (str): fsync policy, one of `FSYNC_POLICIES`
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.fsync = fsync
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._lock = threading.Lock()
+        self._unsynced = []
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(n_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, path, data, encoding="utf-8"):
+        """Queue writing `data` (str or bytes) to `path`, blocking if the queue is full."""
+        if self._closed:
+            raise RuntimeError("BackgroundWriter is closed")
+        self._raise_error()
+        if isinstance(data, str):
+            data = data.encode(encoding)
+        add_bytes_written(len(data))
+        self._queue.put((path, data))
+
+    def flush(self):
+        """Wait until all queued files are written (and fsynced with `fsync="flush"`)."""
+        self._queue.join()
+        self._raise_error()
+        if self.fsync == "flush":
+            with self._lock:
+                paths, self._unsynced = self._unsynced, []
+            for path in paths:
+                _fsync_path(path)
+
+    def close(self):
+        """Flush the queue and stop the threads."""
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            for _ in self._threads:
+                self._queue.put(_STOP)
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Do not hide the original exception behind a write error
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if self._error is None:
+                    self._write(*item)
+            except Exception as error:
+                with self._lock:
+                    if self._error is None:
+                        self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+            if self.fsync == "file":
+                f.flush()
+                os.fsync(f.fileno())
+        if self.fsync == "flush":
+            with self._lock:
+                self._unsynced.append(path)
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,433 @@
+"""Audio input/output and framing utilities."""
+
+import os
+import struct
+import threading
+import wave
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.archive_fs import get_filesystem
+from utils.instrumentation import add_bytes_written
+
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Sample dtypes which can be memory-mapped directly: (format tag, bytes per sample) -> dtype
+WAV_DTYPES = {
+    (WAVE_FORMAT_PCM, 1): np.dtype("u1"),
+    (WAVE_FORMAT_PCM, 2): np.dtype("<i2"),
+    (WAVE_FORMAT_PCM, 4): np.dtype("<i4"),
+    (WAVE_FORMAT_IEEE_FLOAT, 4): np.dtype("<f4"),
+    (WAVE_FORMAT_IEEE_FLOAT, 8): np.dtype("<f8"),
+}
+
+
+# Audio file extensions read by `open_audio` and written by `write_audio`
+AUDIO_EXTENSIONS = (".wav", ".flac")
+
+# FLAC stores at most 24 bits per sample: bytes per sample -> soundfile subtype
+FLAC_SUBTYPES = {2: "PCM_16", 4: "PCM_24"}
+# soundfile subtype -> (dtype decoded into, bytes per sample on disk)
+FLAC_DTYPES = {"PCM_16": (np.dtype("<i2"), 2), "PCM_24": (np.dtype("<i4"), 3)}
+
+# Number of threads of `ParallelAudioWriter`
+N_WRITER_THREADS = 4
+
+
+WavInfo = namedtuple("WavInfo", ["sample_rate", "channels", "sample_width", "format_tag", "data_offset", "n_frames"])
+
+
+def read_wav_info(path):
+    """Read the header of a WAV file and locate its sample data.
+
+    Args:
+        path (str): path to the WAV file
+
+    Returns:
+        WavInfo: sample rate, number of channels, bytes per sample, format tag,
+            byte offset of the sample data and number of frames
+    """
+    fs = get_filesystem()
+    with fs.open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"Not a RIFF/WAVE file: {path}")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in WAV file: {path}")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+
+            if chunk_id == b"fmt ":
+                fmt_chunk = f.read(chunk_size + (chunk_size & 1))
+                format_tag, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", fmt_chunk[:16])
+                # The extensible format stores the actual format tag in the sub-format GUID
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                    format_tag = struct.unpack("<H", fmt_chunk[24:26])[0]
+                fmt = (format_tag, channels, sample_rate, bits // 8)
+
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"Data chunk before format chunk in WAV file: {path}")
+                format_tag, channels, sample_rate, sample_width = fmt
+                data_offset = f.tell()
+                # Streamed WAVs may carry a placeholder chunk size, trust the file size instead
+                data_size = min(chunk_size, fs.getsize(path) - data_offset)
+                n_frames = data_size // (channels * sample_width)
+                return WavInfo(sample_rate, channels, sample_width, format_tag, data_offset, n_frames)
+
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def open_wav(path):
+    """Memory-map the samples of a WAV file.
+
+    The samples are not decoded: the returned array has the on-disk dtype
+    (use `pcm_to_float` to convert a slice of it). 24-bit PCM cannot be mapped
+    and is read into memory as 32-bit integers instead, as are compressed
+    archive members (see `utils.archive_fs`).
+
+    Args:
+        path (str): path to the WAV file
+
+    Returns:
+        tuple: (samples of shape (n_frames, channels), WavInfo)
+    """
+    info = read_wav_info(path)
+    shape = (info.n_frames, info.channels)
+
+    fs = get_filesystem()
+    dtype = WAV_DTYPES.get((info.format_tag, info.sample_width))
+    if dtype is not None:
+        if info.n_frames == 0:
+            return np.zeros(shape, dtype=dtype), info
+        location = fs.locate(path)
+        if location is None:
+            with fs.open(path, "rb") as f:
+                f.seek(info.data_offset)
+                data = f.read(info.n_frames * info.channels * info.sample_width)
+            return np.frombuffer(data, dtype=dtype).reshape(shape), info
+        file_path, offset = location
+        samples = np.memmap(file_path, dtype=dtype, mode="r", offset=offset + info.data_offset, shape=shape)
+        return samples, info
+
+    if info.format_tag == WAVE_FORMAT_PCM and info.sample_width == 3:
+        with fs.open(path, "rb") as f:
+            f.seek(info.data_offset)
+            data = np.frombuffer(f.read(info.n_frames * info.channels * 3), dtype=np.uint8)
+        # Place the three little-endian bytes in the upper part of an int32
+        padded = np.zeros((data.size // 3, 4), dtype=np.uint8)
+        padded[:, 1:] = data.reshape(-1, 3)
+        return padded.view("<i4").reshape(shape), info
+
+    raise ValueError(f"Unsupported WAV sample format {info.format_tag}/{info.sample_width * 8} bit: {path}")
+
+
+def open_flac(path):
+    """Decode the samples of a FLAC file into memory.
+
+    The samples are decoded straight to integers (int16 for 16-bit, int32 for
+    24-bit files, as 24-bit WAV files by `open_wav`) without a float conversion,
+    so that the result can be used like that of `open_wav`.
+
+    Returns:
+        tuple: (samples of shape (n_frames, channels), WavInfo without data offset)
+    """
+    # Imported on first use, only needed for FLAC files
+    import soundfile
+
+    with get_filesystem().open(path, "rb") as f, soundfile.SoundFile(f) as sound_f:
+        if sound_f.subtype not in FLAC_DTYPES:
+            raise ValueError(f"Unsupported FLAC sample format {sound_f.subtype}: {path}")
+        dtype, sample_width = FLAC_DTYPES[sound_f.subtype]
+        samples = sound_f.read(dtype=dtype.name, always_2d=True)
+        info = WavInfo(sound_f.samplerate, sound_f.channels, sample_width, WAVE_FORMAT_PCM, None, len(samples))
+    return samples, info
+
+
+def open_audio(path):
+    """Open the samples of a WAV (memory-mapped, see `open_wav`) or FLAC file (decoded, see `open_flac`).
+
+    Returns:
+        tuple: (samples of shape (n_frames, channels), WavInfo)
+    """
+    if path.endswith(".flac"):
+        return open_flac(path)
+    return open_wav(path)
+
+
+def pcm_to_float(samples):
+    """Convert raw WAV samples to float32 in the range [-1, 1)."""
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128.0) / 128.0
+    if samples.dtype.kind == "i":
+        return samples.astype(np.float32) / float(2 ** (8 * samples.dtype.itemsize - 1))
+    return samples.astype(np.float32)
+
+
+def read_wav(path):
+    """Read a WAV file into memory as float32.
+
+    Returns:
+        tuple: (samples of shape (n_frames, channels), sample rate)
+    """
+    samples, info = open_wav(path)
+    return pcm_to_float(samples), info.sample_rate
+
+
+def read_audio(path):
+    """Read a WAV or FLAC file into memory as float32.
+
+    Returns:
+        tuple: (samples of shape (n_frames, channels), sample rate)
+    """
+    samples, info = open_audio(path)
+    return pcm_to_float(samples), info.sample_rate
+
+
+def output_sample_width(sample_width):
+    """Sample width of the written PCM samples for a source of `sample_width` bytes per sample.
+
+    Sources of more than 16 bits (24-bit, 32-bit or float) are written as 32-bit PCM,
+    the others as 16-bit PCM (the widths supported by `float_to_pcm`).
+    """
+    return 4 if sample_width > 2 else 2
+
+
+def float_to_pcm(samples, sample_width=2):
+    """Convert float samples in the range [-1, 1] to PCM integers (clipped).
+
+    Args:
+        samples (np.ndarray): float samples
+        sample_width (int): bytes per sample, 2 (16-bit) or 4 (32-bit)
+
+    Returns:
+        np.ndarray: little-endian integer samples of the same shape
+    """
+    if sample_width not in (2, 4):
+        raise ValueError(f"Unsupported sample width: {sample_width}")
+    scale = float(2 ** (8 * sample_width - 1))
+    samples = np.asarray(samples, dtype=np.float64)
+    return np.clip(np.round(samples * scale), -scale, scale - 1).astype(f"<i{sample_width}")
+
+
+def write_wav(path, samples, sample_rate, sample_width=2):
+    """Write float samples in the range [-1, 1] to a PCM WAV file.
+
+    Args:
+        path (str): path to the WAV file
+        samples (np.ndarray): samples of shape (n_frames,) or (n_frames, channels)
+        sample_rate (int): sample rate in Hz
+        sample_width (int): bytes per sample, 2 (16-bit) or 4 (32-bit)
+    """
+    pcm = float_to_pcm(samples, sample_width)
+    if pcm.ndim == 1:
+        pcm = pcm[:, np.newaxis]
+
+    with wave.open(path, "wb") as wav_f:
+        wav_f.setnchannels(pcm.shape[1])
+        wav_f.setsampwidth(sample_width)
+        wav_f.setframerate(int(sample_rate))
+        wav_f.writeframes(pcm.tobytes())
+    add_bytes_written(pcm.nbytes)
+
+
+def write_flac(path, samples, sample_rate, sample_width=2):
+    """Write float samples in the range [-1, 1] to a FLAC file.
+
+    Args:
+        path (str): path to the FLAC file
+        samples (np.ndarray): samples of shape (n_frames,) or (n_frames, channels)
+        sample_rate (int): sample rate in Hz
+        sample_width (int): bytes per sample of the PCM samples, 2 (16-bit) or 4
+            (stored as 24-bit, the maximum of FLAC)
+    """
+    # Imported on first use, only needed for FLAC files
+    import soundfile
+
+    pcm = float_to_pcm(samples, sample_width)
+    soundfile.write(path, pcm, int(sample_rate), format="FLAC", subtype=FLAC_SUBTYPES[sample_width])
+    add_bytes_written(os.path.getsize(path))
+
+
+def write_audio(path, samples, sample_rate, sample_width=2):
+    """Write float samples in the range [-1, 1] to a WAV or FLAC file (by the extension of `path`)."""
+    if path.endswith(".flac"):
+        write_flac(path, samples, sample_rate, sample_width)
+    else:
+        write_wav(path, samples, sample_rate, sample_width)
+
+
+class AudioFileWriter:
+    """Write float samples in the range [-1, 1] to a WAV or FLAC file block by block.
+
+    The file is the same as that written by `write_audio` with all the blocks at once:
+
+        with AudioFileWriter(path, sample_rate, channels) as audio_f:
+            for block in blocks:
+                audio_f.write(block)
+    """
+
+    def __init__(self, path, sample_rate, channels=1, sample_width=2):
+        """
+        Args:
+            path (str): path to the WAV or FLAC file (by its extension)
+            sample_rate (int): sample rate in Hz
+            channels (int): number of channels
+            sample_width (int): bytes per sample, 2 (16-bit) or 4 (32-bit, 24-bit in FLAC files)
+        """
+        self.path = path
+        self.sample_width = sample_width
+        if path.endswith(".flac"):
+            # Imported on first use, only needed for FLAC files
+            import soundfile
+
+            self._wav_f = None
+            self._flac_f = soundfile.SoundFile(
+                path, "w", int(sample_rate), channels, subtype=FLAC_SUBTYPES[sample_width], format="FLAC"
+            )
+        else:
+            self._flac_f = None
+            self._wav_f = wave.open(path, "wb")
+            self._wav_f.setnchannels(channels)
+            self._wav_f.setsampwidth(sample_width)
+            self._wav_f.setframerate(int(sample_rate))
+
+    def write(self, samples):
+        """Append samples of shape (n_frames,) or (n_frames, channels)."""
+        pcm = float_to_pcm(samples, self.sample_width)
+        if pcm.ndim == 1:
+            pcm = pcm[:, np.newaxis]
+        if self._flac_f is not None:
+            self._flac_f.write(pcm)
+        else:
+            self._wav_f.writeframes(pcm.tobytes())
+            add_bytes_written(pcm.nbytes)
+
+    def close(self):
+        """Finish the file (header of WAV files, last frames of FLAC files)."""
+        if self._flac_f is not None:
+            self._flac_f.close()
+            add_bytes_written(os.path.getsize(self.path))
+        else:
+            self._wav_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ParallelAudioWriter:
+    """Encode and write audio files in a pool of threads.
+
+    Encoding FLAC is CPU-bound, but libsndfile (like a SoX process) runs without
+    the GIL, so files are encoded in parallel while the caller filters the next
+    recordings:
+
+        with ParallelAudioWriter() as writer:
+            writer.write("filtered/.../10_31_07_ch1.flac", samples, sample_rate)
+
+    `write` and `submit` block once `2 * n_threads` files are pending. A failed
+    write is raised again (the original exception) by the next `write`, `submit`
+    or by `close`.
+    """
+
+    def __init__(self, n_threads=N_WRITER_THREADS):
+        """
+        Args:
+            n_threads (int): number of encoding threads
+        """
+        self._executor = ThreadPoolExecutor(max_workers=n_threads)
+        self._slots = threading.BoundedSemaphore(2 * n_threads)
+        self._futures = []
+
+    def write(self, path, samples, sample_rate, sample_width=2):
+        """Queue writing float samples to a WAV or FLAC file (see `write_audio`)."""
+        self.submit(write_audio, path, samples, sample_rate, sample_width)
+
+    def submit(self, function, *args):
+        """Queue a call writing a file (e.g. running SoX), blocking if too many are pending."""
+        self._raise_errors()
+        self._slots.acquire()
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def close(self):
+        """Wait until all queued files are written and stop the threads."""
+        try:
+            for future in self._futures:
+                future.result()
+            self._futures = []
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Do not hide the original exception behind a write error
+        self._executor.shutdown(cancel_futures=True)
+
+    def _raise_errors(self):
+        pending = []
+        for future in self._futures:
+            if not future.done():
+                pending.append(future)
+            elif future.exception() is not None:
+                raise future.exception()
+        self._futures = pending
+
+
+def frame_signal(samples, frame_length, hop_length):
+    """Split a signal into (possibly overlapping) frames without copying.
+
+    Trailing samples which do not fill a whole frame are dropped.
+
+    Args:
+        samples (np.ndarray): samples of shape (n_frames, ...)
+        frame_length (int): number of samples per frame
+        hop_length (int): number of samples between frame starts
+
+    Returns:
+        np.ndarray: read-only view of shape (n_windows, frame_length, ...)
+    """
+    if len(samples) < frame_length:
+        return np.zeros((0, frame_length) + samples.shape[1:], dtype=samples.dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(samples, frame_length, axis=0)[::hop_length]
+    # `sliding_window_view` appends the window axis, move it next to the frame axis
+    return np.moveaxis(windows, -1, 1)
+
+
+def list_wav_files(root, extensions=(".wav",)):
+    """List all WAV files (or the audio files with one of `extensions`) below `root`, sorted by path."""
+    wav_paths = []
+    for directory, _, files in get_filesystem().walk(root):
+        for file in files:
+            if file.endswith(extensions):
+                wav_paths.append(os.path.join(directory, file))
+    return sorted(wav_paths)
+
+
+def list_audio_files(root):
+    """List all WAV and FLAC files below `root`, sorted by path."""
+    return list_wav_files(root, AUDIO_EXTENSIONS)
+
+
+def recording_filename(path):
+    """Filename of the raw WAV recording of a (possibly FLAC) filtered file, e.g. `10_31_07_ch1.flac` -> `10_31_07_ch1.wav`."""
+    return os.path.splitext(os.path.basename(path))[0] + ".wav"
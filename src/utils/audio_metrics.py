@@ -0,0 +1,122 @@
+"""Audio quality metrics computed over fixed-size frames."""
+
+import numpy as np
+
+from utils.audio import open_audio, pcm_to_float
+
+
+# Number of samples per analysis frame
+FRAME_LENGTH = 2048
+# Number of frames decoded at once (bounds the memory used per file)
+BLOCK_FRAMES = 256
+# Absolute sample value at which a sample is considered clipped
+CLIP_LEVEL = 0.999
+# Frames with RMS below this level (dBFS) are considered silent
+SILENCE_DB = -50.0
+# Share of the quietest/loudest frames used to estimate the noise floor/signal level
+SNR_QUANTILE = 0.1
+# Frequency band (Hz) targeted by `filter_audio.apply_filter`
+BAND = (70, 800)
+
+METRICS_COLUMNS = [
+    "path",
+    "sample_rate",
+    "channels",
+    "duration_s",
+    "rms_dbfs",
+    "peak_dbfs",
+    "clipping_ratio",
+    "silence_fraction",
+    "snr_db",
+    "band_energy_ratio",
+]
+
+
+def compute_metrics(samples, sample_rate, band=BAND):
+    """Compute quality metrics of a recording.
+
+    Sample-level statistics use every sample, frame-level statistics (silence,
+    SNR, band energy) use the whole frames of `FRAME_LENGTH` samples only.
+
+    Args:
+        samples (np.ndarray): raw or float samples of shape (n_frames, channels)
+        sample_rate (int): sample rate in Hz
+        band (tuple): lower and upper edge (Hz) of the band whose energy share is reported
+
+    Returns:
+        dict: metrics named as in `METRICS_COLUMNS` (without `path`)
+    """
+    n_samples, channels = samples.shape
+    n_frames = n_samples // FRAME_LENGTH
+
+    window = np.hanning(FRAME_LENGTH).astype(np.float32)[np.newaxis, :, np.newaxis]
+    freqs = np.fft.rfftfreq(FRAME_LENGTH, d=1.0 / sample_rate)
+    band_mask = (freqs >= band[0]) & (freqs <= band[1])
+
+    sum_squares = 0.0
+    peak = 0.0
+    n_clipped = 0
+    band_power = 0.0
+    total_power = 0.0
+    frame_powers = []
+
+    block_length = BLOCK_FRAMES * FRAME_LENGTH
+    for start in range(0, n_samples, block_length):
+        block = pcm_to_float(samples[start:start + block_length])
+
+        # Sample-level statistics
+        abs_block = np.abs(block)
+        sum_squares += float(np.dot(block.ravel(), block.ravel()))
+        peak = max(peak, float(abs_block.max()))
+        n_clipped += int(np.count_nonzero(abs_block >= CLIP_LEVEL))
+
+        # Frame-level statistics over the whole frames of the block
+        k = len(block) // FRAME_LENGTH
+        if k == 0:
+            continue
+        frames = block[:k * FRAME_LENGTH].reshape(k, FRAME_LENGTH, channels)
+        frame_powers.append(np.mean(frames ** 2, axis=(1, 2)))
+
+        spectrum = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+        band_power += float(spectrum[:, band_mask].sum())
+        total_power += float(spectrum.sum())
+
+    metrics = {
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "duration_s": round(n_samples / sample_rate, 3),
+        "rms_dbfs": _to_db(sum_squares / max(n_samples * channels, 1), power=True),
+        "peak_dbfs": _to_db(peak),
+        "clipping_ratio": round(n_clipped / max(n_samples * channels, 1), 6),
+        "silence_fraction": None,
+        "snr_db": None,
+        "band_energy_ratio": None,
+    }
+
+    if n_frames > 0:
+        frame_powers = np.sort(np.concatenate(frame_powers))
+        frame_db = 10.0 * np.log10(np.maximum(frame_powers, 1e-12))
+        n_edge = max(1, int(n_frames * SNR_QUANTILE))
+        noise = np.mean(frame_powers[:n_edge])
+        signal = np.mean(frame_powers[-n_edge:])
+
+        metrics["silence_fraction"] = round(float(np.mean(frame_db < SILENCE_DB)), 4)
+        metrics["snr_db"] = round(10.0 * np.log10(max(signal, 1e-12) / max(noise, 1e-12)), 2)
+        metrics["band_energy_ratio"] = round(band_power / total_power, 4) if total_power > 0 else 0.0
+
+    return metrics
+
+
+def compute_file_metrics(path):
+    """Compute quality metrics of a WAV file (memory-mapped, decoded block by block) or of a FLAC file."""
+    samples, info = open_audio(path)
+    metrics = compute_metrics(samples, info.sample_rate)
+    metrics["path"] = path
+    return metrics
+
+
+def _to_db(value, power=False):
+    """Convert an amplitude (or power) to decibels relative to full scale."""
+    value = max(float(value), 1e-12)
+    return round((10.0 if power else 20.0) * np.log10(value), 2)
+
@@ -0,0 +1,129 @@
+"""Compact storage of the flattened rows of the XML files.
+
+A row dict from `obtain_row_dict` holds ~100 prefixed keys and mostly short,
+repeated lowercase values, so keeping thousands of them in memory duplicates the
+same key and value objects over and over. `CompactTable` keeps one interned schema
+for all rows and stores every column dictionary-encoded (a list of distinct values
+and an array of 32-bit codes), which takes several times less memory:
+
+    table = CompactTable()
+    for xml_path in xml_paths:
+        table.append(obtain_row_dict(xml_path))
+    for row in table:  # `CompactRow`s, read-only mappings with dict-like `get`
+        row.get("Country")
+
+Keys missing from a row (code 0) are not part of its mapping, keys set to None are,
+so that a `CompactRow` compares equal to the row dict it was built from.
+"""
+
+import sys
+
+from array import array
+from collections.abc import Mapping
+
+
+# Decoded value of the keys missing from a row
+_MISSING = object()
+
+
+class CompactColumn:
+    """Dictionary-encoded column: distinct values and one code per row (0 if missing)."""
+
+    __slots__ = ("values", "codes", "_lookup")
+
+    def __init__(self, n_rows=0):
+        self.values = [_MISSING]
+        self.codes = array("I", bytes(4 * n_rows))
+        self._lookup = {}
+
+    def append(self, value):
+        # The type is part of the key so that True, 1 and 1.0 are encoded separately
+        key = (type(value), value)
+        code = self._lookup.get(key)
+        if code is None:
+            code = self._lookup[key] = len(self.values)
+            self.values.append(sys.intern(value) if type(value) is str else value)
+        self.codes.append(code)
+
+    def __getitem__(self, position):
+        return self.values[self.codes[position]]
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class CompactRow(Mapping):
+    """Read-only view of one row of a `CompactTable`."""
+
+    __slots__ = ("_table", "_position")
+
+    def __init__(self, table, position):
+        self._table = table
+        self._position = position
+
+    def __getitem__(self, key):
+        column = self._table.columns.get(key)
+        value = _MISSING if column is None else column[self._position]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        column = self._table.columns.get(key)
+        value = _MISSING if column is None else column[self._position]
+        return default if value is _MISSING else value
+
+    def __iter__(self):
+        position = self._position
+        return (key for key, column in self._table.columns.items() if column.codes[position] != 0)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"CompactRow({dict(self)!r})"
+
+
+class CompactTable:
+    """Rows with a shared schema of interned column names and dictionary-encoded columns."""
+
+    def __init__(self, rows=()):
+        self.columns = {}
+        self.n_rows = 0
+        for row in rows:
+            self.append(row)
+
+    def append(self, row):
+        """Append a row dict (new keys extend the schema, missing from the earlier rows)."""
+        columns = self.columns
+        for key, value in row.items():
+            if key not in columns:
+                columns[sys.intern(key)] = CompactColumn(self.n_rows)
+            columns[key].append(value)
+        self.n_rows += 1
+        for column in columns.values():
+            if len(column.codes) < self.n_rows:
+                column.codes.append(0)
+
+    def column_names(self):
+        """Names of all columns, in the order they first appeared."""
+        return list(self.columns)
+
+    def column(self, name):
+        """Decoded values of a column (None where missing)."""
+        column = self.columns.get(name)
+        if column is None:
+            return [None] * self.n_rows
+        values = [None] + column.values[1:]
+        return [values[code] for code in column.codes]
+
+    def __getitem__(self, position):
+        if not -self.n_rows <= position < self.n_rows:
+            raise IndexError(position)
+        return CompactRow(self, position % self.n_rows)
+
+    def __iter__(self):
+        return (CompactRow(self, position) for position in range(self.n_rows))
+
+    def __len__(self):
+        return self.n_rows
@@ -0,0 +1,79 @@
+"""Spectral features of audio recordings."""
+
+from functools import lru_cache
+
+import numpy as np
+
+from utils.audio import frame_signal
+
+
+N_FFT = 1024
+HOP_LENGTH = 256
+N_MELS = 64
+# Floor added before taking the logarithm
+LOG_EPS = 1e-10
+
+
+def hz_to_mel(freq):
+    """Convert frequencies (Hz) to the (HTK) mel scale."""
+    return 2595.0 * np.log10(1.0 + np.asarray(freq, dtype=np.float64) / 700.0)
+
+
+def mel_to_hz(mel):
+    """Convert (HTK) mel values to frequencies (Hz)."""
+    return 700.0 * (10.0 ** (np.asarray(mel, dtype=np.float64) / 2595.0) - 1.0)
+
+
+@lru_cache(maxsize=None)
+def mel_filterbank(sample_rate, n_fft=N_FFT, n_mels=N_MELS, fmin=0.0, fmax=None):
+    """Triangular mel filterbank of shape (n_fft // 2 + 1, n_mels).
+
+    The filterbank is computed once per parameter set and shared (read-only) afterwards.
+    """
+    fmax = sample_rate / 2.0 if fmax is None else fmax
+    fft_freqs = np.fft.rfftfreq(n_fft, d=1.0 / sample_rate)
+    mel_edges = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+
+    lower = mel_edges[:-2, np.newaxis]
+    center = mel_edges[1:-1, np.newaxis]
+    upper = mel_edges[2:, np.newaxis]
+    rising = (fft_freqs - lower) / np.maximum(center - lower, 1e-10)
+    falling = (upper - fft_freqs) / np.maximum(upper - center, 1e-10)
+    filterbank = np.maximum(0.0, np.minimum(rising, falling)).T.astype(np.float32)
+
+    filterbank.flags.writeable = False
+    return filterbank
+
+
+@lru_cache(maxsize=None)
+def _window(n_fft):
+    window = np.hanning(n_fft).astype(np.float32)
+    window.flags.writeable = False
+    return window
+
+
+def log_mel_spectrogram(samples, sample_rate, n_fft=N_FFT, hop_length=HOP_LENGTH, n_mels=N_MELS, fmin=0.0, fmax=None):
+    """Compute the log-mel spectrogram of a recording.
+
+    Multi-channel recordings are mixed down to mono first.
+
+    Args:
+        samples (np.ndarray): float samples of shape (n_frames,) or (n_frames, channels)
+        sample_rate (int): sample rate in Hz
+        n_fft (int): FFT (and frame) length
+        hop_length (int): number of samples between frames
+        n_mels (int): number of mel bands
+        fmin (float): lowest frequency (Hz) of the filterbank
+        fmax (float): highest frequency (Hz) of the filterbank (default: Nyquist)
+
+    Returns:
+        np.ndarray: float32 array of shape (n_windows, n_mels) with natural-log mel energies
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim == 2:
+        samples = samples.mean(axis=1)
+
+    frames = frame_signal(samples, n_fft, hop_length)
+    power = np.abs(np.fft.rfft(frames * _window(n_fft), axis=1)) ** 2
+    mel_power = power.astype(np.float32) @ mel_filterbank(sample_rate, n_fft, n_mels, fmin, fmax)
+    return np.log(mel_power + LOG_EPS)
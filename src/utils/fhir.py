@@ -1,14 +1,61 @@
 """Factor functions for FHIR resources."""
 
-from fhir.resources.patient import Patient
-from fhir.resources.bundle import Bundle
-from fhir.resources.bundle import BundleEntry
-from fhir.resources.encounter import Encounter
-from fhir.resources.media import Media
-from fhir.resources.observation import Observation
-from fhir.resources.questionnaireresponse import QuestionnaireResponse
-from fhir.resources.questionnaireresponse import QuestionnaireResponseItem
-from fhir.resources.questionnaireresponse import QuestionnaireResponseItemAnswer
+import hashlib
+import importlib
+import os
+import re
+
+
+class LazyModel:
+    """Stand-in for a `fhir.resources` model class which imports it on first use.
+
+    Importing the `fhir.resources` models (and pydantic) dominates the start-up time
+    of the scripts, so they are only loaded once a resource is actually created.
+    """
+
+    __slots__ = ("_module", "_name", "_model")
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+        self._model = None
+
+    @property
+    def model(self):
+        """The model class (imported on first access)."""
+        if self._model is None:
+            self._model = getattr(importlib.import_module(self._module), self._name)
+        return self._model
+
+    def __call__(self, *args, **kwargs):
+        return self.model(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+Patient = LazyModel("fhir.resources.patient", "Patient")
+Bundle = LazyModel("fhir.resources.bundle", "Bundle")
+BundleEntry = LazyModel("fhir.resources.bundle", "BundleEntry")
+Encounter = LazyModel("fhir.resources.encounter", "Encounter")
+Media = LazyModel("fhir.resources.media", "Media")
+Observation = LazyModel("fhir.resources.observation", "Observation")
+QuestionnaireResponse = LazyModel("fhir.resources.questionnaireresponse", "QuestionnaireResponse")
+QuestionnaireResponseItem = LazyModel("fhir.resources.questionnaireresponse", "QuestionnaireResponseItem")
+QuestionnaireResponseItemAnswer = LazyModel("fhir.resources.questionnaireresponse", "QuestionnaireResponseItemAnswer")
+
+# Characters not allowed in FHIR ids
+_INVALID_ID_CHARACTERS = re.compile(r"[^A-Za-z0-9\-.]")
+# Maximum length of FHIR ids
+MAX_ID_LENGTH = 64
+# Number of hexadecimal digits of the hash ending the ids which were too long
+_ID_HASH_LENGTH = 12
+
+# Content type of the audio files of the Media resources, by extension
+AUDIO_CONTENT_TYPES = {
+    ".wav": "audio/wav",
+    ".flac": "audio/flac",
+}
 
 
 # Age group observation
@@ -323,577 +370,18 @@ auscultation_sound_media = lambda entry, code, encouter_id, patient_id: Media(
         ]
     },
     content={
-        "contentType": "audio/wav",
+        "contentType": audio_content_type(entry),
         "url": entry,
     }
 )
 
 
-def patient_history_questionnaire_response(
-    patient_id,
-    encounter_id,
-    practitioner_id,
-    daily_medication=None,
-    daily_cough=None,
-    breathlessness_code_and_statement=None,
-    smoking_habit_code_and_statement=None,
-    average_cigarettes_per_day=None,
-    years_smoking=None,
-    disqualify_patient=None,
-):
-    """Create a Patient History QuestionnaireResponse FHIR resource.
-
-    Args:
-        patient_id (str): The ID of the patient.
-        encounter_id (str): The ID of the encounter.
-        practitioner_id (str): The ID of the practitioner.
-        daily_medication (str, optional): The patient's daily medication. Defaults to None.
-        daily_cough (bool, optional): The patient's daily cough. Defaults to None.
-        breathlessness_code_and_statement (tuple, optional): The patient's breathlessness code and statement. Defaults to None.
-        smoking_habit_code_and_statement (tuple, optional): The patient's smoking habit code and statement. Defaults to None.
-        average_cigarettes_per_day (int, optional): The patient's average cigarettes per day. Defaults to None.
-        years_smoking (int, optional): The patient's years smoking. Defaults to None.
-        disqualify_patient (bool, optional): Whether the patient should be disqualified. Defaults to None.
-
-    Returns:
-        QuestionnaireResponse: The Patient History QuestionnaireResponse FHIR resource.
-    """
-    items = []
-
-    if daily_medication is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="ph-daily-medication",
-                text="Daily Medication (name + dosage + time/day)",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueString=daily_medication
-                    )
-                ]
-            ),
-        )
-
-    if smoking_habit_code_and_statement is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="ph-smoking",
-                text="Smoking Habit",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueCoding={
-                            "system": "./FHIR_CODING_SYSTEMS.md",
-                            "code": smoking_habit_code_and_statement[0],
-                            "display": smoking_habit_code_and_statement[1],
-                        }
-                    )
-                ]
-            ),
-        )
-
-    if daily_cough is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="ph-daily-cough",
-                text="Daily Cough",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueBoolean=daily_cough,
-                    )
-                ]
-            ),
-        )
-
-    if breathlessness_code_and_statement is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="ph-breathlessness",
-                text="Self-statement about breathlessness",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueCoding={
-                            "system": "./FHIR_CODING_SYSTEMS.md",
-                            "code": breathlessness_code_and_statement[0],
-                            "display": breathlessness_code_and_statement[1],
-                        }
-                    )
-                ]
-            ),
-        )
-
-    if average_cigarettes_per_day is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="cigarettes-per-day",
-                text="Cigarettes per day? (Average)",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueInteger=average_cigarettes_per_day,
-                    )
-                ]
-            )
-        )
-
-    if years_smoking is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="years-smoking",
-                text="Years of smoking",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueInteger=years_smoking,
-                    )
-                ]
-            )
-        )
-
-    if disqualify_patient is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="disqualify-patient",
-                text="Disqualify patient?",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueBoolean=disqualify_patient,
-                    )
-                ]
-            )
-        )
-
-    return QuestionnaireResponse(
-        id="patient-history",
-        status="completed",
-        meta={
-            "versionId": "1.0.0",
-            "lastUpdated": "2023-03-09T00:00:00Z"
-        },
-        subject={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        encounter={
-            "reference": f"Encounter/{encounter_id}",
-            "type": "Encounter",
-        },
-        author={
-            "reference": f"Practitioner/{practitioner_id}",
-            "type": "Practitioner",
-        },
-        source={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        item=items,
-    )
-
-
-def background_disease_questionnaire_response(
-        patient_id,
-        encounter_id,
-        practitioner_id,
-        asthma=False,
-        copd=False,
-        emphysema=False,
-        chronic_bronchitis=False,
-        lung_cancer=False,
-        hypertension=False,
-        angina_pectoris=False,
-        myocardial_infarction=False,
-        heart_failure=False,
-        diabetes=False,
-        current_respiratory_disease=False,
-        other_lung_disease=None,
-        other_cardiovascular_disease=None,
-):
-    """Create a QuestionnaireResponse for the Background Disease Questionnaire.
-
-    Args:
-        patient_id (str): The ID of the patient.
-        encounter_id (str): The ID of the encounter.
-        practitioner_id (str): The ID of the practitioner.
-        asthma (bool): Whether the patient has asthma.
-        copd (bool): Whether the patient has COPD.
-        emphysema (bool): Whether the patient has emphysema.
-        chronic_bronchitis (bool): Whether the patient has chronic bronchitis.
-        lung_cancer (bool): Whether the patient has lung cancer.
-        hypertension (bool): Whether the patient has hypertension.
-        angina_pectoris (bool): Whether the patient has angina pectoris.
-        myocardial_infarction (bool): Whether the patient has myocardial infarction.
-        heart_failure (bool): Whether the patient has heart failure.
-        diabetes (bool): Whether the patient has diabetes.
-        current_respiratory_disease (bool): Whether the patient has a current respiratory disease.
-        other_lung_disease (str): Other lung disease.
-        other_cardiovascular_disease (str): Other cardiovascular disease.
-
-    Returns:
-        QuestionnaireResponse: The QuestionnaireResponse for the Background Disease Questionnaire.
-    """
-    answers_lung = []
-    answers_cv = []
-    answers_other = []
-
-    # Lung
-    if asthma:
-        answers_lung.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-lung-asthma",
-                    "display": "Asthma"
-                }
-            )
-        )
-    if copd:
-        answers_lung.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-lung-copd",
-                    "display": "COPD"
-                }
-            )
-        )
-    if emphysema:
-        answers_lung.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-lung-emphysema",
-                    "display": "Emphysema"
-                }
-            )
-        )
-    if chronic_bronchitis:
-        answers_lung.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-lung-chronic-bronchitis",
-                    "display": "Chronic Bronchitis"
-                }
-            )
-        )
-    if lung_cancer:
-        answers_lung.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-lung-lung-cancer",
-                    "display": "Lung Cancer"
-                }
-            )
-        )
-
-    # Cardiovascular
-    if hypertension:
-        answers_cv.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-cv-hypertension",
-                    "display": "Hypertension"
-                }
-            )
-        )
-    if angina_pectoris:
-        answers_cv.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-cv-angina-pectoris",
-                    "display": "Angina Pectoris"
-                }
-            )
-        )
-    if myocardial_infarction:
-        answers_cv.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-cv-myocardial-infarction",
-                    "display": "Myocardial Infarction"
-                }
-            )
-        )
-    if heart_failure:
-        answers_cv.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-cv-heart-failure",
-                    "display": "Heart Failure"
-                }
-            )
-        )
-
-    # Other
-    if diabetes:
-        answers_other.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-other-diabetes",
-                    "display": "Diabetes"
-                }
-            )
-        )
-    if current_respiratory_disease:
-        answers_other.append(
-            QuestionnaireResponseItemAnswer(
-                valueCoding={
-                    "system": "./FHIR_CODING_SYSTEMS.md",
-                    "code": "bd-other-cri",
-                    "display": "Current Respiratory Disease"
-                }
-            )
-        )
-
-    # Text answers
-    if other_lung_disease is not None and other_lung_disease != "":
-        answers_lung.append(
-            QuestionnaireResponseItemAnswer(
-                valueString=other_lung_disease,
-            )
-        )
-
-    if other_cardiovascular_disease is not None and other_cardiovascular_disease != "":
-        answers_cv.append(
-            QuestionnaireResponseItemAnswer(
-                valueString=other_cardiovascular_disease,
-            )
-        )
-
-
-    items = []
-    if answers_lung != []:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="bd-lung",
-                text="Chronic Lung Disease",
-                answer=answers_lung,
-            )
-        )
-    if answers_cv != []:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="bd-cv",
-                text="Chronic Cardiovascular Disease",
-                answer=answers_cv,
-            )
-        )
-    if answers_other != []:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="bd-other",
-                text="Other",
-                answer=answers_other,
-            )
-        )
-
-
-    return QuestionnaireResponse(
-        id="background-disease",
-        status="completed",
-        meta={
-            "versionId": "1.0.0",
-            "lastUpdated": "2023-03-09T00:00:00Z"
-        },
-        subject={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        encounter={
-            "reference": f"Encounter/{encounter_id}",
-            "type": "Encounter",
-        },
-        author={
-            "reference": f"Practitioner/{practitioner_id}",
-            "type": "Practitioner",
-        },
-        source={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        item=items
-    )
-
-
-def change_in_care_questionnaire_response(
-        patient_id,
-        encounter_id,
-        practitioner_id,
-        new_increased_medication,
-        patient_participation_code_and_statement,
-):
-    """Create a QuestionnaireResponse for the Change in Care questionnaire.
-
-    Args:
-        patient_id (str): The ID of the patient.
-        encounter_id (str): The ID of the encounter.
-        practitioner_id (str): The ID of the practitioner.
-        new_increased_medication (str): The new or increased medication.
-        patient_participation_code_and_statement (tuple): The patient participation code and statement.
-
-    Returns:
-        QuestionnaireResponse: The QuestionnaireResponse for the Change in Care questionnaire.
-    """
-    items = []
-
-    if new_increased_medication is not None and new_increased_medication != "":
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="1",
-                text="New or Increased Medication (name + dosage + time/day)",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueString=new_increased_medication,
-                    )
-                ]
-            ),
-        )
-
-    if patient_participation_code_and_statement is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="2",
-                text="Patient participation",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueCoding={
-                            "system": "./FHIR_CODING_SYSTEMS.md",
-                            "code": patient_participation_code_and_statement[0],
-                            "display": patient_participation_code_and_statement[1],
-                        }
-                    )
-                ]
-            ),
-        )
-
-    return QuestionnaireResponse(
-        id="change-in-care",
-        status="completed",
-        meta={
-            "versionId": "1.0.0",
-            "lastUpdated": "2023-03-09T00:00:00Z"
-        },
-        subject={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        encounter={
-            "reference": f"Encounter/{encounter_id}",
-            "type": "Encounter",
-        },
-        author={
-            "reference": f"Practitioner/{practitioner_id}",
-            "type": "Practitioner",
-        },
-        source={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        item=items
-    )
-
-
-def current_condition_questionnaire_response(
-        patient_id,
-        encounter_id,
-        practitioner_id,
-        coughing_code_and_statement,
-        fatigue_code_and_statement,
-        sob_code_and_statement,
-):
-    """Create a QuestionnaireResponse for the current condition questionnaire.
-
-    Args:
-        patient_id (str): The ID of the patient.
-        encounter_id (str): The ID of the encounter.
-        practitioner_id (str): The ID of the practitioner.
-        coughing_code_and_statement (tuple): A tuple of the coughing code and statement.
-        fatigue_code_and_statement (tuple): A tuple of the fatigue code and statement.
-        sob_code_and_statement (tuple): A tuple of the sob code and statement.
-
-    Returns:
-        QuestionnaireResponse: A QuestionnaireResponse for the current condition questionnaire.
-    """
-    items = []
-
-    if coughing_code_and_statement is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="1",
-                text="Coughing",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueCoding={
-                            "system": "./FHIR_CODING_SYSTEMS.md",
-                            "code": coughing_code_and_statement[0],
-                            "display": coughing_code_and_statement[1],
-                        }
-                    )
-                ]
-            ),
-        )
-
-    if fatigue_code_and_statement is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="2",
-                text="Fatigue",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueCoding={
-                            "system": "./FHIR_CODING_SYSTEMS.md",
-                            "code": fatigue_code_and_statement[0],
-                            "display": fatigue_code_and_statement[1],
-                        }
-                    )
-                ]
-            ),
-        )
-
-    if sob_code_and_statement is not None:
-        items.append(
-            QuestionnaireResponseItem(
-                linkId="3",
-                text="Shortness of Breath",
-                answer=[
-                    QuestionnaireResponseItemAnswer(
-                        valueCoding={
-                            "system": "./FHIR_CODING_SYSTEMS.md",
-                            "code": sob_code_and_statement[0],
-                            "display": sob_code_and_statement[1],
-                        }
-                    )
-                ]
-            ),
-        )
-
-    return QuestionnaireResponse(
-        id="current-condition",
-        status="completed",
-        meta={
-            "versionId": "1.0.0",
-            "lastUpdated": "2023-03-09T00:00:00Z"
-        },
-        subject={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        encounter={
-            "reference": f"Encounter/{encounter_id}",
-            "type": "Encounter",
-        },
-        author={
-            "reference": f"Practitioner/{practitioner_id}",
-            "type": "Practitioner",
-        },
-        source={
-            "reference": f"Patient/{patient_id}",
-            "type": "Patient",
-        },
-        item=items,
-    )
+def audio_content_type(path):
+    """Get the content type of an audio file from its extension (see `AUDIO_CONTENT_TYPES`)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in AUDIO_CONTENT_TYPES:
+        raise ValueError(f"Unknown audio file extension: {path}")
+    return AUDIO_CONTENT_TYPES[extension]
 
 
 def get_encounter(
@@ -1035,3 +523,50 @@ def get_bundle(
         },
         entry=entries,
     )
+
+
+def qualify_id(resource, encounter_id):
+    """Get an id of a resource which is unique across encounters.
+
+    Patients and encounters keep their ids; media get the encounter and the name of
+    the recording, any other resource the encounter and its own id. Ids longer than
+    `MAX_ID_LENGTH` end with a hash of the full id instead of their tail, so that they
+    stay unique.
+    """
+    if resource.resource_type in ("Patient", "Encounter"):
+        return resource.id
+    if resource.resource_type == "Media":
+        recording = os.path.splitext(os.path.basename(resource.content.url))[0]
+        resource_id = f"{encounter_id}-{recording}"
+    else:
+        resource_id = f"{encounter_id}-{resource.id}"
+    qualified_id = _INVALID_ID_CHARACTERS.sub("-", resource_id)
+    if len(qualified_id) > MAX_ID_LENGTH:
+        digest = hashlib.sha1(resource_id.encode("utf-8")).hexdigest()[:_ID_HASH_LENGTH]
+        qualified_id = f"{qualified_id[:MAX_ID_LENGTH - _ID_HASH_LENGTH - 1]}-{digest}"
+    return qualified_id
+
+
+def copy_validated(resource, update=None):
+    """Deep copy of a validated resource, with some of its fields replaced by validated values.
+
+    The copy (and a copy of each of its nested models) is created with `copy`, without
+    validating the values again, so that resources can be created from validated templates
+    without sharing any mutable object with them. The values of `update` are used as given.
+    """
+    update = dict(update or {})
+    # Only the fields which were set can hold models or lists (the others are None)
+    for name in resource.__fields_set__.difference(update):
+        value = getattr(resource, name)
+        if isinstance(value, list) or hasattr(value, "__fields_set__"):
+            update[name] = _copy_validated_value(value)
+    return resource.copy(update=update)
+
+
+def _copy_validated_value(value):
+    """Deep copy of a field value of a validated resource (models and lists; the others are immutable)."""
+    if isinstance(value, list):
+        return [_copy_validated_value(item) for item in value]
+    if hasattr(value, "__fields_set__"):
+        return copy_validated(value)
+    return value
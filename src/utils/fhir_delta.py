@@ -0,0 +1,178 @@
+"""Delta export: keep only the FHIR resources which changed since the last export.
+
+Each resource is fingerprinted by the hash of its canonical JSON (sorted keys, no
+whitespace, without `meta`) and compared with the fingerprint store of the previous
+run (`FINGERPRINTS_PATH`). New and changed resources get the next `versionId` and
+the time of the run as `lastUpdated`, and are written as NDJSON files (one per
+resource type, as in FHIR bulk data) into a directory per run:
+
+    fhir_delta/<run time>/Observation.ndjson
+    fhir_delta/<run time>/deleted.ndjson
+
+Resources of the previous run which were not generated again are listed in
+`deleted.ndjson` (type, id and last version). Their last version is kept in the
+fingerprint store, so that a resource added again continues from it. The ids are
+qualified by the encounter (see `utils.fhir.qualify_id`), so they are unique across
+the dataset. The fingerprint store is only replaced once the run has finished: if
+the `with` block raises, the files are closed and the store is left as it was.
+
+    with FHIRDelta() as delta:
+        for bundle, encounter_id in bundles:
+            delta.add_bundle(bundle, encounter_id)
+    delta.print_report()
+"""
+
+import datetime
+import hashlib
+import json
+import os
+
+from utils.fhir import qualify_id
+from utils.instrumentation import add_bytes_written, count
+
+
+DELTA_DIR = "fhir_delta/"
+FINGERPRINTS_PATH = "fhir_delta/fingerprints.json"
+
+
+class FHIRDelta:
+    """Compare the generated resources with the previous export and write the changes."""
+
+    def __init__(self, delta_dir=DELTA_DIR, fingerprints_path=FINGERPRINTS_PATH, run_time=None):
+        """
+        Args:
+            delta_dir (str): directory of the per-run delta directories
+            fingerprints_path (str): path to the fingerprint store
+            run_time (datetime.datetime): time of the run (default: now, UTC)
+        """
+        run_time = run_time or datetime.datetime.now(datetime.timezone.utc)
+        self.last_updated = run_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.run_dir = os.path.join(delta_dir, run_time.strftime("%Y%m%dT%H%M%SZ"))
+        self.fingerprints_path = fingerprints_path
+        self.stats = {"new": 0, "changed": 0, "unchanged": 0, "deleted": 0}
+
+        self._previous = {}
+        if os.path.isfile(fingerprints_path):
+            with open(fingerprints_path) as f:
+                self._previous = json.load(f)
+        # "<type>/<id>" -> [fingerprint, versionId, lastUpdated] of this run (fingerprint None: deleted)
+        self._fingerprints = {}
+        self._files = {}
+
+    def add_bundle(self, bundle, encounter_id):
+        """Fingerprint the resources of a bundle and write the new and changed ones.
+
+        Returns:
+            list: the new and changed resources (with their original ids and the new `meta`)
+        """
+        return [
+            resource
+            for resource in (self.add_resource(entry.resource, encounter_id) for entry in bundle.entry or [])
+            if resource is not None
+        ]
+
+    def add_resource(self, resource, encounter_id):
+        """Fingerprint a resource and write it if it is new or changed.
+
+        Returns:
+            the resource with the new `meta`, or None if it did not change
+        """
+        resource_id = qualify_id(resource, encounter_id)
+        key = f"{resource.resource_type}/{resource_id}"
+        # The same resource (e.g. a patient with several encounters) is only exported once
+        if key in self._fingerprints:
+            return None
+
+        data = json.loads(resource.json())
+        data.pop("meta", None)
+        data["id"] = resource_id
+        canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        fingerprint = hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+        previous = self._previous.get(key)
+        if previous is not None and previous[0] == fingerprint:
+            self._fingerprints[key] = previous
+            self.stats["unchanged"] += 1
+            return None
+
+        # A deleted resource added again continues from its last version
+        version = str(int(previous[1]) + 1) if previous is not None else "1"
+        self._fingerprints[key] = [fingerprint, version, self.last_updated]
+        self.stats["changed" if previous is not None and previous[0] is not None else "new"] += 1
+        count("delta_resources")
+
+        meta = {"versionId": version, "lastUpdated": self.last_updated}
+        data = {"resourceType": data.pop("resourceType"), "id": data.pop("id"), "meta": meta, **data}
+        self._write(resource.resource_type, data)
+        return resource.copy(update={"meta": resource.meta.copy(update=meta)})
+
+    def deleted(self):
+        """Get the keys ("<type>/<id>") of the resources of the previous export not generated again."""
+        return [
+            key
+            for key, previous in self._previous.items()
+            if key not in self._fingerprints and previous[0] is not None
+        ]
+
+    def close(self):
+        """Write the deleted resources and replace the fingerprint store.
+
+        Returns:
+            list: the keys of the deleted resources
+        """
+        deleted = self.deleted()
+        for key in deleted:
+            resource_type, resource_id = key.split("/", 1)
+            self._write("deleted", {"resourceType": resource_type, "id": resource_id, "versionId": self._previous[key][1]})
+        self.stats["deleted"] = len(deleted)
+        self._close_files()
+
+        # The last version of the deleted resources (this run's and earlier ones) is kept
+        for key, previous in self._previous.items():
+            if key not in self._fingerprints:
+                self._fingerprints[key] = previous if previous[0] is None else [None, previous[1], self.last_updated]
+
+        os.makedirs(os.path.dirname(self.fingerprints_path), exist_ok=True)
+        temporary_path = self.fingerprints_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self._fingerprints, f, separators=(",", ":"))
+        os.replace(temporary_path, self.fingerprints_path)
+        return deleted
+
+    def abort(self):
+        """Close the files written so far, leaving the fingerprint store as it was."""
+        self._close_files()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def print_report(self):
+        """Print the number of new, changed, unchanged and deleted resources."""
+        stats = self.stats
+        print(
+            f"Delta export: {stats['new']} new, {stats['changed']} changed, {stats['unchanged']} unchanged, "
+            f"{stats['deleted']} deleted resources"
+            + (f" written to {self.run_dir}" if os.path.isdir(self.run_dir) else "")
+        )
+
+    def _write(self, name, data):
+        f = self._files.get(name)
+        if f is None:
+            os.makedirs(self.run_dir, exist_ok=True)
+            f = self._files[name] = open(os.path.join(self.run_dir, name + ".ndjson"), "w", encoding="utf-8")
+        line = json.dumps(data, ensure_ascii=False) + "\n"
+        f.write(line)
+        add_bytes_written(len(line))
+
+    def _close_files(self):
+        try:
+            for f in self._files.values():
+                f.close()
+        finally:
+            self._files = {}
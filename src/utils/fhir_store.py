@@ -0,0 +1,205 @@
+"""Embedded SQLite store of the FHIR resources, indexed for lookups by patient, encounter and code.
+
+Every resource is stored as JSON together with indexed columns: resource type,
+patient and encounter (ids, without the "Patient/"/"Encounter/" prefix), code
+(LOINC code of observations, SNOMED body site of media) and date (of the encounter).
+The ids are qualified by the encounter (see `utils.fhir.qualify_id`):
+
+    with FHIRStore("fhir_store.sqlite") as store:
+        store.search("Observation", patient="site00-p00000", code="59408-5")
+        store.get("Encounter", "sn05433721")
+
+`export_to_fhir` fills the store with `--store`, inserting the resources in batches
+of `BATCH_SIZE` within a single transaction. It is committed when the store is
+closed, and rolled back if the `with` block raises, so that a failed export leaves
+the store as it was.
+"""
+
+import json
+import os
+import sqlite3
+
+from utils.fhir import qualify_id
+
+
+STORE_PATH = "fhir_store.sqlite"
+# Number of resources inserted at once
+BATCH_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    patient TEXT,
+    encounter TEXT,
+    system TEXT,
+    code TEXT,
+    date TEXT,
+    json TEXT NOT NULL,
+    PRIMARY KEY (type, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS resources_patient ON resources (patient, type, code);
+CREATE INDEX IF NOT EXISTS resources_encounter ON resources (encounter, type);
+CREATE INDEX IF NOT EXISTS resources_code ON resources (code, type);
+CREATE INDEX IF NOT EXISTS resources_date ON resources (date, type);
+"""
+
+_COLUMNS = ("type", "id", "patient", "encounter", "system", "code", "date", "json")
+
+
+class FHIRStore:
+    """SQLite store of FHIR resources with indexed search columns."""
+
+    def __init__(self, path=STORE_PATH, batch_size=BATCH_SIZE):
+        """
+        Args:
+            path (str): path to the SQLite database (created if missing)
+            batch_size (int): number of resources inserted at once
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._rows = []
+        self._modified = False
+        # Encounter id -> date, for the resources added after their encounter
+        self._encounter_dates = {}
+
+    def add_bundle(self, bundle, encounter_id):
+        """Add the resources of a bundle (ids qualified by `encounter_id`)."""
+        for entry in bundle.entry or []:
+            self.add_resource(entry.resource, encounter_id)
+
+    def add_resource(self, resource, encounter_id):
+        """Add (or replace) a resource; the rows are inserted once `batch_size` are queued."""
+        resource_id = qualify_id(resource, encounter_id)
+        resource_type = resource.resource_type
+        patient = _reference_id(getattr(resource, "subject", None))
+        encounter = _reference_id(getattr(resource, "encounter", None))
+        system, code = None, None
+
+        if resource_type == "Patient":
+            patient = resource.id
+        elif resource_type == "Encounter":
+            encounter = resource.id
+            if resource.period is not None and resource.period.start is not None:
+                self._encounter_dates[encounter] = str(resource.period.start)
+        elif resource_type == "Observation":
+            system, code = _coding(resource.code)
+        elif resource_type == "Media":
+            system, code = _coding(resource.bodySite)
+
+        # Patient-level resources (e.g. the age group) belong to the encounter they were recorded in
+        encounter = encounter or (encounter_id if resource_type != "Patient" else None)
+        date = self._encounter_dates.get(encounter)
+        resource_json = resource.copy(update={"id": resource_id}).json()
+        self._rows.append((resource_type, resource_id, patient, encounter, system, code, date, resource_json))
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert the queued resources (committed by `close`)."""
+        if not self._rows:
+            return
+        self._connection.executemany(
+            f"INSERT OR REPLACE INTO resources VALUES ({', '.join('?' * len(_COLUMNS))})", self._rows
+        )
+        self._rows = []
+        self._modified = True
+
+    def get(self, resource_type, resource_id):
+        """Get a resource (as a dict) by type and id, or None."""
+        row = self._connection.execute(
+            "SELECT json FROM resources WHERE type = ? AND id = ?", (resource_type, resource_id)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def search(self, resource_type=None, patient=None, encounter=None, code=None, date_from=None, date_to=None, limit=None):
+        """Find resources (as dicts) matching all given criteria.
+
+        Args:
+            resource_type (str): resource type (e.g. "Observation")
+            patient (str): patient id (or "Patient/<id>" reference)
+            encounter (str): encounter id (or "Encounter/<id>" reference)
+            code (str): LOINC code of observations / SNOMED body site code of media
+            date_from (str): first date (YYYY-MM-DD) of the encounter
+            date_to (str): last date (YYYY-MM-DD) of the encounter
+            limit (int): maximum number of resources
+
+        Returns:
+            list: resources ordered by date, type and id
+        """
+        where, parameters = self._where(resource_type, patient, encounter, code, date_from, date_to)
+        query = f"SELECT json FROM resources{where} ORDER BY date, type, id"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return [json.loads(row[0]) for row in self._connection.execute(query, parameters)]
+
+    def count(self, resource_type=None, patient=None, encounter=None, code=None, date_from=None, date_to=None):
+        """Count the resources matching all given criteria (see `search`)."""
+        where, parameters = self._where(resource_type, patient, encounter, code, date_from, date_to)
+        return self._connection.execute(f"SELECT COUNT(*) FROM resources{where}", parameters).fetchone()[0]
+
+    def close(self):
+        """Insert the remaining resources, commit them and close the database."""
+        try:
+            self.flush()
+            self._connection.commit()
+            # Statistics for the query planner (which otherwise prefers the primary key to the indexes)
+            if self._modified:
+                self._connection.execute("ANALYZE")
+        finally:
+            self._connection.close()
+
+    def abort(self):
+        """Discard the resources added since the store was opened and close the database."""
+        try:
+            self._rows = []
+            self._connection.rollback()
+        finally:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __len__(self):
+        return self.count()
+
+    @staticmethod
+    def _where(resource_type, patient, encounter, code, date_from, date_to):
+        conditions = [
+            ("type = ?", resource_type),
+            ("patient = ?", patient and patient.rpartition("/")[2]),
+            ("encounter = ?", encounter and encounter.rpartition("/")[2]),
+            ("code = ?", code),
+            ("date >= ?", date_from),
+            ("date <= ?", date_to),
+        ]
+        conditions = [(condition, value) for condition, value in conditions if value is not None]
+        if not conditions:
+            return "", []
+        return " WHERE " + " AND ".join(condition for condition, _ in conditions), [value for _, value in conditions]
+
+
+def _reference_id(reference):
+    """Get the id of a reference such as "Patient/<id>" (None if there is no reference)."""
+    if reference is None or reference.reference is None:
+        return None
+    return reference.reference.rpartition("/")[2]
+
+
+def _coding(concept):
+    """Get the system and code of the first coding of a CodeableConcept."""
+    if concept is None or not concept.coding:
+        return None, None
+    return concept.coding[0].system, concept.coding[0].code
@@ -0,0 +1,253 @@
+"""Upload FHIR resources to a FHIR server in transaction/batch bundles.
+
+The resources of the collection bundles built by `export_to_fhir` are regrouped
+into `transaction` (or `batch`) bundles of `BUNDLE_SIZE` entries and POSTed to
+the server base URL by a few threads sharing a pool of keep-alive connections:
+
+    with BundleUploader(FHIRClient("http://localhost:8080/fhir")) as uploader:
+        uploader.add_bundle(tabular_bundle, encounter_id)
+    uploader.print_report()
+
+Every entry is a `PUT <type>/<id>` (or a `DELETE`, see `delete`), so retrying a
+bundle is idempotent. The factories of `utils.fhir` reuse ids such as "age-group" in every
+encounter, so all resources except patients and encounters get an id qualified by
+the encounter (see `utils.fhir.qualify_id`). Requests failing with a connection error, 429
+or 5xx are retried with exponential backoff.
+"""
+
+import http.client
+import json
+import queue
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from utils.fhir import qualify_id
+
+
+BUNDLE_SIZE = 100
+BUNDLE_TYPES = ("transaction", "batch")
+# Number of concurrent requests (and pooled connections)
+N_CONNECTIONS = 4
+TIMEOUT_S = 60
+MAX_RETRIES = 5
+# Delay before the first retry, doubled on every further retry
+BACKOFF_S = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UploadError(RuntimeError):
+    """A bundle could not be uploaded."""
+
+
+class FHIRClient:
+    """POST JSON documents to a FHIR server over a pool of keep-alive connections."""
+
+    def __init__(self, base_url, n_connections=N_CONNECTIONS, timeout=TIMEOUT_S, max_retries=MAX_RETRIES, backoff=BACKOFF_S):
+        """
+        Args:
+            base_url (str): base URL of the FHIR server (e.g. "http://localhost:8080/fhir")
+            n_connections (int): maximum number of open connections
+            timeout (float): socket timeout in seconds
+            max_retries (int): retries of a request after a connection error, 429 or 5xx
+            backoff (float): delay before the first retry in seconds
+        """
+        url = urlsplit(base_url)
+        if url.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported FHIR server URL: {base_url}")
+        self._connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self._netloc = url.netloc
+        self.path = url.path.rstrip("/") or "/"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retries = 0
+
+        self._pool = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(n_connections)
+        self._lock = threading.Lock()
+
+    def post(self, body):
+        """POST `body` (bytes) to the base URL and return the parsed JSON response.
+
+        Raises:
+            UploadError: if the server rejects the request, or still fails after all retries
+        """
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                status, headers, data = self._request(body)
+            except (OSError, http.client.HTTPException) as error:
+                status, headers, data = None, {}, str(error).encode()
+
+            if status is not None and 200 <= status < 300:
+                return json.loads(data) if data else {}
+            if status is not None and status not in RETRY_STATUSES:
+                raise UploadError(f"FHIR server returned {status}: {data[:500].decode(errors='replace')}")
+            if attempt == self.max_retries:
+                break
+
+            with self._lock:
+                self.retries += 1
+            retry_after = headers.get("Retry-After", "")
+            time.sleep(float(retry_after) if retry_after.isdigit() else delay)
+            delay *= 2
+        raise UploadError(f"FHIR server failed after {self.max_retries} retries ({status}): {data[:500].decode(errors='replace')}")
+
+    def close(self):
+        """Close all pooled connections."""
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+    def _request(self, body):
+        with self._slots:
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                connection = self._connection_class(self._netloc, timeout=self.timeout)
+            try:
+                connection.request("POST", self.path, body=body, headers={
+                    "Content-Type": "application/fhir+json",
+                    "Accept": "application/fhir+json",
+                    "Connection": "keep-alive",
+                })
+                response = connection.getresponse()
+                data = response.read()
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._pool.put(connection)
+            return response.status, response.headers, data
+
+
+class BundleUploader:
+    """Group resources into transaction/batch bundles and upload them concurrently."""
+
+    def __init__(self, client, bundle_size=BUNDLE_SIZE, bundle_type="transaction", n_threads=N_CONNECTIONS):
+        """
+        Args:
+            client (FHIRClient): client of the FHIR server
+            bundle_size (int): number of entries per bundle
+            bundle_type (str): "transaction" (all-or-nothing) or "batch" (independent entries)
+            n_threads (int): number of bundles uploaded concurrently
+        """
+        if bundle_type not in BUNDLE_TYPES:
+            raise ValueError(f"Unknown bundle type: {bundle_type}")
+        self.client = client
+        self.bundle_size = bundle_size
+        self.bundle_type = bundle_type
+        self.stats = {"bundles": 0, "resources": 0, "bytes": 0, "failed_entries": 0, "seconds": 0.0}
+
+        self._entries = {}
+        self._executor = ThreadPoolExecutor(max_workers=n_threads)
+        # Bound the number of bundles held in memory
+        self._pending = threading.BoundedSemaphore(2 * n_threads)
+        self._futures = []
+        self._lock = threading.Lock()
+        self._error = None
+        self._start = time.perf_counter()
+
+    def add_bundle(self, bundle, encounter_id):
+        """Queue the resources of a collection bundle (ids qualified by `encounter_id`)."""
+        for entry in bundle.entry or []:
+            self.add_resource(entry.resource, encounter_id)
+
+    def add_resource(self, resource, encounter_id):
+        """Queue a resource, uploading a bundle once `bundle_size` resources are queued."""
+        self._raise_error()
+        resource_id = qualify_id(resource, encounter_id)
+        url = f"{resource.resource_type}/{resource_id}"
+        # The same resource (e.g. a patient with several encounters) is sent once per bundle
+        self._entries[url] = ("PUT", url, resource.copy(update={"id": resource_id}).json())
+        if len(self._entries) >= self.bundle_size:
+            self.flush()
+
+    def delete(self, url):
+        """Queue the deletion of a resource given as "<type>/<id>"."""
+        self._raise_error()
+        self._entries[url] = ("DELETE", url, None)
+        if len(self._entries) >= self.bundle_size:
+            self.flush()
+
+    def flush(self):
+        """Upload the queued resources as one bundle (in the background)."""
+        if not self._entries:
+            return
+        entries, self._entries = list(self._entries.values()), {}
+        self._pending.acquire()
+        future = self._executor.submit(self._upload, entries)
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append(future)
+        self._futures = [future for future in self._futures if not future.done()]
+
+    def close(self):
+        """Upload the remaining resources and wait for all uploads to finish."""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+            self.client.close()
+            self.stats["seconds"] = time.perf_counter() - self._start
+        self._raise_error()
+
+    def print_report(self):
+        """Print the number of uploaded resources and the throughput."""
+        stats = self.stats
+        seconds = stats["seconds"] or float("nan")
+        print(
+            f"Uploaded {stats['resources']} resources in {stats['bundles']} {self.bundle_type} bundles "
+            f"({stats['bytes'] / 1e6:.1f} MB) in {stats['seconds']:.2f} s: "
+            f"{stats['resources'] / seconds:.1f} resources/s, {stats['bundles'] / seconds:.1f} bundles/s, "
+            f"{stats['bytes'] / 1e6 / seconds:.2f} MB/s, {self.client.retries} retries, "
+            f"{stats['failed_entries']} failed entries"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _upload(self, entries):
+        try:
+            body = (
+                f'{{"resourceType": "Bundle", "type": "{self.bundle_type}", "entry": ['
+                + ", ".join(
+                    f'{{"resource": {resource_json}, "request": {{"method": "{method}", "url": "{url}"}}}}'
+                    if resource_json is not None else
+                    f'{{"request": {{"method": "{method}", "url": "{url}"}}}}'
+                    for method, url, resource_json in entries
+                )
+                + "]}"
+            ).encode("utf-8")
+            response = self.client.post(body)
+            # Entries of a batch succeed or fail independently
+            failed = sum(
+                1 for entry in response.get("entry", [])
+                if not entry.get("response", {}).get("status", "200").startswith("2")
+            )
+            with self._lock:
+                self.stats["bundles"] += 1
+                self.stats["resources"] += len(entries)
+                self.stats["bytes"] += len(body)
+                self.stats["failed_entries"] += failed
+        except Exception as error:
+            with self._lock:
+                if self._error is None:
+                    self._error = error
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
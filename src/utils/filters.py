@@ -0,0 +1,250 @@
+"""In-process digital filters equivalent to the SoX effects used in `filter_audio`.
+
+SoX implements its two-pole `highpass` and `lowpass` effects as biquads from the
+RBJ "Audio EQ Cookbook" with a default Q of 0.707, so the same coefficients are
+used here as second-order sections for `scipy.signal.sosfilt`.
+
+Decimation (the SoX `rate` effect) is a polyphase FIR resampler with the
+anti-aliasing filter and delay compensation of `scipy.signal.resample_poly`.
+`SosFilter` and `Resampler` keep their state between blocks, so a recording can be
+filtered and resampled block by block with the same result as in one go.
+"""
+
+import math
+
+from functools import lru_cache
+
+import numpy as np
+
+
+# Default Q (width) of the two-pole SoX `highpass`/`lowpass` effects
+SOX_Q = 0.707
+
+# Half length of the anti-aliasing filter of the resampler, per unit of max(up, down),
+# and the beta of its Kaiser window (as `scipy.signal.resample_poly`)
+RESAMPLE_HALF_LENGTH = 10
+RESAMPLE_KAISER_BETA = 5.0
+
+# Named filter profiles: name -> (highpass cutoff, lowpass cutoff) in Hz
+FILTER_PROFILES = {
+    "default": (70, 800),
+    "lung": (100, 2000),
+    "heart": (20, 400),
+}
+
+
+def biquad_highpass(cutoff, sample_rate, q=SOX_Q):
+    """Second-order section of a two-pole highpass filter (as SoX `highpass`)."""
+    w0 = 2.0 * np.pi * cutoff / sample_rate
+    alpha = np.sin(w0) / (2.0 * q)
+    cos_w0 = np.cos(w0)
+    b = [(1.0 + cos_w0) / 2.0, -(1.0 + cos_w0), (1.0 + cos_w0) / 2.0]
+    a = [1.0 + alpha, -2.0 * cos_w0, 1.0 - alpha]
+    return np.array(b + a) / a[0]
+
+
+def biquad_lowpass(cutoff, sample_rate, q=SOX_Q):
+    """Second-order section of a two-pole lowpass filter (as SoX `lowpass`)."""
+    w0 = 2.0 * np.pi * cutoff / sample_rate
+    alpha = np.sin(w0) / (2.0 * q)
+    cos_w0 = np.cos(w0)
+    b = [(1.0 - cos_w0) / 2.0, 1.0 - cos_w0, (1.0 - cos_w0) / 2.0]
+    a = [1.0 + alpha, -2.0 * cos_w0, 1.0 - alpha]
+    return np.array(b + a) / a[0]
+
+
+def band_sos(highpass, lowpass, sample_rate):
+    """Second-order sections of a highpass followed by a lowpass filter.
+
+    Args:
+        highpass (float): highpass cutoff in Hz
+        lowpass (float): lowpass cutoff in Hz
+        sample_rate (int): sample rate in Hz
+
+    Returns:
+        np.ndarray: array of shape (2, 6) to be used with `scipy.signal.sosfilt`
+    """
+    return np.vstack([
+        biquad_highpass(highpass, sample_rate),
+        biquad_lowpass(lowpass, sample_rate),
+    ])
+
+
+@lru_cache(maxsize=None)
+def profile_sos(profile, sample_rate):
+    """Second-order sections of a named filter profile.
+
+    The filter is designed once per (profile, sample rate) and the returned
+    coefficients are shared by every file (do not modify them).
+
+    Args:
+        profile (str): name of the profile in `FILTER_PROFILES`
+        sample_rate (int): sample rate in Hz
+
+    Returns:
+        np.ndarray: array of shape (2, 6) to be used with `scipy.signal.sosfilt`
+    """
+    if profile not in FILTER_PROFILES:
+        raise ValueError(f"Unknown filter profile: {profile}")
+    highpass, lowpass = FILTER_PROFILES[profile]
+    if lowpass >= sample_rate / 2:
+        raise ValueError(f"Lowpass cutoff of profile {profile} ({lowpass} Hz) is not below the Nyquist frequency ({sample_rate / 2:g} Hz)")
+
+    return band_sos(highpass, lowpass, sample_rate)
+
+
+def apply_sos(sos, samples):
+    """Filter all channels of `samples` (shape (n_frames, channels)) at once."""
+    # Imported on first use, `scipy.signal` takes most of the start-up time of the scripts
+    from scipy.signal import sosfilt
+
+    return sosfilt(sos, samples, axis=0).astype(np.float32)
+
+
+class SosFilter:
+    """Second-order sections filter of a recording fed block by block.
+
+    The state of the sections is carried from one block to the next, so the
+    output is the same (to the bit) as that of `apply_sos` on the whole recording.
+    """
+
+    def __init__(self, sos, channels=1):
+        """
+        Args:
+            sos (np.ndarray): second-order sections (e.g. from `profile_sos`)
+            channels (int): number of channels of the blocks
+        """
+        self.sos = sos
+        self._zi = np.zeros((len(sos), 2, channels))
+
+    def process(self, block):
+        """Filter a block of shape (n_frames, channels)."""
+        # Imported on first use, `scipy.signal` takes most of the start-up time of the scripts
+        from scipy.signal import sosfilt
+
+        filtered, self._zi = sosfilt(self.sos, block, axis=0, zi=self._zi)
+        return filtered.astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def resample_filter(sample_rate, target_rate):
+    """Polyphase anti-aliasing filter resampling from `sample_rate` to `target_rate`.
+
+    The filter is designed once per pair of rates and shared (do not modify it).
+
+    Args:
+        sample_rate (int): input sample rate in Hz
+        target_rate (int): output sample rate in Hz
+
+    Returns:
+        tuple: (up, down, half length of the filter, polyphase matrix of shape
+            (up, taps per phase) with the taps `h[phase + j * up]`)
+    """
+    # Imported on first use, `scipy.signal` takes most of the start-up time of the scripts
+    from scipy.signal import firwin
+
+    if sample_rate <= 0 or target_rate <= 0:
+        raise ValueError(f"Invalid sample rates: {sample_rate} -> {target_rate} Hz")
+    gcd = math.gcd(int(sample_rate), int(target_rate))
+    up, down = int(target_rate) // gcd, int(sample_rate) // gcd
+    max_rate = max(up, down)
+    half_length = RESAMPLE_HALF_LENGTH * max_rate
+    taps = firwin(2 * half_length + 1, 1.0 / max_rate, window=("kaiser", RESAMPLE_KAISER_BETA)) * up
+
+    n_phase_taps = -(-len(taps) // up)
+    phases = np.zeros(n_phase_taps * up)
+    phases[:len(taps)] = taps
+    return up, down, half_length, phases.reshape(n_phase_taps, up).T.copy()
+
+
+class Resampler:
+    """Polyphase FIR resampler of a recording fed block by block.
+
+    Output sample `n` is `sum_k h[k] * x_up[n * down + half_length - k]` (the input
+    upsampled by `up`, filtered by `h` centered on the sample and taken every `down`
+    samples), as `scipy.signal.resample_poly`. Each output sample is computed from
+    the same products in the same order whatever the blocks, so the result does
+    not depend on the block size:
+
+        resampler = Resampler(sample_rate, target_rate, channels)
+        for block in blocks:
+            write(resampler.process(block))
+        write(resampler.flush())
+    """
+
+    def __init__(self, sample_rate, target_rate, channels=1):
+        """
+        Args:
+            sample_rate (int): input sample rate in Hz
+            target_rate (int): output sample rate in Hz
+            channels (int): number of channels of the blocks
+        """
+        self.up, self.down, self.half_length, self.phases = resample_filter(sample_rate, target_rate)
+        self._reset(channels)
+
+    def process(self, block):
+        """Resample a block of shape (n_frames, channels).
+
+        Returns:
+            np.ndarray: the output samples which only depend on the input so far (float32)
+        """
+        self._buffer = np.concatenate([self._buffer, np.asarray(block, dtype=np.float64)])
+        self._n_in += len(block)
+        # Last output whose newest input sample has been read
+        n_end = max(self._n_out, (self._n_in * self.up - 1 - self.half_length) // self.down + 1)
+        return self._emit(n_end)
+
+    def flush(self):
+        """Resample the end of the recording (followed by zeros) and reset the resampler.
+
+        Returns:
+            np.ndarray: the remaining output samples, `ceil(n_frames * up / down)` in total (float32)
+        """
+        n_end = -(-self._n_in * self.up // self.down)
+        if n_end > self._n_out:
+            last_input = ((n_end - 1) * self.down + self.half_length) // self.up
+            n_padding = max(0, last_input + 1 - self._n_in)
+            self._buffer = np.concatenate([self._buffer, np.zeros((n_padding, self._buffer.shape[1]))])
+        output = self._emit(n_end)
+        self._reset(self._buffer.shape[1])
+        return output
+
+    def _reset(self, channels):
+        n_phase_taps = self.phases.shape[1]
+        # Input samples from `_offset` on (the samples before the first one are zeros)
+        self._buffer = np.zeros((n_phase_taps - 1, channels))
+        self._offset = -(n_phase_taps - 1)
+        self._n_in = 0
+        self._n_out = 0
+
+    def _emit(self, n_end):
+        """Compute the output samples up to `n_end` and drop the input they no longer need."""
+        n_start = self._n_out
+        output = np.zeros((n_end - n_start, self._buffer.shape[1]))
+        n_phase_taps = self.phases.shape[1]
+
+        # The outputs n, n + up, n + 2 * up, ... share their phase, their inputs are `down` apart
+        for first in range(n_start, min(n_start + self.up, n_end)):
+            n_outputs = len(range(first, n_end, self.up))
+            position = first * self.down + self.half_length
+            phase_taps = self.phases[position % self.up]
+            newest = position // self.up - self._offset
+            for j in range(n_phase_taps):
+                if phase_taps[j] == 0.0:
+                    continue
+                start = newest - j
+                output[first - n_start::self.up] += phase_taps[j] * self._buffer[start:start + (n_outputs - 1) * self.down + 1:self.down]
+
+        self._n_out = n_end
+        # Keep the inputs of the next output sample
+        oldest = (n_end * self.down + self.half_length) // self.up - (n_phase_taps - 1)
+        drop = max(0, min(oldest - self._offset, len(self._buffer)))
+        self._buffer = self._buffer[drop:]
+        self._offset += drop
+        return output.astype(np.float32)
+
+
+def resample(samples, sample_rate, target_rate):
+    """Resample all channels of `samples` (shape (n_frames, channels)) in one go (see `Resampler`)."""
+    resampler = Resampler(sample_rate, target_rate, samples.shape[1])
+    return np.concatenate([resampler.process(samples), resampler.flush()])
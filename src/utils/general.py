@@ -4,6 +4,11 @@ import csv
 import json
 import os
 
+from functools import lru_cache
+
+from utils.archive_fs import get_filesystem
+from utils.instrumentation import add_bytes_written, is_enabled, timer
+
 
 def dump_to_csv(dump_path, long_df, csv_columns):
     """Dump data into csv file.
@@ -15,34 +20,64 @@ def dump_to_csv(dump_path, long_df, csv_columns):
     """
     os.makedirs(os.path.dirname(dump_path), exist_ok=True)
     try:
-        with open(dump_path, mode='w', encoding='utf-8') as csvfile:
+        with timer("write"), open(dump_path, mode='w', encoding='utf-8') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
             writer.writeheader()
             for data in long_df:
                 writer.writerow(data)
+            if is_enabled():
+                add_bytes_written(csvfile.tell())
     except IOError:
         print("I/O error")
 
 
 def read_json_from_file(file_path):
     """Reads a JSON file and returns the JSON object"""
-    with open(file_path) as json_file:
+    with get_filesystem().open(file_path) as json_file:
         return json.load(json_file)
 
 
-def dump_json_to_file(file_path, json_string):
-    """Dumps a JSON string to a file"""
-    with open(file_path, "w") as json_file:
+@lru_cache(maxsize=1024)
+def read_encounter_locations(encounter_dir):
+    """Reads the `locations.json` file of an encounter directory (cached).
+
+    Returns an empty dictionary if the encounter has no `locations.json` file.
+    The returned dictionary is shared between calls and must not be modified.
+    """
+    locations_path = os.path.join(encounter_dir, "locations.json")
+    if not get_filesystem().isfile(locations_path):
+        return {}
+    return read_json_from_file(locations_path)
+
+
+def dump_json_to_file(file_path, json_string, writer=None):
+    """Dumps a JSON string to a file (queued if a `BackgroundWriter` is given)"""
+    if writer is not None:
+        writer.submit(file_path, json_string)
+        return
+    with timer("write"), open(file_path, "w") as json_file:
         json_file.write(json_string)
+        if is_enabled():
+            add_bytes_written(json_file.tell())
 
 
-def write_dict_to_json_file(data, file_path):
-    """Writes a dictionary to a JSON file"""
-    with open(file_path, 'w') as f:
+def write_dict_to_json_file(data, file_path, writer=None):
+    """Writes a dictionary to a JSON file (queued if a `BackgroundWriter` is given)"""
+    if writer is not None:
+        writer.submit(file_path, json.dumps(data, indent=4, sort_keys=False))
+        return
+    with timer("write"), open(file_path, 'w') as f:
         json.dump(data, f, indent=4, sort_keys=False)
+        if is_enabled():
+            add_bytes_written(f.tell())
 
 
-def dump_to_markdown(path: str, text: list):
-    """Dump data into markdown file."""
-    with open(path, mode='w', encoding='utf-8') as f:
+def dump_to_markdown(path: str, text: list, writer=None):
+    """Dump data into markdown file (queued if a `BackgroundWriter` is given)."""
+    if writer is not None:
+        writer.submit(path, text)
+        return
+    with timer("write"), open(path, mode='w', encoding='utf-8') as f:
         f.write(text)
+        if is_enabled():
+            add_bytes_written(f.tell())
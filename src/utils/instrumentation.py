@@ -0,0 +1,174 @@
+"""Opt-in timers and counters for the hot paths of the processing scripts.
+
+Instrumentation is disabled by default and then costs a single flag check per
+timer. Scripts enable it with `--instrument` (per-run report) or `--profile`
+(report and a cProfile dump readable by pstats/snakeviz):
+
+    with timer("xmltodict.parse"):
+        ...
+    with timer("process_file", path=xml_path):  # also tracked for the slowest files
+        ...
+    count("xml_files")
+    add_bytes_written(n_bytes)
+"""
+
+import cProfile
+import heapq
+import json
+import os
+import threading
+import time
+
+from collections import Counter
+from contextlib import nullcontext
+
+
+REPORT_DIR = "profile/"
+# Number of slowest files listed in the report
+N_SLOWEST = 10
+
+_enabled = False
+_stages = {}
+_counters = Counter()
+_slowest = []
+_bytes_written = 0
+# Guards the statistics, which are also updated from writer threads
+_lock = threading.Lock()
+_NULL_TIMER = nullcontext()
+
+
+class _Timer:
+    """Accumulate the wall time and the CPU time of the calling thread of a block into a stage."""
+
+    __slots__ = ("stage", "path", "start_wall", "start_cpu")
+
+    def __init__(self, stage, path):
+        self.stage = stage
+        self.path = path
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+
+        with _lock:
+            stats = _stages.setdefault(self.stage, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+            stats["calls"] += 1
+            stats["wall"] += wall
+            stats["cpu"] += cpu
+
+            if self.path is not None:
+                entry = (wall, self.stage, self.path)
+                if len(_slowest) < N_SLOWEST:
+                    heapq.heappush(_slowest, entry)
+                else:
+                    heapq.heappushpop(_slowest, entry)
+
+
+def enable():
+    """Enable the instrumentation (and reset the collected statistics)."""
+    global _enabled, _bytes_written
+    _enabled = True
+    _stages.clear()
+    _counters.clear()
+    _slowest.clear()
+    _bytes_written = 0
+
+
+def is_enabled():
+    """Check if the instrumentation is enabled."""
+    return _enabled
+
+
+def timer(stage, path=None):
+    """Context manager timing a block as part of `stage` (and as a file processing time if `path` is given)."""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(stage, path)
+
+
+def count(name, n=1):
+    """Increase the record counter `name`."""
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+
+def add_bytes_written(n_bytes):
+    """Record bytes written to disk (also from writer threads)."""
+    global _bytes_written
+    if _enabled:
+        with _lock:
+            _bytes_written += n_bytes
+
+
+def get_report(name, wall, cpu):
+    """Collect the statistics of the run into a JSON-serializable report."""
+    return {
+        "script": name,
+        "wall": round(wall, 4),
+        "cpu": round(cpu, 4),
+        "stages": {
+            stage: {"calls": stats["calls"], "wall": round(stats["wall"], 4), "cpu": round(stats["cpu"], 4)}
+            for stage, stats in sorted(_stages.items(), key=lambda item: -item[1]["wall"])
+        },
+        "counters": dict(_counters),
+        "bytes_written": _bytes_written,
+        "slowest_files": [
+            {"path": path, "stage": stage, "seconds": round(seconds, 4)}
+            for seconds, stage, path in sorted(_slowest, reverse=True)
+        ],
+    }
+
+
+def print_report(report):
+    """Print a per-run report."""
+    print()
+    print(f"Run report: {report['script']} (wall {report['wall']:.2f} s, CPU {report['cpu']:.2f} s)")
+    print(f"{'Stage':<32} {'Calls':>8} {'Wall [s]':>10} {'CPU [s]':>10}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<32} {stats['calls']:>8} {stats['wall']:>10.3f} {stats['cpu']:>10.3f}")
+    for name, value in report["counters"].items():
+        print(f"{name}: {value}")
+    print(f"Bytes written: {report['bytes_written']}")
+    if report["slowest_files"]:
+        print("Slowest files:")
+        for entry in report["slowest_files"]:
+            print(f"  {entry['seconds']:.3f} s  {entry['path']}")
+
+
+def add_arguments(parser):
+    """Add the `--instrument` and `--profile` options to an argument parser."""
+    parser.add_argument("--instrument", action="store_true", help="time the hot paths and print a per-run report")
+    parser.add_argument("--profile", action="store_true", help="as --instrument, and dump cProfile statistics")
+
+
+def run(function, name, args):
+    """Run the entry point of a script, instrumented if requested by `args`.
+
+    The report is printed and saved to `profile/<name>.json`, the cProfile
+    statistics (with `--profile`) to `profile/<name>.prof`.
+    """
+    if not (args.instrument or args.profile):
+        return function()
+
+    enable()
+    profiler = cProfile.Profile() if args.profile else None
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        if profiler is not None:
+            return profiler.runcall(function)
+        return function()
+    finally:
+        report = get_report(name, time.perf_counter() - start_wall, time.process_time() - start_cpu)
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        with open(os.path.join(REPORT_DIR, f"{name}.json"), "w") as f:
+            json.dump(report, f, indent=4)
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(REPORT_DIR, f"{name}.prof"))
+        print_report(report)
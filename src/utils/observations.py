@@ -0,0 +1,118 @@
+"""Columnar construction of the Observation resources of all encounters at once.
+
+`process_entry` converts and validates every vital sign of every encounter on its
+own. `build_observations` instead takes the flattened rows of all XML files as a
+`utils.query.Dataset` and parses each vital-sign column once (unparseable values
+become a mask instead of a per-row try/except). The resources are then created
+in one sweep from a template per vital sign, validated once with the factory of
+`utils.fhir`: each Observation is a deep copy of the template with the references
+of its encounter and its value (validated once per distinct value). The resources
+(and their JSON) are the same as those of `process_entry`, at a fraction of the
+cost of validating every resource.
+"""
+
+import numpy as np
+
+from utils.fhir import age_group_observation, copy_validated
+from utils.fhir import blood_pressure_diastolic_observation, blood_pressure_systolic_observation
+from utils.fhir import body_temperature_observation, weight_observation
+from utils.fhir import respiratory_rate_observation, respiratory_rate_30s_observation
+from utils.fhir import pulse_oximetry_observation, spirometry_fev1prcnt_observation
+from utils.query import parse_float_column, parse_int_column
+from utils.xml_schema import NUMERIC_FIELDS, TOLERATED_FIELDS
+
+
+# Factories of the vital signs of the long format, in the order of `process_entry`
+OBSERVATION_FACTORIES = {
+    "Diastolic": blood_pressure_diastolic_observation,
+    "Systolic": blood_pressure_systolic_observation,
+    "BodyTemperature": body_temperature_observation,
+    "RespiratoryRate30Sec": respiratory_rate_30s_observation,
+    "RespiratoryRateInOneMinute": respiratory_rate_observation,
+    "PulseOximetry": pulse_oximetry_observation,
+    "Weight": weight_observation,
+    "Spirometry": spirometry_fev1prcnt_observation,
+}
+
+
+def parse_vital_signs(dataset):
+    """Parse the vital-sign columns of a dataset.
+
+    Values which are missing or empty are skipped (as in `process_entry`). Values
+    which cannot be converted raise a ValueError, except for the fields of
+    `TOLERATED_FIELDS`, which are reported and skipped.
+
+    Returns:
+        dict: field -> list of the converted values (None where skipped)
+    """
+    patient_ids = dataset.column("PatientIdentifier")
+    vital_signs = {}
+    for field in OBSERVATION_FACTORIES:
+        column = dataset.column(field)
+        present = column.astype(bool)
+        if NUMERIC_FIELDS[field] is int:
+            parsed, failed = parse_int_column(np.where(present, column, None))
+        else:
+            parsed, failed = parse_float_column(np.where(present, column, None))
+            failed |= present & np.isnan(parsed)
+            parsed = np.where(present & ~failed, parsed, None)
+
+        for position in np.flatnonzero(failed):
+            if field not in TOLERATED_FIELDS:
+                raise ValueError(f"{field} is not a number: {column[position]!r} for patient {patient_ids[position]}")
+            print(f"{field} is not float-converible: ", column[position], " for patient ", patient_ids[position])
+        parsed[failed] = None
+        vital_signs[field] = [None if value is None else NUMERIC_FIELDS[field](value) for value in parsed.tolist()]
+    return vital_signs
+
+
+def build_observations(dataset):
+    """Create the Observation resources of all rows of a dataset.
+
+    Args:
+        dataset (utils.query.Dataset): flattened rows of the XML files
+
+    Returns:
+        list: for each row, the list of its Observation resources (as `process_entry`)
+    """
+    vital_signs = parse_vital_signs(dataset)
+    patient_ids = dataset.column("PatientIdentifier").tolist()
+    encounter_ids = dataset.column("SerialNumber").tolist()
+    age_groups = dataset.column("Age").tolist()
+
+    # Templates (validated once) and the validated values of the quantities
+    templates = {field: factory(0, "", "") for field, factory in OBSERVATION_FACTORIES.items()}
+    quantity_class = type(templates["Systolic"].valueQuantity)
+    value_field = quantity_class.__fields__["value"]
+    quantity_values = {field: {} for field in OBSERVATION_FACTORIES}
+    age_templates = {}
+    template = templates["Systolic"]
+
+    observations = []
+    for row, (patient_id, encounter_id, age_group) in enumerate(zip(patient_ids, encounter_ids, age_groups)):
+        subject_update = {"reference": f"Patient/{patient_id}"}
+        encounter_update = {"reference": f"Encounter/{encounter_id}"}
+        row_observations = []
+
+        if age_group:
+            if age_group not in age_templates:
+                age_templates[age_group] = age_group_observation("ag-" + age_group, "")
+            row_observations.append(copy_validated(age_templates[age_group], {"subject": copy_validated(template.subject, subject_update)}))
+
+        for field, values in vital_signs.items():
+            value = values[row]
+            if value is None:
+                continue
+            field_values = quantity_values[field]
+            if value not in field_values:
+                validated, error = value_field.validate(value, {}, loc="value", cls=quantity_class)
+                if error:
+                    raise ValueError(f"Invalid {field} {value!r} for patient {patient_id}: {error}")
+                field_values[value] = validated
+            row_observations.append(copy_validated(templates[field], {
+                "encounter": copy_validated(template.encounter, encounter_update),
+                "subject": copy_validated(template.subject, subject_update),
+                "valueQuantity": copy_validated(templates[field].valueQuantity, {"value": field_values[value]}),
+            }))
+        observations.append(row_observations)
+    return observations
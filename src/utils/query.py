@@ -0,0 +1,236 @@
+"""Column-oriented queries over the flattened rows of the XML files.
+
+The rows produced by `get_long_df`/`obtain_row_dict` are loaded once into one NumPy
+array per column, with hash indexes on the most queried columns, so that repeated
+filters and group-bys run in milliseconds:
+
+    dataset = Dataset.from_xml(glob.glob("raw_data--anonymised/28-11-2022/*/Data/input/*/*.xml"))
+    copd_norway = dataset.filter(COPD=True, Country="norway", SpO2=("<", 92))
+    copd_norway.value_counts("RecordDate")
+
+Conditions are either values (equality) or `(operator, operand)` tuples with one of
+`<`, `<=`, `>`, `>=`, `==`, `!=` or `in`. Comparisons against numbers use the column
+parsed as floats (unparseable and missing values never match); comparisons against
+strings use the raw values (e.g. `RecordDate=(">=", "2022-06-01")`).
+"""
+
+import csv
+import operator
+
+import numpy as np
+
+from utils.xml_processing import DISEASE_FLAGS, obtain_row_dict
+
+
+INDEXED_COLUMNS = ["PatientIdentifier", "Country", "RecordDate"] + DISEASE_FLAGS
+
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def parse_float_column(values):
+    """Parse a column of strings (or None) as floats in one pass.
+
+    Returns:
+        tuple: (float64 array with NaN where the value is missing or not a number,
+            boolean mask of the values which could not be parsed)
+    """
+    values = np.asarray(values, dtype=object)
+    present = np.not_equal(values, None)
+    parsed = np.full(len(values), np.nan)
+    try:
+        parsed[present] = values[present].astype(np.float64)
+        return parsed, np.zeros(len(values), dtype=bool)
+    except (TypeError, ValueError):
+        pass
+
+    # Some values are not numbers: parse each distinct value once
+    distinct, inverse = np.unique(values[present].astype(str), return_inverse=True)
+    distinct_parsed = np.full(len(distinct), np.nan)
+    for i, value in enumerate(distinct):
+        try:
+            distinct_parsed[i] = float(value)
+        except ValueError:
+            pass
+    parsed[present] = distinct_parsed[inverse]
+    failed = present.copy()
+    failed[present] = np.isnan(distinct_parsed[inverse])
+    return parsed, failed
+
+
+def parse_int_column(values):
+    """Parse a column of strings (or None) as integers (as `int()`), each distinct value once.
+
+    Returns:
+        tuple: (object array of ints, None where the value is missing or not an integer,
+            boolean mask of the values which could not be parsed)
+    """
+    values = np.asarray(values, dtype=object)
+    present = np.not_equal(values, None)
+    parsed = np.full(len(values), None, dtype=object)
+    failed = np.zeros(len(values), dtype=bool)
+    if not present.any():
+        return parsed, failed
+
+    distinct, inverse = np.unique(values[present].astype(str), return_inverse=True)
+    distinct_parsed = np.full(len(distinct), None, dtype=object)
+    for i, value in enumerate(distinct):
+        try:
+            distinct_parsed[i] = int(value)
+        except ValueError:
+            pass
+    parsed[present] = distinct_parsed[inverse]
+    failed[present] = np.equal(distinct_parsed[inverse], None)
+    return parsed, failed
+
+
+class Dataset:
+    """Flattened rows stored as one object array per column."""
+
+    def __init__(self, columns, n_rows, index_columns=INDEXED_COLUMNS):
+        """
+        Args:
+            columns (dict): column name -> object array of length `n_rows`
+            n_rows (int): number of rows
+            index_columns (list): columns indexed (lazily) for equality lookups
+        """
+        self.columns = columns
+        self.n_rows = n_rows
+        self.index_columns = index_columns
+        self._indexes = {}
+        self._numeric = {}
+        self._missing = np.full(n_rows, None, dtype=object)
+
+    @classmethod
+    def from_rows(cls, rows, index_columns=INDEXED_COLUMNS):
+        """Build a dataset from row dictionaries (missing keys become None)."""
+        names = {}
+        for row in rows:
+            names.update(dict.fromkeys(row))
+        columns = {}
+        for name in names:
+            column = np.empty(len(rows), dtype=object)
+            column[:] = [row.get(name) for row in rows]
+            columns[name] = column
+        return cls(columns, len(rows), index_columns)
+
+    @classmethod
+    def from_table(cls, table, index_columns=INDEXED_COLUMNS):
+        """Build a dataset from a `utils.compact.CompactTable` (decoded without a per-row loop)."""
+        columns = {}
+        for name, column in table.columns.items():
+            values = np.empty(len(column.values), dtype=object)
+            values[1:] = column.values[1:]  # missing values (code 0) become None
+            columns[name] = values[np.frombuffer(column.codes, dtype=np.uint32)]
+        return cls(columns, len(table), index_columns)
+
+    @classmethod
+    def from_xml(cls, xml_paths, index_columns=INDEXED_COLUMNS):
+        """Build a dataset from XML files (one row per file, see `obtain_row_dict`)."""
+        return cls.from_rows([obtain_row_dict(xml_path) for xml_path in xml_paths], index_columns)
+
+    @classmethod
+    def from_csv(cls, csv_path, index_columns=INDEXED_COLUMNS):
+        """Build a dataset from a CSV file written by `extract_xml_to_csv`.
+
+        Empty cells become None and "True"/"False" become booleans.
+        """
+        constants = {"": None, "True": True, "False": False}
+        with open(csv_path, encoding="utf-8") as csv_f:
+            rows = [
+                {key: constants.get(value, value) for key, value in row.items()}
+                for row in csv.DictReader(csv_f)
+            ]
+        return cls.from_rows(rows, index_columns)
+
+    def __len__(self):
+        return self.n_rows
+
+    def column(self, name):
+        """Values of a column (all None if the column does not exist)."""
+        return self.columns.get(name, self._missing)
+
+    def numeric(self, name):
+        """Values of a column parsed as floats (NaN if missing or unparseable), cached."""
+        if name not in self._numeric:
+            self._numeric[name], _ = parse_float_column(self.column(name))
+        return self._numeric[name]
+
+    def index(self, name):
+        """Hash index of a column: value -> sorted row positions (built on first use)."""
+        if name not in self._indexes:
+            positions = {}
+            for position, value in enumerate(self.column(name)):
+                positions.setdefault(value, []).append(position)
+            self._indexes[name] = {value: np.array(rows) for value, rows in positions.items()}
+        return self._indexes[name]
+
+    def mask(self, **conditions):
+        """Boolean mask of the rows matching all conditions (see the module docstring)."""
+        mask = np.ones(self.n_rows, dtype=bool)
+        for name, condition in conditions.items():
+            mask &= self._condition_mask(name, condition)
+        return mask
+
+    def filter(self, **conditions):
+        """Dataset of the rows matching all conditions."""
+        return self.take(np.flatnonzero(self.mask(**conditions)))
+
+    def take(self, positions):
+        """Dataset of the rows at `positions`."""
+        columns = {name: column[positions] for name, column in self.columns.items()}
+        return Dataset(columns, len(positions), self.index_columns)
+
+    def group_by(self, name):
+        """Group the rows by the values of a column.
+
+        Returns:
+            dict: value -> Dataset of the rows with that value
+        """
+        return {value: self.take(positions) for value, positions in self.index(name).items()}
+
+    def value_counts(self, name):
+        """Number of rows per value of a column."""
+        return {value: len(positions) for value, positions in self.index(name).items()}
+
+    def n_unique(self, name):
+        """Number of distinct values of a column (None included)."""
+        return len(self.index(name))
+
+    def rows(self):
+        """Iterate over the rows as dictionaries (None values are left out)."""
+        names = list(self.columns)
+        for values in zip(*(self.columns[name] for name in names)):
+            yield {name: value for name, value in zip(names, values) if value is not None}
+
+    def _condition_mask(self, name, condition):
+        if not isinstance(condition, tuple):
+            condition = ("==", condition)
+        op, operand = condition
+
+        # Equality on an indexed column
+        if op == "==" and name in self.index_columns:
+            mask = np.zeros(self.n_rows, dtype=bool)
+            mask[self.index(name).get(operand, [])] = True
+            return mask
+        if op == "in":
+            return np.isin(self.column(name), list(operand))
+
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator: {op}")
+        if isinstance(operand, (int, float)) and not isinstance(operand, bool):
+            numeric = self.numeric(name)
+            with np.errstate(invalid="ignore"):
+                return OPERATORS[op](numeric, operand) & ~np.isnan(numeric)
+
+        column = self.column(name)
+        present = np.not_equal(column, None)
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[present] = OPERATORS[op](column[present], operand).astype(bool)
+        return mask
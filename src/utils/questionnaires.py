@@ -0,0 +1,284 @@
+"""Declarative questionnaires and a compiled builder of their QuestionnaireResponse resources.
+
+Each questionnaire of `QUESTIONNAIRES` is a list of items (linkId, text, answers);
+each answer is read from a field of the row dictionary of an XML file:
+
+    ("string", field)          valueString (skipped if None or "")
+    ("integer", field)         valueInteger (skipped if None)
+    ("boolean", field)         valueBoolean (skipped if None)
+    ("coding", field, codes)   valueCoding of codes[value] = (code, display), skipped if None
+    ("flag", field, coding)    valueCoding of the fixed (code, display) if the value is truthy
+
+An item without answers is left out. New questions are added as data. The
+`QuestionnaireBuilder` memoizes the answers of the coded and boolean answers (few
+distinct values) and the whole items which only have such answers, so most items
+are validated once per distinct value instead of once per resource. The resources
+get copies of the memoized answers and items (see `utils.fhir.copy_validated`), as
+of a resource validated once with the fixed fields, and share no mutable object.
+"""
+
+from utils.fhir import copy_validated
+from utils.fhir import QuestionnaireResponse, QuestionnaireResponseItem, QuestionnaireResponseItemAnswer
+
+
+CODING_SYSTEM = "./FHIR_CODING_SYSTEMS.md"
+
+BREATHLESSNESS_CODES = {
+    None: None,
+    0: ("ph-breathlessness-0", "I only get breathless when I do strenuous exercise"),
+    1: ("ph-breathlessness-1", "I get short of breath when hurrying on the level or walking up a slight hil"),
+    2: ("ph-breathlessness-2", "On level ground I walk slower than people of the same age because of breathlessness or have to stop for breath w),n walking at my own pace"),
+    3: ("ph-breathlessness-3", "I stop for breath after walking about 100 yards or after a few minutes on the level ground"),
+    4: ("ph-breathlessness-4", "I am too breathless to leave the house or get out of breath when dressing or undressing"),
+}
+
+SMOKING_HABIT_CODES = {
+    None: None,
+    0: ("ph-smoking-0", "Never"),
+    1: ("ph-smoking-1", "Ex-smoker"),
+    2: ("ph-smoking-2", "Current smoker"),
+}
+
+PARTICIPATION_CODES = {
+    None: None,
+    0: ("pp-0", "Continue participation"),
+    1: ("pp-1", "Intensive care with future return"),
+    2: ("pp-2", "Intensive care - discontinued"),
+    3: ("pp-3", "Personal request - discontinued"),
+    4: ("pp-4", "End of trial"),
+    5: ("pp-5", "Other"),
+}
+
+
+COUGHING_CODES = {
+    None: None,
+    0: ("cc-coughing-0", "Normal or better"),
+    1: ("cc-coughing-1", "Somewhat worse than normal"),
+    2: ("cc-coughing-2", "Much worse than normal"),
+}
+
+FATIGUE_CODES = {
+    None: None,
+    0: ("cc-fatigue-0", "Normal or better"),
+    1: ("cc-fatigue-1", "Somewhat worse than normal"),
+    2: ("cc-fatigue-2", "Much worse than normal"),
+}
+
+SOB_CODES= {
+    None: None,
+    0: ("cc-sob-0", "Normal or better"),
+    1: ("cc-sob-1", "Somewhat worse than normal"),
+    2: ("cc-sob-2", "Much worse than normal"),
+}
+
+
+# Questionnaire id -> items, in the order of the resources and of their items
+QUESTIONNAIRES = {
+    "patient-history": [
+        {"linkId": "ph-daily-medication", "text": "Daily Medication (name + dosage + time/day)", "answers": [
+            ("string", "DailyMedication"),
+        ]},
+        {"linkId": "ph-smoking", "text": "Smoking Habit", "answers": [
+            ("coding", "SmokingHabit", SMOKING_HABIT_CODES),
+        ]},
+        {"linkId": "ph-daily-cough", "text": "Daily Cough", "answers": [
+            ("boolean", "DailyCough"),
+        ]},
+        {"linkId": "ph-breathlessness", "text": "Self-statement about breathlessness", "answers": [
+            ("coding", "Statement", BREATHLESSNESS_CODES),
+        ]},
+        {"linkId": "cigarettes-per-day", "text": "Cigarettes per day? (Average)", "answers": [
+            ("integer", "CigarettesPerDay"),
+        ]},
+        {"linkId": "years-smoking", "text": "Years of smoking", "answers": [
+            ("integer", "YearsOfSmoking"),
+        ]},
+        {"linkId": "disqualify-patient", "text": "Disqualify patient?", "answers": [
+            ("boolean", "DisqualifyPatient"),
+        ]},
+    ],
+    "background-disease": [
+        {"linkId": "bd-lung", "text": "Chronic Lung Disease", "answers": [
+            ("flag", "Asthma", ("bd-lung-asthma", "Asthma")),
+            ("flag", "COPD", ("bd-lung-copd", "COPD")),
+            ("flag", "Emphysema", ("bd-lung-emphysema", "Emphysema")),
+            ("flag", "ChronicBronchitis", ("bd-lung-chronic-bronchitis", "Chronic Bronchitis")),
+            ("flag", "LungCancer", ("bd-lung-lung-cancer", "Lung Cancer")),
+            ("string", "LungDisease"),
+        ]},
+        {"linkId": "bd-cv", "text": "Chronic Cardiovascular Disease", "answers": [
+            ("flag", "Hypertension", ("bd-cv-hypertension", "Hypertension")),
+            ("flag", "AnginaPectoris", ("bd-cv-angina-pectoris", "Angina Pectoris")),
+            ("flag", "MyocardialInfarction", ("bd-cv-myocardial-infarction", "Myocardial Infarction")),
+            ("flag", "HeartFailure", ("bd-cv-heart-failure", "Heart Failure")),
+            ("string", "HeartDisease"),
+        ]},
+        {"linkId": "bd-other", "text": "Other", "answers": [
+            ("flag", "Diabetes", ("bd-other-diabetes", "Diabetes")),
+            ("flag", "RespiratoryInfection", ("bd-other-cri", "Current Respiratory Disease")),
+        ]},
+    ],
+    "change-in-care": [
+        {"linkId": "1", "text": "New or Increased Medication (name + dosage + time/day)", "answers": [
+            ("string", "NewIncreasedMedication"),
+        ]},
+        {"linkId": "2", "text": "Patient participation", "answers": [
+            ("coding", "PatientParticipation", PARTICIPATION_CODES),
+        ]},
+    ],
+    "current-condition": [
+        {"linkId": "1", "text": "Coughing", "answers": [
+            ("coding", "Coughing", COUGHING_CODES),
+        ]},
+        {"linkId": "2", "text": "Fatigue", "answers": [
+            ("coding", "Fatigue", FATIGUE_CODES),
+        ]},
+        {"linkId": "3", "text": "Shortness of Breath", "answers": [
+            ("coding", "ShortnessOfBreath", SOB_CODES),
+        ]},
+    ],
+}
+
+# Answer types with few distinct values, whose answers (and items) are memoized
+_STATIC_TYPES = {"boolean", "coding", "flag"}
+
+
+class QuestionnaireBuilder:
+    """Build the QuestionnaireResponse of a questionnaire spec from row dictionaries."""
+
+    def __init__(self, questionnaire_id, items):
+        """
+        Args:
+            questionnaire_id (str): id of the QuestionnaireResponse resources
+            items (list): items of the questionnaire (see `QUESTIONNAIRES`)
+        """
+        self.questionnaire_id = questionnaire_id
+        self.items = items
+        for item in items:
+            for answer in item["answers"]:
+                if answer[0] not in _STATIC_TYPES | {"string", "integer"}:
+                    raise ValueError(f"Unknown answer type {answer[0]} of item {item['linkId']}")
+        self._fields = [[answer[1] for answer in item["answers"]] for item in items]
+        self._static = [all(answer[0] in _STATIC_TYPES for answer in item["answers"]) for item in items]
+        # (item, field values) -> item (or None) for items with static answers only
+        self._item_cache = {}
+        # (item, answer, value) -> answer (or None) for static answers
+        self._answer_cache = {}
+        # Validated resource copied for each row (created on first use)
+        self._template = None
+
+    def build(self, row_dict, patient_id, encounter_id, practitioner_id):
+        """Create the QuestionnaireResponse of a row of data from an XML file."""
+        items = []
+        for i, fields in enumerate(self._fields):
+            values = tuple(row_dict.get(field) for field in fields)
+            if self._static[i]:
+                key = (i, values)
+                if key not in self._item_cache:
+                    self._item_cache[key] = self._build_item(i, values)
+                item = self._item_cache[key]
+                if item is not None:
+                    item = copy_validated(item)
+            else:
+                item = self._build_item(i, values)
+            if item is not None:
+                items.append(item)
+
+        template = self._get_template()
+        return copy_validated(template, {
+            "subject": copy_validated(template.subject, {"reference": f"Patient/{patient_id}"}),
+            "encounter": copy_validated(template.encounter, {"reference": f"Encounter/{encounter_id}"}),
+            "author": copy_validated(template.author, {"reference": f"Practitioner/{practitioner_id}"}),
+            "source": copy_validated(template.source, {"reference": f"Patient/{patient_id}"}),
+            "item": items,
+        })
+
+    def _get_template(self):
+        """QuestionnaireResponse validated once, of which the resources are copies."""
+        if self._template is None:
+            self._template = QuestionnaireResponse(
+                id=self.questionnaire_id,
+                status="completed",
+                meta={
+                    "versionId": "1.0.0",
+                    "lastUpdated": "2023-03-09T00:00:00Z"
+                },
+                subject={
+                    "reference": "Patient/",
+                    "type": "Patient",
+                },
+                encounter={
+                    "reference": "Encounter/",
+                    "type": "Encounter",
+                },
+                author={
+                    "reference": "Practitioner/",
+                    "type": "Practitioner",
+                },
+                source={
+                    "reference": "Patient/",
+                    "type": "Patient",
+                },
+                item=[],
+            )
+        return self._template
+
+    def _build_item(self, i, values):
+        item = self.items[i]
+        answers = []
+        for j, (answer, value) in enumerate(zip(item["answers"], values)):
+            if answer[0] in _STATIC_TYPES:
+                key = (i, j, value)
+                if key not in self._answer_cache:
+                    self._answer_cache[key] = _build_answer(answer, value)
+                answer = self._answer_cache[key]
+                if answer is not None:
+                    answer = copy_validated(answer)
+            else:
+                answer = _build_answer(answer, value)
+            if answer is not None:
+                answers.append(answer)
+        if not answers:
+            return None
+        return QuestionnaireResponseItem(linkId=item["linkId"], text=item["text"], answer=answers)
+
+
+def _build_answer(answer, value):
+    """Create the answer of an answer spec for a value (None if there is no answer)."""
+    answer_type = answer[0]
+    if answer_type == "string":
+        if value is None or value == "":
+            return None
+        return QuestionnaireResponseItemAnswer(valueString=value)
+    if answer_type in ("integer", "boolean"):
+        if value is None:
+            return None
+        if answer_type == "integer":
+            return QuestionnaireResponseItemAnswer(valueInteger=value)
+        return QuestionnaireResponseItemAnswer(valueBoolean=value)
+
+    if answer_type == "coding":
+        code_and_statement = answer[2][value]
+    else:
+        code_and_statement = answer[2] if value else None
+    if code_and_statement is None:
+        return None
+    return QuestionnaireResponseItemAnswer(
+        valueCoding={
+            "system": CODING_SYSTEM,
+            "code": code_and_statement[0],
+            "display": code_and_statement[1],
+        }
+    )
+
+
+BUILDERS = [QuestionnaireBuilder(questionnaire_id, items) for questionnaire_id, items in QUESTIONNAIRES.items()]
+
+
+def build_questionnaire_responses(row_dict, patient_id, encounter_id, practitioner_id):
+    """Create the QuestionnaireResponse resources of all questionnaires for a row of data from an XML file.
+
+    Returns:
+        list: QuestionnaireResponse resources in the order of `QUESTIONNAIRES`
+    """
+    return [builder.build(row_dict, patient_id, encounter_id, practitioner_id) for builder in BUILDERS]
@@ -0,0 +1,127 @@
+"""Deterministic partitioning of the work of the scripts across several nodes.
+
+With `--shard i/N` (see `add_arguments`/`configure`), a script only processes the
+patient directories (`Data/input/<patient>/`) whose stable hash falls into shard
+`i` of `N` (0-based), so that N nodes running the same script with the shards
+0/N ... N-1/N process every directory exactly once:
+
+    python src/extract_xml_to_csv.py --shard 0/4    # node 1
+    python src/extract_xml_to_csv.py --shard 1/4    # node 2
+    ...
+    python src/merge_shards.py
+
+The hash only depends on the path of the patient directory below the raw data
+root, so all scripts (and the local tree and the archives) agree on the shards.
+Outputs shared by all directories (CSV files, reports, stores) are written per shard
+(see `shard_path`) and merged with `merge_shards.py`.
+"""
+
+import argparse
+import hashlib
+import os
+
+from collections import namedtuple
+
+
+# Suffix of the per-shard outputs (e.g. `extracted/horizon.shard-001-of-004.csv`)
+SHARD_SUFFIX = ".shard-{:03d}-of-{:03d}"
+SHARD_GLOB = ".shard-[0-9][0-9][0-9]-of-[0-9][0-9][0-9]"
+
+Shard = namedtuple("Shard", ["index", "count"])
+
+_shard = None
+
+
+def parse_shard(value):
+    """Parse a shard given as "i/N" (0 <= i < N)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value!r}, expected i/N")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value!r}, expected 0 <= i < N")
+    return Shard(index, count)
+
+
+def shard_key(path):
+    """Get the key a path is sharded by: its patient directory below the raw data root.
+
+    Paths outside of a `Data/input/<patient>/` directory are their own key.
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    if "input" in parts[:-1]:
+        end = parts.index("input") + 2
+        return "/".join(parts[1:end])
+    return "/".join(parts)
+
+
+def shard_of(path, count):
+    """Get the shard (0 <= shard < count) of a path from the stable hash of its key."""
+    digest = hashlib.md5(shard_key(path).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def in_shard(path, shard=None):
+    """Check if a path belongs to `shard` (default: the configured shard, all paths if none)."""
+    shard = shard or _shard
+    return shard is None or shard_of(path, shard.count) == shard.index
+
+
+def select(paths, shard=None):
+    """Keep the paths which belong to `shard` (default: the configured shard)."""
+    shard = shard or _shard
+    if shard is None:
+        return list(paths)
+    return [path for path in paths if in_shard(path, shard)]
+
+
+def shard_path(path, shard=None):
+    """Get the path of the per-shard output `path` (unchanged without a shard).
+
+    The suffix goes before the extension of files and at the end of directories:
+    `extracted/horizon.csv` -> `extracted/horizon.shard-001-of-004.csv`,
+    `filtered/` -> `filtered.shard-001-of-004/`.
+    """
+    shard = shard or _shard
+    if shard is None:
+        return path
+    suffix = SHARD_SUFFIX.format(shard.index, shard.count)
+    if path.endswith("/"):
+        return path.rstrip("/") + suffix + "/"
+    root, extension = os.path.splitext(path)
+    return root + suffix + extension
+
+
+def shard_pattern(path):
+    """Get the glob pattern matching the per-shard outputs of `path` (see `shard_path`)."""
+    if path.endswith("/"):
+        return path.rstrip("/") + SHARD_GLOB + "/"
+    root, extension = os.path.splitext(path)
+    return root + SHARD_GLOB + extension
+
+
+def get_shard():
+    """Get the configured shard (None if the scripts process everything)."""
+    return _shard
+
+
+def set_shard(shard):
+    """Set the shard processed by the scripts (None: everything)."""
+    global _shard
+    _shard = shard
+
+
+def add_arguments(parser):
+    """Add the `--shard` option to an argument parser."""
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        metavar="I/N",
+        help="only process the patient directories of shard I of N (0-based), see utils.sharding",
+    )
+
+
+def configure(args):
+    """Set the shard given with `--shard` (if any)."""
+    set_shard(args.shard)
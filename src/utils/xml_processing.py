@@ -4,21 +4,39 @@ import xmltodict
 
 from datetime import datetime
 
+from utils.archive_fs import get_filesystem
+from utils.instrumentation import count, timer
+
+
+# Disease flags extracted from `LungDisease` and `HeartDisease` by `get_long_df`
+DISEASE_FLAGS = [
+    "Asthma",
+    "COPD",
+    "Emphysema",
+    "ChronicBronchitis",
+    "LungCancer",
+    "Hypertension",
+    "AnginaPectoris",
+    "MyocardialInfarction",
+    "HeartFailure",
+]
+
 
 def obtain_row_dict(xml_path):
     """This function takes in a path to an XML file and returns a dictionary with the data
     from the XML file in a long format.
     """
     # Read the xml file
-    with open(xml_path, "r", encoding="utf-8") as xml_f:
-        xml_content = xmltodict.parse(xml_f.read())
-        xml_content = xml_content["Bat-Call_PatientData"]
+    xml_content = read_xml(xml_path)
 
     # Get the long format of the data
-    long_data_row = get_long_df(xml_content)
+    with timer("get_long_df"):
+        long_data_row = get_long_df(xml_content)
     # Add the location (care facility) and the date to the dictionary
     # long_data_row['Location'] = get_location(xml_path)
-    long_data_row['RecordDate'] = get_date(xml_path)
+    with timer("get_date"):
+        long_data_row['RecordDate'] = get_date(xml_path)
+    count("xml_files")
     # Add a unique identifier for each patient
     # try:
         # long_data_row['PatientIdentifierUnique'] = long_data_row['PatientIdentifier'] + '-' + long_data_row['Location']
@@ -29,6 +47,16 @@ def obtain_row_dict(xml_path):
     return long_data_row
 
 
+def read_xml(xml_path):
+    """Read and parse an XML file with patient data (the `Bat-Call_PatientData` element)."""
+    with timer("read_xml"):
+        with get_filesystem().open(xml_path, "r", encoding="utf-8") as xml_f:
+            xml_string = xml_f.read()
+    with timer("xmltodict.parse"):
+        xml_content = xmltodict.parse(xml_string)
+        return xml_content["Bat-Call_PatientData"]
+
+
 def get_long_df(dictionary, prefix=''):
     """This function takes a dictionary and flattens it into a single row.
     It takes a prefix argument that is used to build a key hierarchy.
@@ -294,6 +322,22 @@ def encode_respiratory_infection(entry):
     return idx
 
 
+# Encoders of the categorical fields, by XML tag (raise `ValueError` on unknown values)
+CATEGORICAL_ENCODERS = {
+    "DisqualifyPatient": encode_disqualify_patient,
+    "Health": encode_health,
+    "Statement": encode_statement,
+    "SmokingHabit": encode_smoking_habit,
+    "Coughing": encode_cfs,
+    "Fatigue": encode_cfs,
+    "ShortnessOfBreath": encode_cfs,
+    "PatientParticipation": encode_patient_participation,
+    "Diabetes": encode_diabetes,
+    "DailyCough": encode_daily_cough,
+    "RespiratoryInfection": encode_respiratory_infection,
+}
+
+
 def get_location(path):
     """Return the location (care facility) where files were recorded."""
     try:
@@ -314,9 +358,11 @@ def get_date(xml_path):
     Returns:
         str: date in the format YYYY-MM-DD
     """
+    fs = get_filesystem()
     directory_path = os.path.dirname(xml_path)
     # Get all the dates-directories in the directory of the xml file
-    dates = [x.path for x in os.scandir(directory_path) if os.path.isdir(x)]
+    dates = [os.path.join(directory_path, x) for x in fs.listdir(directory_path)]
+    dates = [x for x in dates if fs.isdir(x)]
 
     # If there are multiple dates, return the date that has some recordings collected
     # Remark: it does not happen that there are multiple dates with recordings collected
@@ -324,7 +370,7 @@ def get_date(xml_path):
         nonempty_dates = []
         for date in dates:
             single_date = os.path.basename(date)
-            if len(os.listdir(date)) > 1:
+            if len(fs.listdir(date)) > 1:
                 nonempty_dates.append(single_date)
         # assert len(nonempty_dates) == 1, (xml_path, nonempty_dates)
         if len(nonempty_dates) > 1:
@@ -333,7 +379,7 @@ def get_date(xml_path):
 
     # If there is only one date, return that date (provided that some recordings were collected)
     if len(dates) == 1:
-        assert len(os.listdir(dates[0])) > 0
+        assert len(fs.listdir(dates[0])) > 0
         return datetime.strptime(os.path.basename(dates[0]), '%Y_%m_%d').strftime('%Y-%m-%d')
 
     # If there are no dates, return None
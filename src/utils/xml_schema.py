@@ -0,0 +1,190 @@
+"""Schema inference and drift detection over the XML files.
+
+Every XML file is parsed once (in parallel) to collect the full set of fields and
+output columns, the number of distinct values of each field and the values the
+extraction would fail on: unknown categorical values (see `CATEGORICAL_ENCODERS`),
+values of numeric fields which are not numbers and values outside the allowed sets
+given by the caller. The extraction and export scripts run it with
+`--check-schema` to fail within seconds instead of in the middle of a run.
+"""
+
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from tqdm import tqdm
+
+from utils.xml_processing import CATEGORICAL_ENCODERS, get_long_df, read_xml
+
+
+# Numeric fields of the long format and their conversion in `export_to_fhir`
+NUMERIC_FIELDS = {
+    "Diastolic": int,
+    "Systolic": int,
+    "BodyTemperature": float,
+    "RespiratoryRate30Sec": int,
+    "RespiratoryRateInOneMinute": int,
+    "PulseOximetry": float,
+    "Weight": float,
+    "Spirometry": float,
+}
+# Numeric fields whose unparseable values are skipped by `export_to_fhir` (reported, not fatal)
+TOLERATED_FIELDS = {"Weight"}
+
+# Distinct values tracked per field (the cardinality is reported as "> N" beyond)
+MAX_DISTINCT_VALUES = 1000
+# Example files listed per problematic value
+N_EXAMPLES = 3
+
+# Number of worker processes (None: one per CPU)
+N_WORKERS = None
+# Number of files sent to a worker at once
+CHUNK_SIZE = 64
+
+
+def scan_file(xml_path, allowed_values=None):
+    """Collect the fields of an XML file and the values the extraction would fail on.
+
+    Args:
+        xml_path (str): path to the XML file
+        allowed_values (dict): field of the long format -> allowed (lowercase) values
+
+    Returns:
+        dict: path, parse error (or None), raw fields (flattened tag -> value), output
+            columns (None if the file cannot be extracted) and problems
+            as a list of (field, kind, value)
+    """
+    result = {"path": xml_path, "error": None, "fields": {}, "columns": None, "problems": []}
+    try:
+        xml_content = read_xml(xml_path)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+        return result
+
+    for key, tag, value in flatten_fields(xml_content):
+        result["fields"][key] = value
+        encoder = CATEGORICAL_ENCODERS.get(tag)
+        if encoder is None:
+            continue
+        try:
+            encoder(value)
+        except ValueError:
+            result["problems"].append((key, "unknown categorical value", value))
+    if result["problems"]:
+        return result
+
+    long_data_row = get_long_df(xml_content)
+    result["columns"] = list(long_data_row)
+
+    for field, convert in NUMERIC_FIELDS.items():
+        value = long_data_row.get(field)
+        if not value:
+            continue
+        try:
+            convert(value)
+        except ValueError:
+            kind = "not a number (skipped)" if field in TOLERATED_FIELDS else "not a number"
+            result["problems"].append((field, kind, value))
+
+    for field, values in (allowed_values or {}).items():
+        value = long_data_row.get(field)
+        if value and value not in values:
+            result["problems"].append((field, "unexpected value", value))
+    return result
+
+
+def flatten_fields(dictionary, prefix=""):
+    """Iterate over the string values of a parsed XML file as (flattened key, tag, value).
+
+    The keys are built as in `get_long_df`, before the fields are expanded or encoded.
+    """
+    if not isinstance(dictionary, dict):
+        return
+    for k, v in dictionary.items():
+        if isinstance(v, str):
+            yield prefix + k, k, v
+        else:
+            yield from flatten_fields(v, prefix + k + "_")
+
+
+def scan_files(xml_paths, allowed_values=None, n_workers=N_WORKERS):
+    """Scan XML files in parallel and aggregate their schema.
+
+    Returns:
+        dict: number of files, parse errors, output columns, per-field statistics
+            (number of files, distinct values) and problems
+            (field -> kind -> value -> count and example files)
+    """
+    schema = {"files": len(xml_paths), "errors": [], "columns": set(), "fields": {}, "problems": {}}
+    distinct = {}
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = executor.map(partial(scan_file, allowed_values=allowed_values), xml_paths, chunksize=CHUNK_SIZE)
+        for result in tqdm(results, total=len(xml_paths), desc="Scanning XML files"):
+            if result["error"] is not None:
+                schema["errors"].append({"path": result["path"], "error": result["error"]})
+                continue
+            schema["columns"].update(result["columns"] or [])
+
+            for key, value in result["fields"].items():
+                stats = schema["fields"].setdefault(key, {"files": 0, "distinct": 0, "capped": False})
+                stats["files"] += 1
+                values = distinct.setdefault(key, set())
+                if len(values) < MAX_DISTINCT_VALUES:
+                    values.add(value)
+                elif value not in values:
+                    stats["capped"] = True
+
+            for field, kind, value in result["problems"]:
+                entry = schema["problems"].setdefault(field, {}).setdefault(kind, {}).setdefault(
+                    value, {"count": 0, "examples": []}
+                )
+                entry["count"] += 1
+                if len(entry["examples"]) < N_EXAMPLES:
+                    entry["examples"].append(result["path"])
+
+    for key, values in distinct.items():
+        schema["fields"][key]["distinct"] = len(values)
+    schema["columns"] = sorted(schema["columns"])
+    schema["fields"] = dict(sorted(schema["fields"].items()))
+    return schema
+
+
+def is_fatal(schema):
+    """Check if the extraction would fail on the scanned files."""
+    if schema["errors"]:
+        return True
+    return any(
+        not kind.endswith("(skipped)")
+        for kinds in schema["problems"].values()
+        for kind in kinds
+    )
+
+
+def print_schema_report(schema):
+    """Print the fields, their cardinalities and the problems found by `scan_files`."""
+    print(f"Scanned {schema['files']} XML files: {len(schema['columns'])} output columns, {len(schema['fields'])} fields")
+    print(f"{'Field':<48} {'Files':>7} {'Distinct':>9}")
+    for key, stats in schema["fields"].items():
+        distinct = f"> {stats['distinct']}" if stats["capped"] else str(stats["distinct"])
+        print(f"{key:<48} {stats['files']:>7} {distinct:>9}")
+
+    for error in schema["errors"]:
+        print(f"Cannot parse {error['path']}: {error['error']}")
+    for field, kinds in schema["problems"].items():
+        for kind, values in kinds.items():
+            for value, entry in values.items():
+                examples = ", ".join(os.path.basename(os.path.dirname(path)) for path in entry["examples"])
+                print(f"{field}: {kind} {value!r} in {entry['count']} files (e.g. {examples})")
+
+
+def check_xml_schema(xml_paths, allowed_values=None):
+    """Scan XML files and print the report; return False if the extraction would fail."""
+    schema = scan_files(xml_paths, allowed_values)
+    fatal = is_fatal(schema)
+    if fatal or schema["problems"]:
+        print_schema_report(schema)
+    if fatal:
+        print("Schema check failed")
+    return not fatal
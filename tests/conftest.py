@@ -0,0 +1,7 @@
+"""The scripts import their helpers as `utils.<module>` from `src`."""
+
+import os
+import sys
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
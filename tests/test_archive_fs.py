@@ -0,0 +1,97 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from utils.archive_fs import ArchiveFS
+
+
+WAV_PATH = "raw_data--anonymised/28-11-2022/site/Data/input/p1/rec/10_31_07_ch1.wav"
+XML_PATH = "raw_data--anonymised/28-11-2022/site/Data/input/p1/p1.xml"
+WAV_DATA = bytes(range(256)) * 64
+XML_DATA = "<Bat-Call_PatientData>é</Bat-Call_PatientData>"
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # The archives are mounted and the TAR indexes cached relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def make_zip(path):
+    with zipfile.ZipFile(path, "w") as zip_f:
+        # The data offset depends on the variable fields of the local header
+        info = zipfile.ZipInfo(WAV_PATH)
+        info.compress_type = zipfile.ZIP_STORED
+        info.extra = b"\xfe\xca\x04\x00abcd"
+        zip_f.writestr(info, WAV_DATA)
+        zip_f.writestr(XML_PATH, XML_DATA, compress_type=zipfile.ZIP_DEFLATED)
+    return path
+
+
+def make_tar(path, mode):
+    with tarfile.open(path, mode) as tar_f:
+        for name, data in [(WAV_PATH, WAV_DATA), (XML_PATH, XML_DATA.encode("utf-8"))]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar_f.addfile(info, io.BytesIO(data))
+    return path
+
+
+def test_zip_stored_member_is_read_in_place():
+    fs = ArchiveFS([make_zip("data.zip")])
+    archive_path, offset = fs.locate(WAV_PATH)
+    assert archive_path == os.path.abspath("data.zip")
+    with open(archive_path, "rb") as f:
+        f.seek(offset)
+        assert f.read(len(WAV_DATA)) == WAV_DATA
+
+    with fs.open(WAV_PATH, "rb") as f:
+        assert f.read() == WAV_DATA
+        f.seek(100)
+        assert f.read(4) == WAV_DATA[100:104]
+    assert fs.getsize(WAV_PATH) == len(WAV_DATA)
+
+
+def test_zip_compressed_member_is_streamed():
+    fs = ArchiveFS([make_zip("data.zip")])
+    assert fs.locate(XML_PATH) is None
+    with fs.open(XML_PATH, "r", encoding="utf-8") as f:
+        assert f.read() == XML_DATA
+
+
+@pytest.mark.parametrize("name, mode, in_place", [("data.tar", "w", True), ("data.tgz", "w:gz", False)])
+def test_tar_members(name, mode, in_place):
+    fs = ArchiveFS([make_tar(name, mode)])
+    assert (fs.locate(WAV_PATH) is not None) == in_place
+    with fs.open(WAV_PATH, "rb") as f:
+        assert f.read() == WAV_DATA
+    with fs.open(XML_PATH, "r", encoding="utf-8") as f:
+        assert f.read() == XML_DATA
+
+    # The second mount reads the cached index
+    assert os.listdir(".archive_index")
+    assert ArchiveFS([name])._files == fs._files
+
+
+def test_tree_and_local_overlay():
+    fs = ArchiveFS([make_zip("data.zip")])
+    assert fs.glob("raw_data--anonymised/*/*/Data/input/*/*.xml") == [XML_PATH]
+    assert fs.glob("raw_data--anonymised/*/*/Data/input/*/") == ["raw_data--anonymised/28-11-2022/site/Data/input/p1/"]
+    assert fs.isdir("raw_data--anonymised/28-11-2022/site/Data/input/p1/rec")
+    assert fs.isfile(WAV_PATH) and not fs.isfile("raw_data--anonymised/missing.wav")
+    walked = {root: files for root, _, files in fs.walk("raw_data--anonymised")}
+    assert walked[os.path.dirname(WAV_PATH)] == [os.path.basename(WAV_PATH)]
+
+    # Local files take precedence over the archive members
+    os.makedirs(os.path.dirname(XML_PATH))
+    with open(XML_PATH, "w", encoding="utf-8") as f:
+        f.write("local")
+    with fs.open(XML_PATH, "r", encoding="utf-8") as f:
+        assert f.read() == "local"
+    assert fs.locate(XML_PATH) == (XML_PATH, 0)
+
+    with pytest.raises(FileNotFoundError):
+        fs.open("raw_data--anonymised/missing.xml")
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.array_store import INDEX_FILENAME, ArrayStoreReader, ArrayStoreWriter
+
+
+def test_round_trip(tmp_path):
+    root = str(tmp_path / "store")
+    arrays = [np.arange(n * 3, dtype=np.int16).reshape(n, 3) for n in (5, 0, 1000, 7)]
+    with ArrayStoreWriter(root, dtype="int16", shard_size_mb=0.001, metadata={"sample_rate": 4000}) as store:
+        for i, array in enumerate(arrays):
+            assert store.append(array, encounter=f"sn{i % 2}", filename=f"{i}.wav") == i
+
+    reader = ArrayStoreReader(root)
+    assert len(reader) == len(arrays) and reader.metadata == {"sample_rate": 4000}
+    assert len({entry["shard"] for entry in reader.entries}) > 1
+    for i, array in enumerate(arrays):
+        assert reader[i].dtype == np.int16
+        np.testing.assert_array_equal(reader[i], array)
+    assert reader.find(encounter="sn1") == [1, 3]
+    assert reader.group_by("encounter") == {("sn0",): [0, 2], ("sn1",): [1, 3]}
+
+
+def test_no_index_on_failure(tmp_path):
+    root = str(tmp_path / "store")
+    with pytest.raises(RuntimeError):
+        with ArrayStoreWriter(root) as store:
+            store.append(np.zeros(10))
+            raise RuntimeError("filtering failed")
+    assert os.listdir(root) == ["shard-00000.bin"]
+    assert not os.path.exists(os.path.join(root, INDEX_FILENAME))
+    with pytest.raises(FileNotFoundError):
+        ArrayStoreReader(root)
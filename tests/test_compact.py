@@ -0,0 +1,48 @@
+from utils.compact import CompactTable
+from utils.query import Dataset
+
+
+ROWS = [
+    {"Country": "norway", "Age": "60-69", "COPD": True, "Weight": 80.0},
+    {"Country": "spain", "COPD": False, "Note": None},
+    {"Country": "norway", "Age": "60-69", "COPD": 1, "Weight": 80},
+    {},
+]
+
+
+def test_round_trip():
+    table = CompactTable(ROWS)
+    assert len(table) == len(ROWS)
+    assert [dict(row) for row in table] == ROWS
+    assert list(table) == ROWS
+
+
+def test_values_keep_their_type():
+    table = CompactTable(ROWS)
+    assert type(table[0]["COPD"]) is bool and type(table[2]["COPD"]) is int
+    assert type(table[0]["Weight"]) is float and type(table[2]["Weight"]) is int
+
+
+def test_missing_keys_and_none_values():
+    table = CompactTable(ROWS)
+    row = table[1]
+    assert "Age" not in row and row.get("Age", "-") == "-"
+    assert "Note" in row and row["Note"] is None
+    assert "Unknown" not in row
+    assert table[-1] == {}
+
+
+def test_columns_are_dictionary_encoded():
+    table = CompactTable(ROWS)
+    assert table.column_names() == ["Country", "Age", "COPD", "Weight", "Note"]
+    assert table.columns["Country"].values[1:] == ["norway", "spain"]
+    assert table.column("Age") == ["60-69", None, "60-69", None]
+    assert table.column("Unknown") == [None] * 4
+
+
+def test_dataset_from_table():
+    table = CompactTable(ROWS)
+    from_table = Dataset.from_table(table)
+    from_rows = Dataset.from_rows(ROWS)
+    for name in table.column_names():
+        assert list(from_table.column(name)) == list(from_rows.column(name))
@@ -0,0 +1,52 @@
+import re
+
+import pytest
+
+from utils.fhir import MAX_ID_LENGTH, Media, Observation, copy_validated, get_patient, qualify_id
+
+
+def observation(resource_id):
+    return Observation(id=resource_id, status="final", code={"text": "test"})
+
+
+def media(url):
+    return Media(id="media", status="completed", content={"url": url})
+
+
+def test_patients_keep_their_id():
+    assert qualify_id(get_patient("site00-p00001", "NOR", "male"), "sn1") == "site00-p00001"
+
+
+def test_ids_are_qualified_by_the_encounter():
+    assert qualify_id(observation("ag-60-69"), "sn1") == "sn1-ag-60-69"
+    assert qualify_id(observation("ag-60-69"), "sn1") != qualify_id(observation("ag-60-69"), "sn2")
+
+
+def test_media_ids_use_the_recording_name():
+    assert qualify_id(media("raw_data/p1/rec/10_31_07_ch1.wav"), "sn1") == "sn1-10-31-07-ch1"
+    assert qualify_id(media("raw_data/p1/rec/10_31_07_ch1.wav"), "sn1") != qualify_id(media("raw_data/p1/rec/10_31_07_ch2.wav"), "sn1")
+
+
+@pytest.mark.parametrize("encounter_id", ["sn1", "s" * 100])
+def test_long_ids_are_valid_and_unique(encounter_id):
+    # Ids which only differ in their tail, beyond the maximum length once qualified
+    ids = [qualify_id(observation(f"{'x' * 58}-{i:03d}"), encounter_id) for i in range(100)]
+    ids += [qualify_id(media(f"rec/{'y' * 80}_ch{i}.wav"), encounter_id) for i in range(100)]
+    assert len(set(ids)) == len(ids)
+    for resource_id in ids:
+        assert len(resource_id) == MAX_ID_LENGTH
+        assert re.fullmatch(r"[A-Za-z0-9\-.]{1,64}", resource_id)
+
+
+def test_id_of_maximum_length_is_kept():
+    resource_id = "x" * (MAX_ID_LENGTH - len("sn1-"))
+    assert qualify_id(observation(resource_id), "sn1") == "sn1-" + resource_id
+
+
+def test_copy_validated_shares_no_models():
+    original = observation("o1")
+    copy = copy_validated(original, {"id": "o2"})
+    assert copy.id == "o2" and original.id == "o1"
+    assert copy.code == original.code and copy.code is not original.code
+    copy.code.text = "changed"
+    assert original.code.text == "test"
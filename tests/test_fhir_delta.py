@@ -0,0 +1,77 @@
+import datetime
+import json
+import os
+
+import pytest
+
+from utils.fhir import get_patient
+from utils.fhir_delta import FHIRDelta
+
+
+def run_time(day):
+    return datetime.datetime(2026, 1, day, tzinfo=datetime.timezone.utc)
+
+
+def export(tmp_path, day, patients):
+    """Run a delta export of patients (id -> country) and return the delta and the written files."""
+    with FHIRDelta(str(tmp_path), str(tmp_path / "fingerprints.json"), run_time(day)) as delta:
+        for patient_id, country in patients.items():
+            delta.add_resource(get_patient(patient_id, country, "male"), "sn1")
+    run_dir = tmp_path / run_time(day).strftime("%Y%m%dT%H%M%SZ")
+    written = {}
+    for name in ("Patient", "deleted"):
+        path = run_dir / f"{name}.ndjson"
+        written[name] = [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+    return delta, written
+
+
+def versions(records):
+    return {record["id"]: record.get("versionId") or record["meta"]["versionId"] for record in records}
+
+
+def test_versions_across_runs(tmp_path):
+    delta, written = export(tmp_path, 1, {"p1": "NOR", "p2": "NOR"})
+    assert delta.stats == {"new": 2, "changed": 0, "unchanged": 0, "deleted": 0}
+    assert versions(written["Patient"]) == {"p1": "1", "p2": "1"}
+    assert written["Patient"][0]["meta"]["lastUpdated"] == "2026-01-01T00:00:00Z"
+
+    # Unchanged, changed and deleted
+    delta, written = export(tmp_path, 2, {"p1": "NOR"})
+    delta, written = export(tmp_path, 3, {"p1": "ESP"})
+    assert delta.stats == {"new": 0, "changed": 1, "unchanged": 0, "deleted": 0}
+    assert versions(written["Patient"]) == {"p1": "2"}
+
+    # A deleted resource is reported once and continues from its last version when added again
+    delta, written = export(tmp_path, 4, {})
+    assert delta.stats["deleted"] == 1 and versions(written["deleted"]) == {"p1": "2"}
+    delta, written = export(tmp_path, 5, {})
+    assert delta.stats["deleted"] == 0 and written["deleted"] == []
+    delta, written = export(tmp_path, 6, {"p1": "ESP", "p2": "NOR"})
+    assert delta.stats == {"new": 2, "changed": 0, "unchanged": 0, "deleted": 0}
+    assert versions(written["Patient"]) == {"p1": "3", "p2": "2"}
+
+
+def test_second_run_unchanged(tmp_path):
+    export(tmp_path, 1, {"p1": "NOR", "p2": "NOR"})
+    delta, written = export(tmp_path, 2, {"p1": "NOR", "p2": "NOR"})
+    assert delta.stats == {"new": 0, "changed": 0, "unchanged": 2, "deleted": 0}
+    assert written == {"Patient": [], "deleted": []}
+
+
+def test_resources_are_exported_once_per_run(tmp_path):
+    with FHIRDelta(str(tmp_path), str(tmp_path / "fingerprints.json"), run_time(1)) as delta:
+        assert delta.add_resource(get_patient("p1", "NOR", "male"), "sn1").meta.versionId == "1"
+        assert delta.add_resource(get_patient("p1", "NOR", "male"), "sn2") is None
+    assert delta.stats["new"] == 1
+
+
+def test_fingerprints_are_kept_on_failure(tmp_path):
+    export(tmp_path, 1, {"p1": "NOR"})
+    fingerprints = (tmp_path / "fingerprints.json").read_text()
+    with pytest.raises(RuntimeError):
+        with FHIRDelta(str(tmp_path), str(tmp_path / "fingerprints.json"), run_time(2)) as delta:
+            delta.add_resource(get_patient("p1", "ESP", "male"), "sn1")
+            raise RuntimeError("export failed")
+    assert delta._files == {}
+    assert (tmp_path / "fingerprints.json").read_text() == fingerprints
+    assert not os.path.exists(tmp_path / "fingerprints.json.tmp")
@@ -0,0 +1,43 @@
+import pytest
+
+from utils.fhir import get_encounter, get_patient, pulse_oximetry_observation
+from utils.fhir_store import FHIRStore
+
+
+def add_encounter(store, patient_id, encounter_id, date):
+    store.add_resource(get_patient(patient_id, "NOR", "male"), encounter_id)
+    store.add_resource(get_encounter(patient_id, "c1", encounter_id, date), encounter_id)
+    store.add_resource(pulse_oximetry_observation(95.0, encounter_id, patient_id), encounter_id)
+
+
+def test_search(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    with FHIRStore(path, batch_size=2) as store:
+        add_encounter(store, "p1", "sn1", "2022-06-01")
+        add_encounter(store, "p1", "sn2", "2022-07-01")
+        add_encounter(store, "p2", "sn3", "2022-07-02")
+
+    with FHIRStore(path) as store:
+        assert len(store) == 8
+        assert store.get("Patient", "p1")["id"] == "p1"
+        observations = store.search("Observation", patient="Patient/p1")
+        assert [observation["id"] for observation in observations] == ["sn1-pulse-oximetry", "sn2-pulse-oximetry"]
+        assert store.count(code=observations[0]["code"]["coding"][0]["code"]) == 3
+        assert store.count(encounter="sn3") == 2
+        assert store.count("Encounter", date_from="2022-07-01", date_to="2022-07-01") == 1
+        assert len(store.search(limit=3)) == 3
+
+
+def test_rolled_back_on_failure(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    with FHIRStore(path) as store:
+        add_encounter(store, "p1", "sn1", "2022-06-01")
+
+    with pytest.raises(RuntimeError):
+        with FHIRStore(path, batch_size=2) as store:
+            add_encounter(store, "p2", "sn2", "2022-06-02")
+            raise RuntimeError("export failed")
+
+    with FHIRStore(path) as store:
+        assert len(store) == 3
+        assert store.get("Patient", "p2") is None
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from scipy.signal import resample_poly
+
+from utils.filters import Resampler, SosFilter, apply_sos, profile_sos, resample
+
+
+def blocks(samples, block_frames):
+    return [samples[start:start + block_frames] for start in range(0, len(samples), block_frames)]
+
+
+@pytest.fixture
+def samples():
+    return np.random.default_rng(0).standard_normal((10007, 2)).astype(np.float32)
+
+
+@pytest.mark.parametrize("sample_rate, target_rate", [(8000, 4000), (44100, 4000), (22050, 16000), (4000, 8000)])
+def test_resample_as_resample_poly(samples, sample_rate, target_rate):
+    resampled = resample(samples, sample_rate, target_rate)
+    assert len(resampled) == -(-len(samples) * target_rate // sample_rate)
+    assert resampled.dtype == np.float32
+    gcd = np.gcd(sample_rate, target_rate)
+    expected = resample_poly(samples, target_rate // gcd, sample_rate // gcd, axis=0)
+    np.testing.assert_allclose(resampled, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("block_frames", [1, 7, 1000, 4096, 20000])
+def test_resampler_block_by_block(samples, block_frames):
+    resampler = Resampler(44100, 4000, channels=2)
+    output = [resampler.process(block) for block in blocks(samples, block_frames)] + [resampler.flush()]
+    np.testing.assert_array_equal(np.concatenate(output), resample(samples, 44100, 4000))
+
+
+def test_resampler_is_reset_by_flush(samples):
+    resampler = Resampler(8000, 4000, channels=2)
+    first = np.concatenate([resampler.process(samples), resampler.flush()])
+    second = np.concatenate([resampler.process(samples), resampler.flush()])
+    np.testing.assert_array_equal(first, second)
+
+
+def test_invalid_rates():
+    with pytest.raises(ValueError):
+        Resampler(0, 4000)
+
+
+@pytest.mark.parametrize("block_frames", [1, 7, 1000, 4096, 20000])
+def test_sos_filter_block_by_block(samples, block_frames):
+    sos = profile_sos("default", 8000)
+    sos_filter = SosFilter(sos, channels=2)
+    output = np.concatenate([sos_filter.process(block) for block in blocks(samples, block_frames)])
+    np.testing.assert_array_equal(output, apply_sos(sos, samples))
+
+
+def test_filter_and_resample_block_by_block(samples):
+    sos = profile_sos("lung", 44100)
+    sos_filter, resampler = SosFilter(sos, channels=2), Resampler(44100, 8000, channels=2)
+    output = [resampler.process(sos_filter.process(block)) for block in blocks(samples, 1000)] + [resampler.flush()]
+    np.testing.assert_array_equal(np.concatenate(output), resample(apply_sos(sos, samples), 44100, 8000))
+
+
+def test_profile_sos():
+    with pytest.raises(ValueError):
+        profile_sos("unknown", 8000)
+    with pytest.raises(ValueError):
+        profile_sos("lung", 4000)
@@ -0,0 +1,36 @@
+import pytest
+
+from export_to_fhir import get_observations
+from utils.observations import build_observations
+from utils.query import Dataset
+
+
+ROWS = [
+    {"PatientIdentifier": "p1", "SerialNumber": "sn1", "Age": "60-69", "Diastolic": "80", "Systolic": "120",
+     "BodyTemperature": "36.6", "PulseOximetry": "95", "Weight": "80.5"},
+    {"PatientIdentifier": "p2", "SerialNumber": "sn2", "Systolic": "120", "Weight": "approx. 80 kg",
+     "RespiratoryRate30Sec": "9", "RespiratoryRateInOneMinute": "", "Spirometry": "71.5"},
+    {"PatientIdentifier": "p3", "SerialNumber": "sn3"},
+]
+
+
+def test_same_resources_as_per_row():
+    observations = build_observations(Dataset.from_rows(ROWS))
+    for row, row_observations in zip(ROWS, observations):
+        expected = get_observations(row, row["PatientIdentifier"], row["SerialNumber"])
+        assert [observation.json() for observation in row_observations] == [observation.json() for observation in expected]
+    assert [len(row_observations) for row_observations in observations] == [6, 3, 0]
+
+
+def test_observations_share_no_models():
+    first, second, _ = build_observations(Dataset.from_rows(ROWS))
+    assert first[2].valueQuantity == second[0].valueQuantity
+    assert first[2].valueQuantity is not second[0].valueQuantity
+    assert first[2].code is not second[0].code
+    first[2].subject.reference = "Patient/changed"
+    assert second[0].subject.reference == "Patient/p2"
+
+
+def test_invalid_values():
+    with pytest.raises(ValueError):
+        build_observations(Dataset.from_rows([{"PatientIdentifier": "p1", "SerialNumber": "sn1", "Systolic": "high"}]))
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from utils.query import Dataset, parse_float_column
+
+
+ROWS = [
+    {"PatientIdentifier": "p1", "Country": "norway", "SpO2": "95", "COPD": True},
+    {"PatientIdentifier": "p2", "Country": "spain", "SpO2": "not measured"},
+    {"PatientIdentifier": "p3", "SpO2": None, "COPD": True},
+    {"PatientIdentifier": "p4", "Country": "norway", "SpO2": "88", "COPD": False},
+]
+
+
+@pytest.fixture
+def dataset():
+    return Dataset.from_rows(ROWS)
+
+
+def matches(dataset, **conditions):
+    return list(dataset.column("PatientIdentifier")[dataset.mask(**conditions)])
+
+
+def test_parse_float_column():
+    parsed, failed = parse_float_column(["1.5", None, "x", "2"])
+    np.testing.assert_array_equal(parsed, [1.5, np.nan, np.nan, 2.0])
+    np.testing.assert_array_equal(failed, [False, False, True, False])
+
+
+@pytest.mark.parametrize("op, operand, expected", [
+    ("<", 92, ["p4"]),
+    ("<=", 95, ["p1", "p4"]),
+    (">", 90, ["p1"]),
+    (">=", 88, ["p1", "p4"]),
+    ("==", 95, ["p1"]),
+    ("!=", 95, ["p4"]),
+])
+def test_numeric_conditions_never_match_missing_values(dataset, op, operand, expected):
+    assert matches(dataset, SpO2=(op, operand)) == expected
+
+
+def test_string_conditions_skip_missing_values(dataset):
+    assert matches(dataset, Country=("!=", "norway")) == ["p2"]
+    assert matches(dataset, Country=(">=", "o")) == ["p2"]
+
+
+def test_equality_on_indexed_column(dataset):
+    assert matches(dataset, Country="norway") == ["p1", "p4"]
+    assert matches(dataset, COPD=True) == ["p1", "p3"]
+    assert matches(dataset, COPD=None) == ["p2"]
+
+
+def test_conditions_on_missing_column(dataset):
+    assert matches(dataset, Unknown=("<", 1)) == []
+    assert matches(dataset, Unknown=("!=", "x")) == []
+
+
+def test_in_condition(dataset):
+    assert matches(dataset, Country=("in", ["spain", None])) == ["p2", "p3"]
+
+
+def test_combined_conditions(dataset):
+    assert matches(dataset, COPD=True, Country="norway", SpO2=(">", 90)) == ["p1"]
+
+
+def test_unknown_operator(dataset):
+    with pytest.raises(ValueError):
+        dataset.mask(SpO2=("~", 1))
+
+
+def test_filter_and_group_by(dataset):
+    norway = dataset.filter(Country="norway")
+    assert len(norway) == 2
+    assert list(norway.rows()) == [ROWS[0], ROWS[3]]
+    assert {value: len(group) for value, group in dataset.group_by("COPD").items()} == {True: 2, None: 1, False: 1}
+    assert dataset.value_counts("Country") == {"norway": 2, "spain": 1, None: 1}
@@ -0,0 +1,60 @@
+import pytest
+
+from utils.questionnaires import QUESTIONNAIRES, QuestionnaireBuilder, build_questionnaire_responses
+
+
+ROW = {
+    "DailyMedication": "none",
+    "SmokingHabit": 1,
+    "DailyCough": True,
+    "CigarettesPerDay": 10,
+    "COPD": True,
+    "Hypertension": False,
+    "HeartDisease": "",
+    "Coughing": 0,
+}
+
+
+def sub_models(model):
+    """All models nested in a model."""
+    models = []
+    for name in model.__fields_set__:
+        value = getattr(model, name)
+        for item in value if isinstance(value, list) else [value]:
+            if hasattr(item, "__fields_set__"):
+                models += [item] + sub_models(item)
+    return models
+
+
+def test_responses():
+    responses = build_questionnaire_responses(ROW, "p1", "sn1", "c1")
+    assert [response.id for response in responses] == list(QUESTIONNAIRES)
+    history, background, change, condition = responses
+
+    assert history.subject.reference == "Patient/p1" and history.encounter.reference == "Encounter/sn1"
+    assert history.author.reference == "Practitioner/c1" and history.source.reference == "Patient/p1"
+    assert [item.linkId for item in history.item] == ["ph-daily-medication", "ph-smoking", "ph-daily-cough", "cigarettes-per-day"]
+    assert history.item[1].answer[0].valueCoding.code == "ph-smoking-1"
+    assert history.item[3].answer[0].valueInteger == 10
+    # Falsy flags and empty strings have no answer, items without answers are left out
+    assert [[answer.valueCoding.code for answer in item.answer] for item in background.item] == [["bd-lung-copd"]]
+    assert not change.item
+    assert [item.answer[0].valueCoding.code for item in condition.item] == ["cc-coughing-0"]
+
+
+def test_responses_share_no_models():
+    first = build_questionnaire_responses(ROW, "p1", "sn1", "c1")
+    second = build_questionnaire_responses(ROW, "p2", "sn2", "c1")
+    assert [response.item for response in first] == [response.item for response in second]
+
+    models = [model for response in first + second for model in [response] + sub_models(response)]
+    assert len({id(model) for model in models}) == len(models)
+
+    first[0].item[1].answer[0].valueCoding.code = "changed"
+    assert second[0].item[1].answer[0].valueCoding.code == "ph-smoking-1"
+    assert build_questionnaire_responses(ROW, "p3", "sn3", "c1")[0].item[1].answer[0].valueCoding.code == "ph-smoking-1"
+
+
+def test_unknown_answer_type():
+    with pytest.raises(ValueError):
+        QuestionnaireBuilder("test", [{"linkId": "1", "text": "Test", "answers": [("date", "RecordDate")]}])